@@ -0,0 +1,44 @@
+"""resumen_diario_sucursal
+
+Revision ID: 0e6b93d4a1f7
+Revises: c41d7a2e8f13
+Create Date: 2026-10-17 12:40:55.918227
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0e6b93d4a1f7'
+down_revision: Union[str, Sequence[str], None] = 'c41d7a2e8f13'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('daily_location_summary',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('location_id', sa.Integer(), nullable=False),
+    sa.Column('summary_date', sa.Date(), nullable=False),
+    sa.Column('sales_total', sa.Float(), nullable=False, server_default='0'),
+    sa.Column('expenses_total', sa.Float(), nullable=False, server_default='0'),
+    sa.Column('work_order_counts', postgresql.JSON(astext_type=sa.Text()), nullable=True),
+    sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.ForeignKeyConstraint(['location_id'], ['locations.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('location_id', 'summary_date', name='_daily_summary_location_date_uc')
+    )
+    op.create_index(op.f('ix_daily_location_summary_id'), 'daily_location_summary', ['id'], unique=False)
+    # El backfill lo hace: python -m app.rebuild_daily_summary
+    # (usa la zona horaria TZ del servidor, igual que el dashboard)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_daily_location_summary_id'), table_name='daily_location_summary')
+    op.drop_table('daily_location_summary')
@@ -0,0 +1,64 @@
+"""busqueda_productos_trigram
+
+Revision ID: 227f385a5a1b
+Revises: 81258462056b
+Create Date: 2026-10-17 09:12:44.512301
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '227f385a5a1b'
+down_revision: Union[str, Sequence[str], None] = '81258462056b'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # 1. Extensiones: pg_trgm (índices trigram) y unaccent (quitar tildes)
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    op.execute("CREATE EXTENSION IF NOT EXISTS unaccent")
+
+    # 2. Columna con el documento de búsqueda
+    op.add_column('products', sa.Column('search_document', sa.String(), nullable=True))
+
+    # 3. Trigger que mantiene el documento (MAYÚSCULAS y sin tildes, igual que normalize_text)
+    op.execute("""
+        CREATE OR REPLACE FUNCTION products_search_document_refresh() RETURNS trigger AS $$
+        BEGIN
+            NEW.search_document := upper(unaccent(concat_ws(' ',
+                NEW.sku, NEW.name, NEW.product_type, NEW.brand, NEW.model, NEW.description
+            )));
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql;
+    """)
+    op.execute("""
+        CREATE TRIGGER trg_products_search_document
+        BEFORE INSERT OR UPDATE OF sku, name, product_type, brand, model, description
+        ON products
+        FOR EACH ROW EXECUTE FUNCTION products_search_document_refresh();
+    """)
+
+    # 4. Rellenar los productos existentes (el trigger hace el cálculo)
+    op.execute("UPDATE products SET name = name")
+
+    # 5. Índice GIN trigram para LIKE '%...%' y similarity()
+    op.execute(
+        "CREATE INDEX ix_products_search_document_trgm "
+        "ON products USING gin (search_document gin_trgm_ops)"
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("DROP INDEX IF EXISTS ix_products_search_document_trgm")
+    op.execute("DROP TRIGGER IF EXISTS trg_products_search_document ON products")
+    op.execute("DROP FUNCTION IF EXISTS products_search_document_refresh()")
+    op.drop_column('products', 'search_document')
+    # Las extensiones se dejan instaladas (pueden usarlas otras tablas)
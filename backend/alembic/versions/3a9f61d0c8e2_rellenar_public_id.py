@@ -0,0 +1,58 @@
+"""rellenar_public_id
+
+Revision ID: 3a9f61d0c8e2
+Revises: e85a40c7d29b
+Create Date: 2026-10-17 16:03:27.584410
+
+"""
+import uuid
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3a9f61d0c8e2'
+down_revision: Union[str, Sequence[str], None] = 'e85a40c7d29b'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BATCH_SIZE = 5000
+TABLES = ['sales', 'work_orders']
+
+
+def _backfill(conn, table: str):
+    """Asigna un UUID a cada fila sin public_id, por lotes, mostrando el avance."""
+    total = conn.execute(sa.text(f"SELECT COUNT(*) FROM {table} WHERE public_id IS NULL")).scalar()
+    if not total:
+        return
+    done = 0
+    while True:
+        ids = [row[0] for row in conn.execute(
+            sa.text(f"SELECT id FROM {table} WHERE public_id IS NULL ORDER BY id LIMIT :n"),
+            {"n": BATCH_SIZE}
+        )]
+        if not ids:
+            break
+        conn.execute(
+            sa.text(f"UPDATE {table} SET public_id = :public_id WHERE id = :id"),
+            [{"id": row_id, "public_id": str(uuid.uuid4())} for row_id in ids]
+        )
+        done += len(ids)
+        print(f"   {table}: {done}/{total} public_id asignados")
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    conn = op.get_bind()
+    for table in TABLES:
+        _backfill(conn, table)
+        # Ya no puede quedar ninguna fila sin código público
+        op.alter_column(table, 'public_id', existing_type=sa.String(), nullable=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for table in TABLES:
+        op.alter_column(table, 'public_id', existing_type=sa.String(), nullable=True)
@@ -0,0 +1,37 @@
+"""variantes_webp_imagenes
+
+Revision ID: 5b0e1f7c9d24
+Revises: aa38bd953b58
+Create Date: 2026-10-17 11:02:41.337905
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5b0e1f7c9d24'
+down_revision: Union[str, Sequence[str], None] = 'aa38bd953b58'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    for table in ('product_images', 'work_order_images'):
+        op.add_column(table, sa.Column('thumbnail_url', sa.String(), nullable=True))
+        op.add_column(table, sa.Column('medium_url', sa.String(), nullable=True))
+        op.add_column(table, sa.Column('content_hash', sa.String(), nullable=True))
+        op.create_index(op.f(f'ix_{table}_content_hash'), table, ['content_hash'], unique=False)
+    # Las fotos antiguas quedan sin variantes: el frontend usa image_url como respaldo
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for table in ('work_order_images', 'product_images'):
+        op.drop_index(op.f(f'ix_{table}_content_hash'), table_name=table)
+        op.drop_column(table, 'content_hash')
+        op.drop_column(table, 'medium_url')
+        op.drop_column(table, 'thumbnail_url')
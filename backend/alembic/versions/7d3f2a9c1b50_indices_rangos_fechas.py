@@ -0,0 +1,44 @@
+"""indices_rangos_fechas
+
+Revision ID: 7d3f2a9c1b50
+Revises: 0e6b93d4a1f7
+Create Date: 2026-10-17 14:05:12.301846
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7d3f2a9c1b50'
+down_revision: Union[str, Sequence[str], None] = '0e6b93d4a1f7'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# (nombre, tabla, columnas)
+INDEXES = [
+    ('ix_sales_company_created_at', 'sales', ['company_id', 'created_at']),
+    ('ix_sales_location_created_at', 'sales', ['location_id', 'created_at']),
+    ('ix_inventory_movements_timestamp', 'inventory_movements', ['timestamp']),
+    ('ix_inventory_movements_user_timestamp', 'inventory_movements', ['user_id', 'timestamp']),
+    ('ix_shifts_user_start_time', 'shifts', ['user_id', 'start_time']),
+    ('ix_shifts_location_start_time', 'shifts', ['location_id', 'start_time']),
+    ('ix_cash_transactions_account_timestamp', 'cash_transactions', ['account_id', 'timestamp']),
+    ('ix_expenses_company_expense_date', 'expenses', ['company_id', 'expense_date']),
+    ('ix_expenses_location_expense_date', 'expenses', ['location_id', 'expense_date']),
+]
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    for name, table, columns in INDEXES:
+        op.create_index(name, table, columns, unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for name, table, columns in reversed(INDEXES):
+        op.drop_index(name, table_name=table)
@@ -0,0 +1,50 @@
+"""crear_cola_facturacion_sri
+
+Revision ID: aa38bd953b58
+Revises: 227f385a5a1b
+Create Date: 2026-10-17 10:03:18.204417
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'aa38bd953b58'
+down_revision: Union[str, Sequence[str], None] = '227f385a5a1b'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('sri_invoice_jobs',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('sale_id', sa.Integer(), nullable=False),
+    sa.Column('company_id', sa.Integer(), nullable=True),
+    sa.Column('status', sa.String(), nullable=False, server_default='PENDIENTE'),
+    sa.Column('attempts', sa.Integer(), nullable=False, server_default='0'),
+    sa.Column('next_attempt_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.Column('locked_at', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('last_error', sa.String(), nullable=True),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.ForeignKeyConstraint(['company_id'], ['companies.id'], ),
+    sa.ForeignKeyConstraint(['sale_id'], ['sales.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('sale_id')
+    )
+    op.create_index(op.f('ix_sri_invoice_jobs_id'), 'sri_invoice_jobs', ['id'], unique=False)
+    op.create_index(op.f('ix_sri_invoice_jobs_company_id'), 'sri_invoice_jobs', ['company_id'], unique=False)
+    # Índice para que los workers encuentren rápido lo pendiente
+    op.create_index('ix_sri_invoice_jobs_status_next_attempt', 'sri_invoice_jobs', ['status', 'next_attempt_at'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_sri_invoice_jobs_status_next_attempt', table_name='sri_invoice_jobs')
+    op.drop_index(op.f('ix_sri_invoice_jobs_company_id'), table_name='sri_invoice_jobs')
+    op.drop_index(op.f('ix_sri_invoice_jobs_id'), table_name='sri_invoice_jobs')
+    op.drop_table('sri_invoice_jobs')
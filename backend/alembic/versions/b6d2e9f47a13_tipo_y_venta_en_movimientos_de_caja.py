@@ -0,0 +1,71 @@
+"""tipo_y_venta_en_movimientos_de_caja
+
+Revision ID: b6d2e9f47a13
+Revises: 3a9f61d0c8e2
+Create Date: 2026-10-17 17:41:09.652318
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b6d2e9f47a13'
+down_revision: Union[str, Sequence[str], None] = '3a9f61d0c8e2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# Mismas reglas que usaba el reporte de cierre leyendo la descripción
+BACKFILL_TYPES = [
+    ("CIERRE", "description ILIKE 'CIERRE DE CAJA%'"),
+    ("VENTA", "amount > 0 AND (description LIKE '%Venta #%' OR description LIKE '%Ingreso Venta%')"),
+    ("DEVOLUCION", "description LIKE 'DEVOLUCIÓN EFECTIVO VENTA #%'"),
+    ("GASTO", "description LIKE 'GASTO #%'"),
+]
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('cash_transactions', sa.Column('transaction_type', sa.String(), nullable=False, server_default='MANUAL'))
+    op.add_column('cash_transactions', sa.Column('sale_id', sa.Integer(), nullable=True))
+
+    conn = op.get_bind()
+    for transaction_type, condition in BACKFILL_TYPES:
+        updated = conn.execute(sa.text(
+            f"UPDATE cash_transactions SET transaction_type = :type "
+            f"WHERE transaction_type = 'MANUAL' AND {condition}"
+        ), {"type": transaction_type}).rowcount
+        print(f"   {transaction_type}: {updated} movimientos")
+
+    # "Ingreso Venta #15 (Efectivo)" / "DEVOLUCIÓN EFECTIVO VENTA #15: ..." -> sale_id = 15 (si la venta existe)
+    linked = conn.execute(sa.text("""
+        UPDATE cash_transactions t
+        SET sale_id = s.id
+        FROM sales s
+        WHERE t.transaction_type IN ('VENTA', 'DEVOLUCION')
+          AND t.description ~* 'VENTA #[0-9]+'
+          AND s.id = substring(t.description FROM '(?i)VENTA #([0-9]+)')::int
+    """)).rowcount
+    print(f"   Movimientos enlazados a su venta: {linked}")
+
+    op.create_foreign_key(
+        'fk_cash_transactions_sale_id', 'cash_transactions', 'sales',
+        ['sale_id'], ['id'], ondelete='SET NULL'
+    )
+    op.create_index('ix_cash_transactions_sale_id', 'cash_transactions', ['sale_id'], unique=False)
+    op.create_index(
+        'ix_cash_transactions_account_type_timestamp', 'cash_transactions',
+        ['account_id', 'transaction_type', 'timestamp'], unique=False
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_cash_transactions_account_type_timestamp', table_name='cash_transactions')
+    op.drop_index('ix_cash_transactions_sale_id', table_name='cash_transactions')
+    op.drop_constraint('fk_cash_transactions_sale_id', 'cash_transactions', type_='foreignkey')
+    op.drop_column('cash_transactions', 'sale_id')
+    op.drop_column('cash_transactions', 'transaction_type')
@@ -0,0 +1,31 @@
+"""estado_procesamiento_imagenes
+
+Revision ID: c41d7a2e8f13
+Revises: 5b0e1f7c9d24
+Create Date: 2026-10-17 11:48:09.612874
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c41d7a2e8f13'
+down_revision: Union[str, Sequence[str], None] = '5b0e1f7c9d24'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Las fotos existentes ya están en disco: quedan como LISTA
+    op.add_column('product_images', sa.Column('status', sa.String(), nullable=False, server_default='LISTA'))
+    op.add_column('work_order_images', sa.Column('status', sa.String(), nullable=False, server_default='LISTA'))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('work_order_images', 'status')
+    op.drop_column('product_images', 'status')
@@ -0,0 +1,40 @@
+"""indices_paginacion_cursor
+
+Revision ID: e85a40c7d29b
+Revises: 7d3f2a9c1b50
+Create Date: 2026-10-17 15:22:40.117392
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e85a40c7d29b'
+down_revision: Union[str, Sequence[str], None] = '7d3f2a9c1b50'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# (nombre, tabla, columnas) -> mismo orden que crud.*_PAGE_ORDER
+INDEXES = [
+    ('ix_sales_created_at_id', 'sales', ['created_at', 'id']),
+    ('ix_work_orders_created_at_id', 'work_orders', ['created_at', 'id']),
+    ('ix_work_orders_location_created_at_id', 'work_orders', ['location_id', 'created_at', 'id']),
+    ('ix_customers_company_name_id', 'customers', ['company_id', 'name', 'id']),
+    ('ix_transfers_company_created_at_id', 'transfers', ['company_id', 'created_at', 'id']),
+]
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    for name, table, columns in INDEXES:
+        op.create_index(name, table, columns, unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for name, table, columns in reversed(INDEXES):
+        op.drop_index(name, table_name=table)
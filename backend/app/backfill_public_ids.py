@@ -0,0 +1,25 @@
+# backend/app/backfill_public_ids.py
+# Rellena el public_id (enlace público del PDF) de ventas y órdenes antiguas.
+# La migración de alembic hace lo mismo; este job sirve para correrlo ANTES
+# en bases grandes (hace commit por lote y se puede cortar y repetir).
+# Uso:
+#   python -m app.backfill_public_ids
+from app import crud, database, models
+
+def backfill():
+    db = database.SessionLocal()
+    try:
+        print("--- RELLENANDO PUBLIC_ID FALTANTES ---")
+        for label, model in (("Ventas", models.Sale), ("Órdenes de trabajo", models.WorkOrder)):
+            def report(done, total, label=label):
+                print(f"   {label}: {done}/{total}")
+            filled = crud.backfill_public_ids(db, model, progress=report)
+            print(f"✅ {label}: {filled} registros actualizados.")
+    except Exception as e:
+        print(f"❌ Error rellenando public_id: {e}")
+        db.rollback()
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    backfill()
@@ -1,26 +1,30 @@
 
-from collections import defaultdict
+from collections import defaultdict, namedtuple
 from decimal import Decimal, ROUND_HALF_UP
-from sqlalchemy.sql import func, and_, case, literal_column, or_, text, cast
-from sqlalchemy import String # Importamos String para el cast
+from sqlalchemy.sql import func, and_, case, literal_column, or_, text, cast, false
+from sqlalchemy import String, Float # Importamos String para el cast
 from sqlalchemy.orm import Session, joinedload, outerjoin, selectinload
+from sqlalchemy.dialects.postgresql import insert as pg_insert, aggregate_order_by
 from datetime import date, datetime # Añadimos datetime
 import pytz # Añadimos pytz para la zona horaria
 from decimal import Decimal
 from app.utils.money import money, calc_tax, calc_total
+from app.utils.cursor import apply_keyset
 
 import os
 import shutil
 import os
 import random
 import string
+import threading
+import time
 
 import smtplib # <--- El cartero
 from email.mime.text import MIMEText # <--- El papel de la carta
 from email.mime.multipart import MIMEMultipart # <--- El sobre
 from datetime import timedelta # <--- Para calcular fecha de expiración
 
-from . import models, schemas, security, sri_utils # <--- AÑADIDO: sri_utils
+from . import models, schemas, security, sri_utils, media_service, pdf_utils # <--- AÑADIDO: sri_utils
 from fastapi import HTTPException # <--- NUEVO: Para enviar mensajes de error claros
 
 # --- HELPER DE CÁLCULO DE TOTALES (VENTA) ---
@@ -37,6 +41,49 @@ def _compute_sale_totals(items: list[dict], iva_percentage: float) -> tuple[floa
     total_amount = round(subtotal + tax_amount, 2)
     return subtotal, tax_amount, total_amount
 
+# --- HELPERS DE FECHAS (DÍAS LOCALES DEL NEGOCIO) ---
+# Los reportes piden días de Ecuador, pero en la BD las horas se guardan en UTC.
+# En vez de filtrar con func.date(columna) (que obliga a revisar TODAS las filas
+# porque no puede usar índices), convertimos el rango de días a un rango UTC
+# semiabierto [inicio, fin) y comparamos la columna tal cual.
+
+def _app_timezone():
+    # BLINDAJE: Si os.getenv devuelve cadena vacía, forzamos el default
+    return os.getenv("TZ") or "America/Guayaquil"
+
+def _local_date(dt: datetime | None = None) -> date:
+    """Fecha local del negocio (hoy, o la de 'dt' si viene con zona horaria)."""
+    tz = pytz.timezone(_app_timezone())
+    if dt is None:
+        return datetime.now(tz).date()
+    if dt.tzinfo is None:
+        dt = pytz.utc.localize(dt)
+    return dt.astimezone(tz).date()
+
+def _local_midnight_utc(day: date) -> datetime:
+    """00:00 hora local de 'day', expresada en UTC."""
+    tz = pytz.timezone(_app_timezone())
+    return tz.localize(datetime.combine(day, datetime.min.time())).astimezone(pytz.utc)
+
+def local_day_range(start_date: date | None = None, end_date: date | None = None) -> tuple[datetime | None, datetime | None]:
+    """
+    Días locales (ambos inclusive) -> (desde, hasta) en UTC, con 'hasta' EXCLUSIVO.
+    Ej: 2025-10-31..2025-10-31 -> [2025-10-31 05:00 UTC, 2025-11-01 05:00 UTC)
+    """
+    start_utc = _local_midnight_utc(start_date) if start_date else None
+    end_utc = _local_midnight_utc(end_date + timedelta(days=1)) if end_date else None
+    return start_utc, end_utc
+
+def date_range_filter(column, start_date: date | None = None, end_date: date | None = None) -> list:
+    """Condiciones listas para query.filter(*...). Sin fechas devuelve [] (no filtra)."""
+    start_utc, end_utc = local_day_range(start_date, end_date)
+    conditions = []
+    if start_utc is not None:
+        conditions.append(column >= start_utc)
+    if end_utc is not None:
+        conditions.append(column < end_utc)
+    return conditions
+
 # ===================================================================
 # --- CATEGORÍAS ---
 # ===================================================================
@@ -61,14 +108,22 @@ def create_category(db: Session, category: schemas.CategoryCreate, company_id: i
 def get_product(db: Session, product_id: int):
     return db.query(models.Product).options(joinedload(models.Product.category), joinedload(models.Product.supplier), joinedload(models.Product.images)).filter(models.Product.id == product_id).first()
 
+# Columnas del producto que se proyectan directo a la respuesta (schemas.Product)
+_PRODUCT_LIST_COLUMNS = (
+    "id", "sku", "name", "description",
+    "product_type", "brand", "model", "color", "compatibility", "condition",
+    "price_1", "price_2", "price_3", "average_cost", "is_active", "is_public",
+    "category_id", "supplier_id",
+)
+
 def get_products(db: Session, company_id: int, skip: int = 0, limit: int = 100, search: str | None = None, location_id: int | None = None):
-    # --- Parte 1: Encontrar los productos que coinciden y su stock local ---
-    base_query = db.query(
-        models.Product,
-        models.Category.name.label("category_name")
-    ).outerjoin(models.Category, models.Product.category_id == models.Category.id)\
-     .filter(models.Product.company_id == company_id)\
-     .options(joinedload(models.Product.images), joinedload(models.Product.supplier)) # Cargar imágenes y proveedor
+    """
+    Listado de productos en UNA sola consulta.
+    Stock local, stock en otras bodegas (de la misma empresa), imágenes,
+    categoría y proveedor vienen agregados en la misma fila (json_agg),
+    sin cargar objetos ORM completos.
+    """
+    # --- Parte 1: ¿Cuál es la bodega "local"? ---
     current_bodega_id = None
     if location_id:
         # 1. Intentamos buscar la "Bodega Hija" (Sub-ubicación)
@@ -77,106 +132,114 @@ def get_products(db: Session, company_id: int, skip: int = 0, limit: int = 100,
         # 2. Si no hay hija, revisamos si la ubicación actual YA ES una bodega
         if not bodega:
             # Opción A: Es una bodega central o ubicación plana
-            current_loc = get_location(db, location_id=location_id)
-            if current_loc:
-                bodega = current_loc
+            bodega = get_location_info(db, location_id=location_id)
 
         if bodega:
             current_bodega_id = bodega.id
-            # Añadir columna de stock local
-            base_query = base_query.add_columns(
-                func.coalesce(models.Stock.quantity, 0).label("stock_quantity")
-            ).outerjoin(
-                models.Stock,
-                (models.Product.id == models.Stock.product_id) & (models.Stock.location_id == current_bodega_id)
-            )
-        else:
-             # Si no encontramos NINGUNA ubicación válida para stock, mostramos 0
-             base_query = base_query.add_columns(
-                 literal_column("0").label("stock_quantity")
-             )
-    else:
-         # Si no se especifica ubicación, añadir columna como 0
-         base_query = base_query.add_columns(
-             literal_column("0").label("stock_quantity")
-         )
 
+    # --- Parte 2: Sub-consultas correlacionadas (se resuelven dentro del mismo SELECT) ---
+    P = models.Product
+
+    # Stock local (0 si no hay bodega o no hay registro)
+    if current_bodega_id:
+        local_stock_sq = db.query(models.Stock.quantity)\
+            .filter(models.Stock.product_id == P.id, models.Stock.location_id == current_bodega_id)\
+            .correlate(P).scalar_subquery()
+        local_stock_col = func.coalesce(local_stock_sq, 0).label("stock_quantity")
+    else:
+        local_stock_col = literal_column("0").label("stock_quantity")
+
+    # Stock en OTRAS bodegas de MI empresa (solo si hay stock)
+    other_stock_filters = [
+        models.Stock.product_id == P.id,
+        models.Location.parent_id != None,
+        models.Location.company_id == company_id,
+        models.Stock.quantity > 0,
+    ]
+    if current_bodega_id:
+        other_stock_filters.append(models.Location.id != current_bodega_id)
+    other_stock_sq = db.query(
+        func.coalesce(
+            func.json_agg(func.json_build_object(
+                "location_name", models.Location.name,
+                "quantity", models.Stock.quantity,
+            )),
+            literal_column("'[]'::json"),
+        )
+    ).select_from(models.Stock)\
+     .join(models.Location, models.Stock.location_id == models.Location.id)\
+     .filter(*other_stock_filters)\
+     .correlate(P).scalar_subquery()
+
+    # Imágenes del producto
+    images_sq = db.query(
+        func.coalesce(
+            func.json_agg(func.json_build_object(
+                "id", models.ProductImage.id,
+                "image_url", models.ProductImage.image_url,
+                "thumbnail_url", models.ProductImage.thumbnail_url,
+                "medium_url", models.ProductImage.medium_url,
+                "status", models.ProductImage.status,
+                "product_id", models.ProductImage.product_id,
+            )),
+            literal_column("'[]'::json"),
+        )
+    ).filter(models.ProductImage.product_id == P.id)\
+     .correlate(P).scalar_subquery()
+
+    query = db.query(
+        *[getattr(P, col) for col in _PRODUCT_LIST_COLUMNS],
+        models.Category.name.label("category_name"),
+        models.Category.description.label("category_description"),
+        models.Supplier.name.label("supplier_name"),
+        models.Supplier.contact_person.label("supplier_contact_person"),
+        models.Supplier.email.label("supplier_email"),
+        models.Supplier.phone.label("supplier_phone"),
+        local_stock_col,
+        other_stock_sq.label("other_locations_stock"),
+        images_sq.label("images"),
+    ).outerjoin(models.Category, P.category_id == models.Category.id)\
+     .outerjoin(models.Supplier, P.supplier_id == models.Supplier.id)\
+     .filter(P.company_id == company_id)
 
     # Aplicar filtro de búsqueda si existe
+    # El documento de búsqueda ya viene en MAYÚSCULAS y sin tildes (trigger en BD),
+    # así que normalizamos el texto del usuario igual y cada palabra debe aparecer.
+    # El índice GIN trigram resuelve los LIKE '%...%' sin recorrer toda la tabla.
+    order_clauses = [P.name]
     if search:
-        search_term = f"%{search.lower()}%"
-        base_query = base_query.filter(
-            or_(
-                func.lower(models.Product.name).like(search_term),
-                func.lower(models.Product.sku).like(search_term),
-                func.lower(models.Product.product_type).like(search_term), # Buscar por Tipo (Pantalla, Cable...)
-                func.lower(models.Product.brand).like(search_term), 
-                func.lower(models.Product.model).like(search_term), 
-                func.lower(models.Product.description).like(search_term)
+        from .import_service import normalize_text  # Import local para evitar import circular
+        normalized_search = normalize_text(search)
+        terms = normalized_search.split()
+        if terms:
+            query = query.filter(
+                and_(*[P.search_document.like(f"%{term}%") for term in terms])
             )
-        )
+            # Ranking: primero los más parecidos a lo que se escribió
+            order_clauses = [func.similarity(P.search_document, normalized_search).desc(), P.name]
 
-    # Ejecutar la primera consulta para obtener los productos y stock local
-    initial_results = base_query.order_by(models.Product.name).offset(skip).limit(limit).all()
+    rows = query.order_by(*order_clauses).offset(skip).limit(limit).all()
 
-    # Si no hay resultados, terminar aquí
-    if not initial_results:
-        return []
-
-    # Extraer los IDs de los productos encontrados
-    product_ids_found = [row.Product.id for row in initial_results]
-
-    # --- Parte 2: Buscar stock en OTRAS bodegas para esos productos ---
-    other_stock_data = defaultdict(list) # Usaremos un diccionario para agrupar
-    if product_ids_found:
-        # Encontrar IDs de todas las bodegas (excepto la actual si existe)
-        other_bodegas_query = db.query(models.Location.id, models.Location.name).filter(models.Location.parent_id != None)
-        if current_bodega_id:
-            other_bodegas_query = other_bodegas_query.filter(models.Location.id != current_bodega_id)
-
-        other_bodegas = other_bodegas_query.all()
-        other_bodega_ids = [bodega.id for bodega in other_bodegas]
-        other_bodega_names = {bodega.id: bodega.name for bodega in other_bodegas} # Mapa ID -> Nombre
-
-
-        if other_bodega_ids:
-            # Consultar stock en esas otras bodegas para los productos encontrados
-            stock_in_others = db.query(
-                models.Stock.product_id,
-                models.Stock.location_id,
-                models.Stock.quantity
-            ).filter(
-                models.Stock.product_id.in_(product_ids_found),
-                models.Stock.location_id.in_(other_bodega_ids),
-                models.Stock.quantity > 0 # Solo mostrar si hay stock
-            ).all()
-
-            # Agrupar los resultados por product_id
-            for stock_entry in stock_in_others:
-                location_name = other_bodega_names.get(stock_entry.location_id, "Desconocida")
-                other_stock_data[stock_entry.product_id].append(
-                    schemas.StockLocationInfo(
-                        location_name=location_name,
-                        quantity=stock_entry.quantity
-                    )
-                )
-
-    # --- Parte 3: Combinar todo y devolver ---
+    # --- Parte 3: Armar las filas de respuesta (dicts planos, FastAPI valida con response_model) ---
     products_list = []
-    for row in initial_results:
-        product_data = row.Product.__dict__
-        product_data['images'] = row.Product.images # Adjuntar imágenes
-        product_data['category'] = schemas.Category(id=row.Product.category_id, name=row.category_name) if row.Product.category_id else None
-        product_data['supplier'] = row.Product.supplier # Adjuntar proveedor
-
-        # Añadir stock local (ya viene en 'row')
-        product_data['stock_quantity'] = row.stock_quantity if row.stock_quantity is not None else 0
-
-        # Añadir stock de otras ubicaciones (buscando en el diccionario que creamos)
-        product_data['other_locations_stock'] = other_stock_data.get(row.Product.id, []) # Usa .get() para default a lista vacía
-
-        # Validar con el schema Pydantic
-        products_list.append(schemas.Product.model_validate(product_data))
+    for row in rows:
+        product_data = {col: getattr(row, col) for col in _PRODUCT_LIST_COLUMNS}
+        product_data["category"] = {
+            "id": row.category_id,
+            "name": row.category_name,
+            "description": row.category_description,
+        } if row.category_id else None
+        product_data["supplier"] = {
+            "id": row.supplier_id,
+            "name": row.supplier_name,
+            "contact_person": row.supplier_contact_person,
+            "email": row.supplier_email,
+            "phone": row.supplier_phone,
+        } if row.supplier_id else None
+        product_data["stock_quantity"] = row.stock_quantity if row.stock_quantity is not None else 0
+        product_data["other_locations_stock"] = row.other_locations_stock or []
+        product_data["images"] = row.images or []
+        products_list.append(product_data)
 
     return products_list
 
@@ -215,8 +278,12 @@ def delete_product(db: Session, product_id: int):
         db.commit()
     return db_product
 
-def add_product_image(db: Session, product_id: int, image_url: str):
-    db_image = models.ProductImage(product_id=product_id, image_url=image_url)
+def add_product_image(db: Session, product_id: int, image_url: str, thumbnail_url: str | None = None,
+                      medium_url: str | None = None, content_hash: str | None = None, status: str = "LISTA"):
+    db_image = models.ProductImage(
+        product_id=product_id, image_url=image_url,
+        thumbnail_url=thumbnail_url, medium_url=medium_url, content_hash=content_hash, status=status
+    )
     db.add(db_image)
     db.commit()
     db.refresh(db_image)
@@ -231,41 +298,33 @@ def delete_product_image(db: Session, image_id: int):
     
     # Si la encontramos...
     if db_image:
-        # Guardamos la ruta del archivo ANTES de borrar el registro de la BD.
-        image_path_to_delete = db_image.image_url
-
         # Borramos el registro de la base de datos.
         db.delete(db_image)
         db.commit()
 
-        # --- ¡LA LÓGICA CLAVE! ---
-        # Ahora, borramos el archivo físico del disco duro del servidor.
-        # --- LÓGICA SEGURA CORREGIDA ---
-        # Usamos os.path.join para evitar errores si falta el "/" inicial
-        # .lstrip("/") quita la barra inicial si la tiene, para que join funcione bien
-        full_file_path = os.path.join("/code", image_path_to_delete.lstrip("/"))
-        
-        try:
-            if os.path.exists(full_file_path):
-                os.remove(full_file_path)
-                print(f"Archivo eliminado correctamente: {full_file_path}")
-        except OSError as e:
-            print(f"Advertencia: No se pudo borrar el archivo físico {full_file_path}: {e}")
-        # -------------------------------
+        # Ahora, borramos los archivos físicos (si ninguna otra foto los comparte).
+        _release_image_files(db, db_image)
             
     return db_image
 
 
-def add_work_order_image(db: Session, work_order_id: int, image_url: str, tag: str):
+def add_work_order_image(db: Session, work_order_id: int, image_url: str, tag: str, thumbnail_url: str | None = None,
+                         medium_url: str | None = None, content_hash: str | None = None, status: str = "LISTA"):
     """
     Añade una nueva imagen a una orden de trabajo existente.
     - work_order_id: El ID de la orden.
-    - image_url: La ruta donde se guardó la imagen.
+    - image_url: La ruta donde se guardó la imagen (variante completa).
     - tag: La etiqueta que describe la foto (ej: "frontal", "borde_derecho").
+    - thumbnail_url / medium_url / content_hash: variantes WebP (ver media_service).
+    - status: PROCESANDO si el worker aún está generando las variantes.
     """
     db_image = models.WorkOrderImage(
         work_order_id=work_order_id, 
         image_url=image_url,
+        thumbnail_url=thumbnail_url,
+        medium_url=medium_url,
+        content_hash=content_hash,
+        status=status,
         tag=tag
     )
     db.add(db_image)
@@ -281,14 +340,124 @@ def delete_work_order_image(db: Session, image_id: int):
     if db_image:
         db.delete(db_image)
         db.commit()
+        _release_image_files(db, db_image)
     return db_image
 
+def _release_image_files(db: Session, db_image):
+    """
+    Borra del disco los archivos de una foto ya eliminada de la BD.
+    Las variantes WebP se guardan por hash (deduplicadas): solo se borran
+    si ninguna otra foto de producto u orden usa el mismo contenido.
+    """
+    if db_image.content_hash:
+        in_use = db.query(models.ProductImage.id).filter(models.ProductImage.content_hash == db_image.content_hash).first() \
+            or db.query(models.WorkOrderImage.id).filter(models.WorkOrderImage.content_hash == db_image.content_hash).first()
+        if in_use:
+            return
+    media_service.remove_files([db_image.image_url, db_image.medium_url, db_image.thumbnail_url])
+
 # ===================================================================
 # --- UBICACIONES ---
 # ===================================================================
 def get_location(db: Session, location_id: int):
     return db.query(models.Location).filter(models.Location.id == location_id).first()
 
+# --- INICIO DE NUESTRO CÓDIGO (Caché del árbol de ubicaciones) ---
+# Las sucursales y bodegas casi nunca cambian, pero get_primary_bodega_for_location
+# se consulta en cada venta, transferencia, listado de productos, importación...
+# Guardamos en memoria (por proceso) el árbol de cada empresa:
+#   - nodos: id -> LocationInfo (id, nombre, padre, empresa, meta diaria)
+#   - sucursal -> bodega principal
+# Se invalida al crear/editar/borrar/reparar ubicaciones. El TTL es un respaldo
+# para cuando hay varios workers (cada uno tiene su propia caché).
+LOCATION_CACHE_TTL_SECONDS = int(os.getenv("LOCATION_CACHE_TTL", "300"))
+
+LocationInfo = namedtuple("LocationInfo", ["id", "name", "parent_id", "company_id", "daily_goal"])
+
+_location_cache_lock = threading.Lock()
+_location_trees = {}          # company_id -> {"loaded_at", "nodes", "primary_bodega"}
+_location_company_index = {}  # location_id -> company_id
+_location_cache_stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+def _build_location_tree(rows):
+    """Arma el árbol de una empresa a partir de sus filas de Location."""
+    nodes = {row.id: LocationInfo(row.id, row.name, row.parent_id, row.company_id, row.daily_goal) for row in rows}
+
+    children = defaultdict(list)
+    for node in nodes.values():
+        if node.parent_id:
+            children[node.parent_id].append(node)
+
+    # Misma regla que antes: primero un hijo con 'BODEGA' en el nombre, si no el primer hijo
+    primary_bodega = {}
+    for parent_id, kids in children.items():
+        bodega = next((kid for kid in kids if "BODEGA" in kid.name.upper()), kids[0])
+        primary_bodega[parent_id] = bodega.id
+
+    return {"loaded_at": time.monotonic(), "nodes": nodes, "primary_bodega": primary_bodega}
+
+def _get_location_tree(db: Session, location_id: int):
+    """Devuelve el árbol (cacheado) de la empresa dueña de location_id, o None si no existe."""
+    with _location_cache_lock:
+        if location_id in _location_company_index:
+            tree = _location_trees.get(_location_company_index[location_id])
+            if tree and time.monotonic() - tree["loaded_at"] < LOCATION_CACHE_TTL_SECONDS:
+                _location_cache_stats["hits"] += 1
+                return tree
+        _location_cache_stats["misses"] += 1
+
+    # Fuera del candado: vamos a la BD
+    owner = db.query(models.Location.company_id).filter(models.Location.id == location_id).first()
+    if owner is None:
+        return None
+    company_id = owner.company_id
+
+    company_filter = models.Location.company_id == company_id if company_id is not None else models.Location.company_id.is_(None)
+    rows = db.query(
+        models.Location.id,
+        models.Location.name,
+        models.Location.parent_id,
+        models.Location.company_id,
+        models.Location.daily_goal
+    ).filter(company_filter).order_by(models.Location.id).all()
+    tree = _build_location_tree(rows)
+
+    with _location_cache_lock:
+        _location_trees[company_id] = tree
+        for node_id in tree["nodes"]:
+            _location_company_index[node_id] = company_id
+    return tree
+
+def get_location_info(db: Session, location_id: int):
+    """Versión liviana (y cacheada) de get_location: devuelve un LocationInfo o None."""
+    tree = _get_location_tree(db, location_id)
+    if not tree:
+        return None
+    return tree["nodes"].get(location_id)
+
+def invalidate_location_cache(company_id: int | None = None):
+    """Borra el árbol cacheado de una empresa (o de todas si no se indica)."""
+    with _location_cache_lock:
+        if company_id is None:
+            _location_trees.clear()
+            _location_company_index.clear()
+        else:
+            _location_trees.pop(company_id, None)
+            for loc_id in [k for k, v in _location_company_index.items() if v == company_id]:
+                del _location_company_index[loc_id]
+        _location_cache_stats["invalidations"] += 1
+
+def get_location_cache_stats():
+    """Contadores de la caché de ubicaciones (aciertos, fallos, invalidaciones)."""
+    with _location_cache_lock:
+        return {
+            **_location_cache_stats,
+            "companies_cached": len(_location_trees),
+            "locations_cached": len(_location_company_index),
+            "ttl_seconds": LOCATION_CACHE_TTL_SECONDS,
+        }
+# --- FIN DE NUESTRO CÓDIGO ---
+
 def get_locations(db: Session, company_id: int, skip: int = 0, limit: int = 100, include_all: bool = False):
     # --- INICIO DE NUESTRO CÓDIGO (Filtro Inteligente) ---
     # Por defecto (include_all=False), solo mostramos "Padres" (Sucursales) para menús limpios.
@@ -330,6 +499,7 @@ def create_location(db: Session, location: schemas.LocationCreate, company_id: i
 
     # 4. Guardar todo
     db.commit()
+    invalidate_location_cache(company_id)
     db.refresh(db_sucursal)
     return db_sucursal
 
@@ -345,7 +515,8 @@ def update_location(db: Session, location_id: int, location: schemas.LocationCre
             setattr(db_location, key, value)
             
         # 2. Buscamos su "Cuarto de Almacenamiento" (Bodega)
-        db_bodega = get_primary_bodega_for_location(db, location_id=db_location.id)
+        bodega_info = get_primary_bodega_for_location(db, location_id=db_location.id)
+        db_bodega = get_location(db, location_id=bodega_info.id) if bodega_info else None
         if db_bodega:
             # Actualizamos también los datos de la Bodega para que coincidan
             db_bodega.name = f"Bodega - {db_location.name}"
@@ -353,6 +524,7 @@ def update_location(db: Session, location_id: int, location: schemas.LocationCre
             
         # 3. Guardamos ambos cambios
         db.commit()
+        invalidate_location_cache(db_location.company_id)
         db.refresh(db_location)
     return db_location
     # --- FIN DE NUESTRO CÓDIGO ---
@@ -360,8 +532,10 @@ def update_location(db: Session, location_id: int, location: schemas.LocationCre
 def delete_location(db: Session, location_id: int):
     db_location = get_location(db, location_id=location_id)
     if db_location:
+        company_id = db_location.company_id
         db.delete(db_location)
         db.commit()
+        invalidate_location_cache(company_id)
     return db_location
 
 def get_primary_bodega_for_location(db: Session, location_id: int):
@@ -369,19 +543,13 @@ def get_primary_bodega_for_location(db: Session, location_id: int):
     Busca la bodega asociada a una sucursal de forma inteligente.
     Prioridad 1: Un hijo con la palabra 'BODEGA' en su nombre.
     Prioridad 2: El primer hijo que encuentre.
+    Devuelve un LocationInfo (id, name, ...) desde la caché, o None.
     """
-    children = db.query(models.Location).filter(models.Location.parent_id == location_id).all()
-    
-    # 1. Buscamos explícitamente al hijo que se llame 'Bodega'
-    for child in children:
-        if "BODEGA" in child.name.upper():
-            return child
-            
-    # 2. Si no hay uno llamado Bodega, devolvemos el primero (comportamiento antiguo)
-    if children:
-        return children[0]
-        
-    return None
+    tree = _get_location_tree(db, location_id)
+    if not tree:
+        return None
+    bodega_id = tree["primary_bodega"].get(location_id)
+    return tree["nodes"].get(bodega_id) if bodega_id else None
 
 # --- INICIO DE NUESTRO CÓDIGO (Lista solo de Bodegas) ---
 def get_bodegas(db: Session, company_id: int, skip: int = 0, limit: int = 100):
@@ -533,8 +701,8 @@ def search_global_parts(db: Session, query: str, limit: int = 50):
         company_settings = p.company.settings if p.company.settings else None
 
         # Obtener las primeras 3 URLs de imágenes
-        # (La base de datos ya guarda la versión optimizada de mejor calidad disponible)
-        top_images = [img.image_url for img in p.images[:3]]
+        # (Variante mediana WebP; las fotos antiguas sin variantes usan el original)
+        top_images = [img.medium_url or img.image_url for img in p.images[:3]]
         
         # --- LÓGICA DE NOMBRE COMERCIAL ---
         # Priorizamos el nombre configurado en settings. 
@@ -623,6 +791,7 @@ def update_user(db: Session, user_id: int, user_update: schemas.UserUpdate):
 
     db.commit()
     db.refresh(db_user)
+    security.invalidate_principal_cache(user_id=user_id) # Rol o estado pudieron cambiar
     return db_user
 
 
@@ -956,6 +1125,7 @@ def verify_user_account(db: Session, email: str, code: str):
     user.verification_code = None # Limpiamos el código
     db.commit()
     db.refresh(user)
+    security.invalidate_principal_cache(user_id=user.id)
     return True
 
 # ===================================================================
@@ -1027,12 +1197,6 @@ def get_work_order(db: Session, work_order_id: int):
         .filter(models.WorkOrder.id == work_order_id)
         .first()
     )
-    # --- AUTO-GENERACIÓN DE PUBLIC_ID PARA ÓRDENES ANTIGUAS ---
-    if order and not order.public_id:
-        order.public_id = str(uuid.uuid4())
-        db.commit()
-        db.refresh(order)
-    # ----------------------------------------------------------
     return order
 
 def get_work_order_by_public_id(db: Session, public_id: str):
@@ -1052,9 +1216,24 @@ def get_work_order_by_public_id(db: Session, public_id: str):
 
 
 
-def get_work_orders(db: Session, user: models.User, skip: int = 0, limit: int = 100, active_only: bool = False, search: str | None = None):
+# Orden de paginación (keyset) de cada listado: la última columna desempata
+WORK_ORDER_PAGE_ORDER = (models.WorkOrder.created_at, models.WorkOrder.id)
+SALE_PAGE_ORDER = (models.Sale.created_at, models.Sale.id)
+CASH_TRANSACTION_PAGE_ORDER = (models.CashTransaction.timestamp, models.CashTransaction.id)
+CUSTOMER_PAGE_ORDER = (models.Customer.name, models.Customer.id)
+TRANSFER_PAGE_ORDER = (models.Transfer.created_at, models.Transfer.id)
+
+def _paginate(query, order_columns, skip: int, limit: int, cursor: str | None, descending: bool = True):
+    """Con cursor: keyset (ignora 'skip'). Sin cursor: offset clásico (compatibilidad)."""
+    query = apply_keyset(query, order_columns, cursor, descending=descending)
+    if not cursor and skip:
+        query = query.offset(skip)
+    return query.limit(limit).all()
+
+def get_work_orders(db: Session, user: models.User, skip: int = 0, limit: int = 100, active_only: bool = False, search: str | None = None, cursor: str | None = None):
     """
-    Obtiene las órdenes de trabajo y AUTO-REPARA los public_id faltantes.
+    Obtiene las órdenes de trabajo (solo lectura).
+    Paginación: 'cursor' (recomendado) o 'skip' (compatibilidad).
     """
     query = db.query(models.WorkOrder).options(
         joinedload(models.WorkOrder.user),
@@ -1086,22 +1265,7 @@ def get_work_orders(db: Session, user: models.User, skip: int = 0, limit: int =
             return [] 
         query = query.filter(models.WorkOrder.location_id == active_shift.location_id)
 
-    results = query.order_by(models.WorkOrder.created_at.desc()).offset(skip).limit(limit).all()
-
-    # --- BLOQUE DE AUTO-REPARACIÓN ---
-    # Si encontramos órdenes sin código público, se lo creamos ahora mismo.
-    has_changes = False
-    for order in results:
-        if not order.public_id:
-            order.public_id = str(uuid.uuid4())
-            has_changes = True
-    
-    if has_changes:
-        db.commit() # Guardamos los nuevos códigos generados
-        # No necesitamos refrescar, el objeto en memoria ya tiene el ID
-    # ---------------------------------
-
-    return results
+    return _paginate(query, WORK_ORDER_PAGE_ORDER, skip, limit, cursor)
 
 def create_work_order(db: Session, work_order: schemas.WorkOrderCreate, user_id: int, location_id: int):
     # Recuperamos al usuario para saber su COMPANY ID
@@ -1141,6 +1305,7 @@ def create_work_order(db: Session, work_order: schemas.WorkOrderCreate, user_id:
     db_work_order = models.WorkOrder(**work_order_data, user_id=user_id, location_id=location_id, company_id=company_id)
     db.add(db_work_order)
     db.flush() # Obtenemos el ID de la orden
+    refresh_work_order_counts(db, location_id) # Resumen diario (dashboard)
 
     # --- INICIO LÓGICA ADELANTO = VENTA ---
     # Si hay un adelanto mayor a 0, creamos una VENTA automática
@@ -1198,6 +1363,8 @@ def update_work_order(db: Session, work_order_id: int, work_order_update: schema
         update_data = work_order_update.model_dump(exclude_unset=True)
         for key, value in update_data.items():
             setattr(db_work_order, key, value)
+        if "status" in update_data:
+            refresh_work_order_counts(db, db_work_order.location_id)
         db.commit()
         db.refresh(db_work_order)
     return db_work_order
@@ -1230,18 +1397,7 @@ def search_ready_work_orders(db: Session, user: models.User, search: str | None
 
         query = query.filter(or_(*filters))
 
-    results = query.order_by(models.WorkOrder.created_at.desc()).offset(skip).limit(limit).all()
-
-    # --- AUTO-REPARACIÓN ---
-    has_changes = False
-    for order in results:
-        if not order.public_id:
-            order.public_id = str(uuid.uuid4())
-            has_changes = True
-    if has_changes: db.commit()
-    # -----------------------
-
-    return results
+    return query.order_by(models.WorkOrder.created_at.desc()).offset(skip).limit(limit).all()
 
     # Aplicar filtro de permisos basado en rol y turno (igual que en get_work_orders)
     if user.role not in ["admin", "inventory_manager"]:
@@ -1447,6 +1603,50 @@ def create_purchase_invoice(db: Session, invoice: schemas.PurchaseInvoiceCreate,
 # --- VENTAS ---
 # ===================================================================
 # --- INICIO DE NUESTRO CÓDIGO (Venta con Pagos Mixtos y Costo Histórico) ---
+def _lock_and_discount_sale_stock(db: Session, quantities: dict, location_id: int, product_names: dict):
+    """
+    Descuenta el stock de TODOS los productos de la venta en bloque.
+    - quantities: {product_id: cantidad total a descontar}
+    - Bloquea las filas de Stock en UNA sola consulta, siempre ordenadas por product_id
+      (dos carritos concurrentes toman los candados en el mismo orden -> sin deadlocks).
+    - Valida todo antes de tocar nada y hace un único UPDATE.
+    No hace commit (lo hace create_sale).
+    """
+    product_ids = sorted(quantities.keys())
+    locked_rows = db.query(
+        models.Stock.id,
+        models.Stock.product_id,
+        models.Stock.quantity
+    ).filter(
+        models.Stock.product_id.in_(product_ids),
+        models.Stock.location_id == location_id
+    ).order_by(models.Stock.product_id).with_for_update().all()
+    stock_by_product = {row.product_id: row for row in locked_rows}
+
+    # Verificamos si hay stock suficiente ANTES de hacer cambios
+    for product_id in product_ids:
+        needed = quantities[product_id]
+        product_name = product_names.get(product_id, f"ID {product_id}")
+        row = stock_by_product.get(product_id)
+        if not row:
+            if needed <= 0:
+                continue
+            raise ValueError(f"Intento de sacar stock inexistente para '{product_name}'.")
+        if row.quantity < needed:
+            raise ValueError(f"Stock insuficiente para '{product_name}'. Disponible: {row.quantity}, Necesario: {needed}")
+
+    if not locked_rows:
+        return
+
+    # Un solo UPDATE con CASE para todas las filas
+    discount = case(
+        {row.id: quantities[row.product_id] for row in locked_rows},
+        value=models.Stock.id
+    )
+    db.query(models.Stock).filter(
+        models.Stock.id.in_([row.id for row in locked_rows])
+    ).update({models.Stock.quantity: models.Stock.quantity - discount}, synchronize_session=False)
+
 def create_sale(db: Session, sale: schemas.SaleCreate, user_id: int, location_id: int):
     try:
         # Recuperamos al usuario para saber su COMPANY ID
@@ -1490,7 +1690,10 @@ def create_sale(db: Session, sale: schemas.SaleCreate, user_id: int, location_id
                 # 1. Si la orden ya tenía una venta de abono registrada, la borramos
                 # para reemplazarla por esta "Venta Maestra" que incluye todo.
                 if db_work_order and db_work_order.sale:
-                    db.delete(db_work_order.sale)
+                    old_sale = db_work_order.sale
+                    # Sacamos el abono del resumen diario del día en que se cobró
+                    _bump_daily_summary(db, old_sale.location_id, _local_date(old_sale.created_at), sales=-(old_sale.total_amount or 0.0))
+                    db.delete(old_sale)
                     db.flush() 
 
                 # 2. Lógica de Fusión de Pagos (Si hubo abono)
@@ -1538,29 +1741,30 @@ def create_sale(db: Session, sale: schemas.SaleCreate, user_id: int, location_id
         # ---------------------------------------------------
 
         # 1. Calcular totales y PREPARAR ITEMS CON COSTO
+        # --- CAPTURAR EL COSTO DEL MOMENTO (una sola consulta para todo el carrito) ---
+        product_ids = {item.product_id for item in sale.items if item.product_id}
+        product_costs = {}
+        product_names = {}
+        if product_ids:
+            for row in db.query(models.Product.id, models.Product.name, models.Product.average_cost)\
+                         .filter(models.Product.id.in_(product_ids)).all():
+                # Usamos el costo promedio que tiene el producto AHORA MISMO
+                product_costs[row.id] = row.average_cost
+                product_names[row.id] = row.name
+        # -------------------------------------
+
         subtotal_decimal = Decimal("0.00")
         sale_items_to_create = []
         for item in sale.items:
             line_total_decimal = Decimal(item.quantity) * Decimal(str(item.unit_price))
             subtotal_decimal += line_total_decimal
             line_total = line_total_decimal.quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
-            
-            # --- CAPTURAR EL COSTO DEL MOMENTO ---
-            current_product_cost = 0.0
-            if item.product_id:
-                product = get_product(db, item.product_id)
-                if product:
-                    # Usamos el costo promedio que tiene el producto AHORA MISMO
-                    current_product_cost = product.average_cost
-            # -------------------------------------
-
-            sale_items_to_create.append(
-                models.SaleItem(
-                    **item.model_dump(),
-                    line_total=float(line_total),
-                    recorded_cost=current_product_cost # Guardamos el costo para el reporte
-                )
-            )
+
+            sale_items_to_create.append({
+                **item.model_dump(),
+                "line_total": float(line_total),
+                "recorded_cost": product_costs.get(item.product_id, 0.0) if item.product_id else 0.0 # Guardamos el costo para el reporte
+            })
 
         subtotal_decimal = subtotal_decimal.quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
         iva_rate = Decimal(str(sale.iva_percentage)) / Decimal("100")
@@ -1610,24 +1814,31 @@ def create_sale(db: Session, sale: schemas.SaleCreate, user_id: int, location_id
         db.add(db_sale)
         db.flush() # ¡CRÍTICO! Aquí obtenemos el ID de la venta (db_sale.id)
 
-        # --- AHORA SÍ, GUARDAMOS LOS ÍTEMS VINCULADOS A LA VENTA ---
-        for item_obj in sale_items_to_create:
-            item_obj.sale_id = db_sale.id # Le pegamos la etiqueta de la venta
-            db.add(item_obj) # Lo mandamos a la base de datos
+        # --- AHORA SÍ, GUARDAMOS LOS ÍTEMS VINCULADOS A LA VENTA (un solo INSERT) ---
+        for item_data in sale_items_to_create:
+            item_data["sale_id"] = db_sale.id # Le pegamos la etiqueta de la venta
+        db.bulk_insert_mappings(models.SaleItem, sale_items_to_create)
         # -----------------------------------------------------------
 
-        # 5. Mover inventario
-        for item in sale.items:
-            if item.product_id:
-                movement = schemas.InventoryMovementCreate(
-                    product_id=item.product_id,
-                    location_id=bodega.id,
-                    quantity_change=-item.quantity,
-                    movement_type="VENTA",
-                    reference_id=f"SALE-{db_sale.id}",
-                    pin=sale.pin
-                )
-                create_inventory_movement(db=db, movement=movement, user_id=user_id)
+        # 5. Mover inventario (candado ordenado + UPDATE + INSERT en bloque)
+        product_lines = [item for item in sale.items if item.product_id]
+        if product_lines:
+            quantities = defaultdict(int)
+            for item in product_lines:
+                quantities[item.product_id] += item.quantity
+            _lock_and_discount_sale_stock(db, quantities, location_id=bodega.id, product_names=product_names)
+
+            db.bulk_insert_mappings(models.InventoryMovement, [
+                {
+                    "product_id": item.product_id,
+                    "location_id": bodega.id,
+                    "quantity_change": -item.quantity,
+                    "movement_type": "VENTA",
+                    "reference_id": f"SALE-{db_sale.id}",
+                    "user_id": user_id
+                }
+                for item in product_lines
+            ])
 
         # 6. Procesar Pagos (Caja, Bancos y Notas de Crédito)
         db_caja_ventas = db.query(models.CashAccount).filter(
@@ -1643,7 +1854,9 @@ def create_sale(db: Session, sale: schemas.SaleCreate, user_id: int, location_id
                         amount=payment.amount,
                         description=f"Ingreso Venta #{db_sale.id} (Efectivo)",
                         user_id=user_id,
-                        account_id=db_caja_ventas.id
+                        account_id=db_caja_ventas.id,
+                        transaction_type=CASH_TX_SALE,
+                        sale_id=db_sale.id
                     )
                     db.add(db_transaction)
 
@@ -1658,7 +1871,9 @@ def create_sale(db: Session, sale: schemas.SaleCreate, user_id: int, location_id
                             amount=payment.amount,
                             description=f"Ingreso Venta #{db_sale.id} (Transf: {payment.reference or 'Sin Ref'})",
                             user_id=user_id,
-                            account_id=target_bank.id
+                            account_id=target_bank.id,
+                            transaction_type=CASH_TX_SALE,
+                            sale_id=db_sale.id
                         )
                         db.add(db_transaction)
             
@@ -1692,99 +1907,19 @@ def create_sale(db: Session, sale: schemas.SaleCreate, user_id: int, location_id
                     if db_work_order.status == "LISTO":
                         db_work_order.status = "ENTREGADO"
                         db_work_order.final_cost = db_work_order.estimated_cost
+                # Cubre también entregas sin reparar (el estado ya viene cambiado)
+                refresh_work_order_counts(db, db_work_order.location_id)
 
-        db.commit()
-        db.refresh(db_sale)
+        # Resumen diario (dashboard): sumamos la venta al día de hoy
+        _bump_daily_summary(db, location_id, sales=db_sale.total_amount or 0.0)
 
-        # =======================================================================
-        # --- AUTOMATIZACIÓN FACTURACIÓN ELECTRÓNICA SRI (DISPARADOR) ---
-        # =======================================================================
+        # 8. Facturación electrónica: solo ENCOLAMOS (misma transacción que la venta).
+        # Los workers de sri_worker.py generan, firman, envían y consultan la autorización.
         if sale.issue_electronic_invoice:
-            print(f"🔄 Iniciando proceso de facturación electrónica para Venta #{db_sale.id}...")
-            try:
-                # 1. Obtener credenciales y configuración de la empresa
-                sri_config = get_sri_config(db, company_id)
-                company_settings = get_company_settings(db, company_id)
-                
-                if not sri_config:
-                    db_sale.sri_auth_status = "ERROR_CONFIG"
-                    db_sale.sri_error_message = "La empresa no tiene configurada la firma electrónica."
-                else:
-                    # 2. Preparar datos limpios para el generador XML
-                    venta_data = {
-                        "cliente_nombre": db_sale.customer_name,
-                        "cliente_id": db_sale.customer_ci,
-                        "cliente_email": db_sale.customer_email or "consumidor@final.com",
-                        "cliente_direccion": db_sale.customer_address or "Ciudad",
-                        "subtotal": db_sale.subtotal_amount,
-                        "total": db_sale.total_amount,
-                        "items": []
-                    }
-                    
-                    for item in db_sale.items:
-                        venta_data["items"].append({
-                            "nombre": item.description,
-                            "cantidad": item.quantity,
-                            "precio": item.unit_price
-                        })
-
-                    # 3. Generar Clave de Acceso (La cédula de identidad de la factura)
-                    # Usamos el ID de la venta como secuencial simple (relleno a 9 dígitos)
-                    secuencial = str(db_sale.id).zfill(9)
-                    now = datetime.now()
-                    
-                    clave_acceso = sri_utils.generar_clave_acceso(
-                        fecha=now,
-                        tipo_comprobante="01", # 01 = Factura
-                        ruc=sri_config["ruc"],
-                        ambiente=sri_config["env"],
-                        serie=f"{sri_config['establishment']}{sri_config['emission_point']}",
-                        numero=secuencial,
-                        codigo_numerico="12345678" # En producción usar random.randint(10000000, 99999999)
-                    )
-
-                    # Completar configuración para el generador XML
-                    sri_config.update({
-                        "razon_social": company_settings.name,
-                        "direccion": company_settings.address or "Matriz",
-                        "clave_acceso": clave_acceso,
-                        "secuencial": secuencial,
-                        "fecha_emision": now.strftime("%d/%m/%Y")
-                    })
-
-                    # 4. CICLO DE VIDA DEL DOCUMENTO: Crear -> Firmar -> Enviar
-                    print("   ↳ Generando XML...")
-                    xml_raw = sri_utils.crear_xml_factura(venta_data, sri_config)
-                    
-                    print("   ↳ Firmando digitalmente...")
-                    xml_signed = sri_utils.firmar_xml(xml_raw, sri_config["signature_path"], sri_config["password"])
-                    
-                    print("   ↳ Enviando al SRI...")
-                    respuesta_sri = sri_utils.enviar_comprobante_sri(xml_signed, ambiente=sri_config["env"])
+            enqueue_sri_invoice(db, db_sale)
 
-                    # 5. Guardar el veredicto en la base de datos
-                    db_sale.sri_access_key = clave_acceso
-                    db_sale.sri_auth_status = respuesta_sri["status"]
-                    db_sale.sri_auth_date = now
-                    
-                    if respuesta_sri["status"] != "RECIBIDA":
-                        detalles = respuesta_sri.get("detalles", [])
-                        msg = " | ".join(detalles) if detalles else respuesta_sri.get("mensaje")
-                        db_sale.sri_error_message = msg
-                        print(f"⚠️ SRI Rechazado: {msg}")
-                    else:
-                        print("✅ Factura Autorizada por SRI")
-
-                # Guardamos los cambios del estado SRI (sin afectar la venta original)
-                db.commit()
-
-            except Exception as e:
-                print(f"❌ Error CRÍTICO en proceso SRI: {e}")
-                # No fallamos la venta, el cliente ya pagó. Solo marcamos el error interno.
-                db_sale.sri_auth_status = "ERROR_INTERNO"
-                db_sale.sri_error_message = str(e)
-                db.commit()
-        # =======================================================================
+        db.commit()
+        db.refresh(db_sale)
 
         return db_sale
 
@@ -1811,13 +1946,6 @@ def get_sale(db: Session, sale_id: int):
         .filter(models.Sale.id == sale_id)
         .first()
     )
-    # --- AUTO-GENERACIÓN DE PUBLIC_ID PARA VENTAS ANTIGUAS ---
-    # Si la venta existe pero no tiene código secreto, se lo creamos ahora mismo.
-    if sale and not sale.public_id:
-        sale.public_id = str(uuid.uuid4())
-        db.commit()
-        db.refresh(sale)
-    # ---------------------------------------------------------
     return sale
 
 def get_sale_by_public_id(db: Session, public_id: str):
@@ -1833,31 +1961,51 @@ def get_sale_by_public_id(db: Session, public_id: str):
         .first()
     )
 
+# --- RELLENO DE PUBLIC_ID (VENTAS Y ÓRDENES ANTIGUAS) ---
+# Antes los listados generaban el código público "al vuelo" y hacían commit
+# dentro de una lectura. Ahora se rellena UNA vez (migración o este job) y las
+# lecturas quedan de solo lectura (pueden ir a la réplica).
+PUBLIC_ID_BATCH_SIZE = int(os.getenv("PUBLIC_ID_BATCH_SIZE", "5000"))
+
+def backfill_public_ids(db: Session, model, batch_size: int = PUBLIC_ID_BATCH_SIZE, progress=None) -> int:
+    """
+    Asigna public_id a las filas de 'model' (models.Sale o models.WorkOrder) que no lo tienen,
+    por lotes con commit en cada uno (no bloquea la tabla entera).
+    'progress(hechas, total)' se llama después de cada lote. Devuelve cuántas se rellenaron.
+    """
+    total = db.query(func.count(model.id)).filter(model.public_id == None).scalar() or 0
+    done = 0
+    last_id = 0
+    while done < total:
+        ids = [row[0] for row in db.query(model.id).filter(
+            model.public_id == None,
+            model.id > last_id
+        ).order_by(model.id).limit(batch_size).all()]
+        if not ids:
+            break
+        db.bulk_update_mappings(model, [{"id": row_id, "public_id": str(uuid.uuid4())} for row_id in ids])
+        db.commit()
+        done += len(ids)
+        last_id = ids[-1]
+        if progress:
+            progress(done, total)
+    return done
+
 # --- INICIO DE NUESTRO CÓDIGO ---
 # Esta es la nueva función (¡MEJORADA!) para buscar en el "archivador"
-def get_sales(
-    db: Session, 
-    user: models.User, 
-    skip: int = 0, 
-    limit: int = 100,
-    # --- NUEVOS PARÁMETROS PARA EL BUSCADOR INTELIGENTE ---
-    start_date: date | None = None,
-    end_date: date | None = None,
-    search: str | None = None,
-    location_id: int | None = None  # <--- ¡AQUÍ ESTÁ EL PARÁMETRO NUEVO!
+def _sales_history_criteria(
+    db: Session,
+    user: models.User,
+    start_date: date | None,
+    end_date: date | None,
+    search: str | None,
+    location_id: int | None,
 ):
     """
-    Obtiene el historial de ventas con lógica de permisos Y FILTROS.
-    - Admins/Managers ven todas las ventas.
-    - Otros roles (vendedores) solo ven las de su turno activo.
-    - Filtra por rango de fechas y por término de búsqueda (cliente/cédula).
+    Filtros del historial de ventas (pantalla y reporte PDF).
+    Devuelve la lista para query.filter(*...) o None si el empleado no tiene turno activo.
     """
-    # 1. Preparamos la consulta (esto no cambia)
-    query = db.query(models.Sale).options(
-        selectinload(models.Sale.user),
-        selectinload(models.Sale.location),
-        selectinload(models.Sale.items).selectinload(models.SaleItem.product),
-    )
+    criteria = []
 
     # --- INICIO DE LA LÓGICA DE PERMISOS CORREGIDA (CON INDENTACIÓN) ---
     # 2. Lógica de permisos y filtrado por sucursal
@@ -1865,7 +2013,7 @@ def get_sales(
         # Si es Super Admin, Admin o Gerente, PUEDE filtrar por sucursal.
         if location_id:
             # Si se le pasa un ID, filtra por ese ID
-            query = query.filter(models.Sale.location_id == location_id)
+            criteria.append(models.Sale.location_id == location_id)
         # Si location_id es None (el usuario eligió "Todas"), 
         # no se aplica filtro y verá todas las sucursales.
     else:
@@ -1873,24 +2021,18 @@ def get_sales(
         # intentado enviar y SIEMPRE filtra por su turno activo.
         active_shift = get_active_shift_for_user(db, user_id=user.id)
         if not active_shift:
-            return []  # <--- ESTE 'return' AHORA SÍ ESTÁ DENTRO DE LA FUNCIÓN
-        query = query.filter(models.Sale.location_id == active_shift.location_id)
+            return None
+        criteria.append(models.Sale.location_id == active_shift.location_id)
     # --- FIN DE LA LÓGICA DE PERMISOS ---
 
     # --- INICIO DE LA NUEVA LÓGICA DE FILTROS ---
-    # 3. Aplicamos el filtro de "Fecha Inicio" si existe
-    if start_date:
-        # func.date() extrae solo la fecha (ej: '2025-10-31') de la hora completa
-        query = query.filter(func.date(models.Sale.created_at) >= start_date)
-
-    # 4. Aplicamos el filtro de "Fecha Fin" si existe
-    if end_date:
-        query = query.filter(func.date(models.Sale.created_at) <= end_date)
+    # 3 y 4. Rango de fechas (días locales -> rango UTC, usa el índice de created_at)
+    criteria.extend(date_range_filter(models.Sale.created_at, start_date, end_date))
 
     # 5. Aplicamos el filtro de búsqueda de texto si existe
     if search:
         search_term = f"%{search.lower()}%" # Buscamos el texto en mayúsculas/minúsculas
-        query = query.filter(
+        criteria.append(
             or_(
                 # Busca en el nombre del cliente
                 func.lower(models.Sale.customer_name).like(search_term),
@@ -1899,26 +2041,136 @@ def get_sales(
             )
         )
     # --- FIN DE LA NUEVA LÓGICA DE FILTROS ---
+    return criteria
 
-    # 6. Ejecutamos consulta y AUTO-REPARAMOS IDs faltantes
-    results = query.order_by(models.Sale.created_at.desc()).offset(skip).limit(limit).all()
-    
-    has_changes = False
-    for sale in results:
-        if not sale.public_id:
-            sale.public_id = str(uuid.uuid4())
-            has_changes = True
-    
-    if has_changes:
-        db.commit()
 
-    return results
+def get_sales(
+    db: Session, 
+    user: models.User, 
+    skip: int = 0, 
+    limit: int = 100,
+    # --- NUEVOS PARÁMETROS PARA EL BUSCADOR INTELIGENTE ---
+    start_date: date | None = None,
+    end_date: date | None = None,
+    search: str | None = None,
+    location_id: int | None = None,  # <--- ¡AQUÍ ESTÁ EL PARÁMETRO NUEVO!
+    cursor: str | None = None # Paginación por cursor (ver utils/cursor.py)
+):
+    """
+    Obtiene el historial de ventas con lógica de permisos Y FILTROS.
+    - Admins/Managers ven todas las ventas.
+    - Otros roles (vendedores) solo ven las de su turno activo.
+    - Filtra por rango de fechas y por término de búsqueda (cliente/cédula).
+    """
+    # 1. Preparamos la consulta (esto no cambia)
+    query = db.query(models.Sale).options(
+        selectinload(models.Sale.user),
+        selectinload(models.Sale.location),
+        selectinload(models.Sale.items).selectinload(models.SaleItem.product),
+    )
+
+    # 2 a 5. Permisos + filtros (los mismos que usa el reporte impreso)
+    criteria = _sales_history_criteria(db, user, start_date, end_date, search, location_id)
+    if criteria is None:
+        return []  # Empleado sin turno activo
+    query = query.filter(*criteria)
+
+    # 6. Ejecutamos la consulta (solo lectura: los public_id ya vienen llenos, ver backfill_public_ids)
+    return _paginate(query, SALE_PAGE_ORDER, skip, limit, cursor)
 # --- FIN DE NUESTRO CÓDIGO ---
 
+# ===================================================================
+# --- REPORTE IMPRESO DEL HISTORIAL DE VENTAS ---
+# ===================================================================
+# El PDF no necesita los objetos completos (usuario, sucursal, items, productos):
+# solo las columnas que se imprimen. La consulta se recorre con cursor del
+# servidor (ver export_service.iter_sales_report_rows) y los totales salen de SQL,
+# así que no hay tope de filas ni picos de memoria.
+
+# Cómo se reparte cada método de pago en el cuadro de resumen
+SALES_REPORT_BUCKETS = {"EFECTIVO": "cash", "TRANSFERENCIA": "transfer", "TARJETA": "card"}
+
+
+def sales_report_query(
+    db: Session,
+    user: models.User,
+    start_date: date | None = None,
+    end_date: date | None = None,
+    search: str | None = None,
+    location_id: int | None = None,
+):
+    """Proyección liviana (sin ordenar) de las ventas del reporte, con los filtros de get_sales."""
+    query = db.query(
+        models.Sale.id,
+        models.Sale.created_at,
+        models.Sale.customer_name,
+        models.User.email.label("user_email"),
+        models.Location.name.label("location_name"),
+        models.Sale.payment_method,
+        models.Sale.payment_method_details,
+        models.Sale.total_amount,
+    ).join(models.User, models.Sale.user_id == models.User.id)\
+     .outerjoin(models.Location, models.Sale.location_id == models.Location.id)
+
+    criteria = _sales_history_criteria(db, user, start_date, end_date, search, location_id)
+    if criteria is None:
+        return query.filter(false())  # Empleado sin turno activo: reporte vacío
+    return query.filter(*criteria)
+
+
+def get_sales_report_totals(db: Session, query):
+    """
+    Totales del reporte calculados en la BD sobre la misma consulta:
+    - Ventas con lista de pagos (mixtas/nuevas): se suma cada pago por su método.
+    - Ventas antiguas (sin lista): todo el total va a su payment_method.
+    """
+    details = models.Sale.payment_method_details
+    is_payment_list = and_(
+        func.json_typeof(details) == "array",
+        case((func.json_typeof(details) == "array", func.json_array_length(details)), else_=0) > 0
+    )
+
+    count, total = query.with_entities(
+        func.count(models.Sale.id), func.coalesce(func.sum(models.Sale.total_amount), 0.0)
+    ).order_by(None).one()
+
+    totals = {"count": count, "total": float(total), "cash": 0.0, "transfer": 0.0, "card": 0.0, "others": 0.0}
+
+    def _add(method, amount):
+        bucket = SALES_REPORT_BUCKETS.get(method, "others")
+        totals[bucket] += float(amount or 0)
+
+    # 1. Ventas antiguas / simples
+    simple_rows = query.with_entities(
+        models.Sale.payment_method, func.sum(models.Sale.total_amount)
+    ).filter(or_(details == None, ~is_payment_list))\
+     .group_by(models.Sale.payment_method).order_by(None).all()
+    for method, amount in simple_rows:
+        _add(method, amount)
+
+    # 2. Ventas con lista de pagos: un renglón por pago (json_array_elements)
+    payments = query.with_entities(
+        func.json_array_elements(details).label("payment")
+    ).filter(is_payment_list).order_by(None).subquery()
+    method = func.coalesce(payments.c.payment.op("->>")("method"), "OTROS")
+    amount = func.coalesce(cast(payments.c.payment.op("->>")("amount"), Float), 0.0)
+    for method_name, method_total in db.query(method, func.sum(amount)).group_by(method).all():
+        _add(method_name, method_total)
+
+    return totals
+
 
 # ===================================================================
 # --- GESTIÓN DE CAJA ---
 # ===================================================================
+# Tipos de movimiento (cash_transactions.transaction_type). Antes se deducían
+# de la descripción ("Venta #15", "CIERRE DE CAJA"...).
+CASH_TX_SALE = "VENTA"          # Cobro de una venta (sale_id apunta a la venta)
+CASH_TX_REFUND = "DEVOLUCION"   # Devolución en efectivo (sale_id = venta devuelta)
+CASH_TX_EXPENSE = "GASTO"       # Salida registrada desde el módulo de gastos
+CASH_TX_CLOSURE = "CIERRE"      # Cierre de caja
+CASH_TX_MANUAL = "MANUAL"       # Cualquier otro ingreso/egreso manual
+
 def create_cash_account(db: Session, account: schemas.CashAccountCreate, company_id: int):
     # Convertimos el nombre a MAYÚSCULAS antes de guardar
     account_data = account.model_dump()
@@ -1950,22 +2202,27 @@ def create_cash_transaction(db: Session, transaction: schemas.CashTransactionCre
     account = get_cash_account(db, account_id=transaction.account_id)
     if not account:
         return None
+    # El botón "Cierre de Caja" manda esta descripción por defecto
+    is_closure = transaction.description.upper().startswith("CIERRE DE CAJA")
     db_transaction = models.CashTransaction(
         amount=transaction.amount,
         description=transaction.description,
         user_id=user_id,
-        account_id=transaction.account_id
+        account_id=transaction.account_id,
+        transaction_type=CASH_TX_CLOSURE if is_closure else CASH_TX_MANUAL
     )
     db.add(db_transaction)
+    _record_cash_expense(db, account, transaction.amount, db_transaction.transaction_type)
     db.commit()
     db.refresh(db_transaction)
     return db_transaction
 
-def get_cash_transactions_by_account(db: Session, account_id: int, skip: int = 0, limit: int = 100):
-    return db.query(models.CashTransaction).options(
+def get_cash_transactions_by_account(db: Session, account_id: int, skip: int = 0, limit: int = 100, cursor: str | None = None):
+    query = db.query(models.CashTransaction).options(
         joinedload(models.CashTransaction.user),
         joinedload(models.CashTransaction.account)
-    ).filter(models.CashTransaction.account_id == account_id).order_by(models.CashTransaction.timestamp.desc()).offset(skip).limit(limit).all()
+    ).filter(models.CashTransaction.account_id == account_id)
+    return _paginate(query, CASH_TRANSACTION_PAGE_ORDER, skip, limit, cursor)
 
 # --- INICIO DE NUESTRO CÓDIGO (Cierre de Caja) ---
 def get_cash_account_balance(db: Session, account_id: int) -> float:
@@ -1986,46 +2243,154 @@ def get_cash_account_balance(db: Session, account_id: int) -> float:
 # ===================================================================
 # --- REPORTES ---
 # ===================================================================
+# ===================================================================
+# --- RESUMEN DIARIO POR SUCURSAL (tabla daily_location_summary) ---
+# ===================================================================
+# El dashboard se refresca cada pocos segundos en todas las sucursales.
+# Antes sumaba TODO el historial de ventas y caja en cada consulta (el filtro
+# por fecha local no usa índices). Ahora cada venta/egreso suma su parte a la
+# fila (sucursal, día local) y el dashboard solo lee una fila.
+
+def _bump_daily_summary(db: Session, location_id: int, summary_date: date | None = None, sales: float = 0.0, expenses: float = 0.0):
+    """Suma (o resta) a los totales del día. NO hace commit: va en la transacción de quien llama."""
+    if not location_id or (not sales and not expenses):
+        return
+    stmt = pg_insert(models.DailyLocationSummary).values(
+        location_id=location_id,
+        summary_date=summary_date or _local_date(),
+        sales_total=sales,
+        expenses_total=expenses,
+    )
+    table = models.DailyLocationSummary.__table__
+    stmt = stmt.on_conflict_do_update(
+        constraint="_daily_summary_location_date_uc",
+        set_={
+            "sales_total": table.c.sales_total + stmt.excluded.sales_total,
+            "expenses_total": table.c.expenses_total + stmt.excluded.expenses_total,
+            "updated_at": func.now(),
+        }
+    )
+    db.execute(stmt)
+
+def _record_cash_expense(db: Session, account: models.CashAccount, amount: float, transaction_type: str):
+    """
+    Mismo criterio que usaba el dashboard: solo egresos de la CAJA DE VENTAS
+    de una sucursal, sin contar los cierres de caja.
+    """
+    if amount is None or amount >= 0:
+        return
+    if account.account_type != "CAJA_VENTAS" or not account.location_id:
+        return
+    if transaction_type == CASH_TX_CLOSURE:
+        return
+    _bump_daily_summary(db, account.location_id, expenses=abs(amount))
+
+def refresh_work_order_counts(db: Session, location_id: int):
+    """Guarda en la fila de hoy la foto de órdenes por estado de la sucursal. NO hace commit."""
+    if not location_id:
+        return
+    db.flush() # Para que el conteo vea los cambios pendientes de esta sesión
+    # Un solo cambio de estado a la vez por sucursal: sin este lock, dos transacciones
+    # cuentan cada una sin el cambio (aún sin commit) de la otra y la última pisa la foto.
+    # El lock dura hasta el commit de quien llama; al esperar, el conteo ya ve lo confirmado.
+    # (FOR NO KEY UPDATE: no choca con los KEY SHARE de las FK al crear órdenes)
+    db.query(models.Location.id).filter(models.Location.id == location_id).with_for_update(key_share=True).first()
+    counts = dict(db.query(models.WorkOrder.status, func.count(models.WorkOrder.id)).filter(
+        models.WorkOrder.location_id == location_id
+    ).group_by(models.WorkOrder.status).all())
+
+    stmt = pg_insert(models.DailyLocationSummary).values(
+        location_id=location_id,
+        summary_date=_local_date(),
+        sales_total=0.0,
+        expenses_total=0.0,
+        work_order_counts=counts,
+    )
+    stmt = stmt.on_conflict_do_update(
+        constraint="_daily_summary_location_date_uc",
+        set_={"work_order_counts": stmt.excluded.work_order_counts, "updated_at": func.now()}
+    )
+    db.execute(stmt)
+
+_REBUILD_SUMMARY_SQL = """
+    INSERT INTO daily_location_summary (location_id, summary_date, sales_total, expenses_total)
+    SELECT location_id, summary_date, SUM(sales), SUM(expenses)
+    FROM (
+        SELECT s.location_id, (s.created_at AT TIME ZONE :tz)::date AS summary_date,
+               s.total_amount AS sales, 0 AS expenses
+        FROM sales s
+        WHERE s.location_id IS NOT NULL {sale_filter}
+        UNION ALL
+        SELECT a.location_id, (t.timestamp AT TIME ZONE :tz)::date,
+               0, -t.amount
+        FROM cash_transactions t
+        JOIN cash_accounts a ON a.id = t.account_id
+        WHERE a.account_type = 'CAJA_VENTAS'
+          AND a.location_id IS NOT NULL
+          AND t.amount < 0
+          AND t.transaction_type <> 'CIERRE' {account_filter}
+    ) AS movimientos
+    GROUP BY location_id, summary_date
+"""
+
+def _rebuild_daily_location_summary(db: Session, location_id: int | None = None):
+    """Borra y recalcula las filas del resumen (todas las sucursales o solo una). NO hace commit."""
+    params = {"tz": _app_timezone()}
+    sale_filter = account_filter = ""
+    delete_query = db.query(models.DailyLocationSummary)
+    if location_id:
+        params["location_id"] = location_id
+        sale_filter = "AND s.location_id = :location_id"
+        account_filter = "AND a.location_id = :location_id"
+        delete_query = delete_query.filter(models.DailyLocationSummary.location_id == location_id)
+
+    delete_query.delete(synchronize_session=False)
+    db.execute(text(_REBUILD_SUMMARY_SQL.format(sale_filter=sale_filter, account_filter=account_filter)), params)
+
+    location_ids = [location_id] if location_id else [
+        row[0] for row in db.query(models.WorkOrder.location_id).filter(models.WorkOrder.location_id != None).distinct()
+    ]
+    for loc_id in location_ids:
+        refresh_work_order_counts(db, loc_id)
+
+def rebuild_daily_location_summary(db: Session, location_id: int | None = None) -> int:
+    """
+    Recalcula el resumen desde cero (todas las sucursales o solo una) y
+    toma la foto de órdenes de hoy. Sirve para el backfill inicial o si algo
+    se descuadró. Devuelve cuántas filas quedaron. Hace commit.
+    """
+    _rebuild_daily_location_summary(db, location_id)
+    db.commit()
+
+    query = db.query(func.count(models.DailyLocationSummary.id))
+    if location_id:
+        query = query.filter(models.DailyLocationSummary.location_id == location_id)
+    return query.scalar()
+
 def get_dashboard_summary(db: Session, location_id: int, target_date: date):
-    # Calcula ventas totales del día en la ubicación
-    # BLINDAJE: Si os.getenv devuelve cadena vacía, forzamos el default
-    app_timezone = os.getenv("TZ")
-    if not app_timezone: 
-        app_timezone = "America/Guayaquil"
+    # Ventas y gastos del día: una sola fila del resumen diario
+    summary = db.query(models.DailyLocationSummary).filter(
+        models.DailyLocationSummary.location_id == location_id,
+        models.DailyLocationSummary.summary_date == target_date
+    ).first()
 
-    total_sales = db.query(func.sum(models.Sale.total_amount)).filter(
-        models.Sale.location_id == location_id,
-        func.date(func.timezone(app_timezone, models.Sale.created_at)) == target_date
-    ).scalar() or 0.0
+    total_sales = summary.sales_total if summary else 0.0
+    # Solo cuentan egresos de la CAJA DE VENTAS (sin cierres); la Caja Chica es un fondo aparte.
+    total_expenses = summary.expenses_total if summary else 0.0
 
-    # Calcula gastos totales del día en la ubicación
-    # CORRECCIÓN: Solo sumamos gastos que salieron de la CAJA DE VENTAS (dinero del día).
-    # La Caja Chica es un fondo aparte y no debe afectar el balance diario de ventas.
-    cash_accounts = db.query(models.CashAccount).filter(
-        models.CashAccount.location_id == location_id,
-        models.CashAccount.account_type == 'CAJA_VENTAS' 
-    ).all()
-    account_ids = [acc.id for acc in cash_accounts]
-
-    total_expenses = 0.0
-    if account_ids:
-        # Reutilizamos la variable app_timezone que definimos arriba
-        total_expenses = db.query(func.sum(models.CashTransaction.amount)).filter(
-            models.CashTransaction.account_id.in_(account_ids),
-            models.CashTransaction.amount < 0,
-            # --- NUEVO FILTRO: Excluir Cierres de Caja ---
-            # Usamos NOT ILIKE para que ignore mayúsculas/minúsculas
-            models.CashTransaction.description.notilike("CIERRE DE CAJA%"), 
-            # ---------------------------------------------
-            func.date(func.timezone(app_timezone, models.CashTransaction.timestamp)) == target_date
-        ).scalar() or 0.0
-    total_expenses = abs(total_expenses)
-
-    # --- SECCIÓN CORREGIDA ---
-    # Cuenta las órdenes de trabajo por estado
-    status_counts = db.query(models.WorkOrder.status, func.count(models.WorkOrder.id)).filter(
-        models.WorkOrder.location_id == location_id
-    ).group_by(models.WorkOrder.status).all()
+    # Conteo de órdenes por estado: la última foto guardada (si no hay, se cuenta en vivo)
+    latest_counts = db.query(models.DailyLocationSummary.work_order_counts).filter(
+        models.DailyLocationSummary.location_id == location_id,
+        models.DailyLocationSummary.summary_date <= target_date,
+        models.DailyLocationSummary.work_order_counts != None
+    ).order_by(models.DailyLocationSummary.summary_date.desc()).first()
+
+    if latest_counts:
+        status_counts = latest_counts[0].items()
+    else:
+        status_counts = db.query(models.WorkOrder.status, func.count(models.WorkOrder.id)).filter(
+            models.WorkOrder.location_id == location_id
+        ).group_by(models.WorkOrder.status).all()
 
     # 1. Creamos el diccionario con las claves CORRECTAS y valor 0
     work_order_summary = {
@@ -2055,7 +2420,7 @@ def get_dashboard_summary(db: Session, location_id: int, target_date: date):
     # --- FIN DE LA SECCIÓN CORREGIDA ---
 
     # --- NUEVO: Obtener la meta de la sucursal ---
-    current_location = get_location(db, location_id)
+    current_location = get_location_info(db, location_id)
     # BLINDAJE: Si daily_goal es None en la base de datos, usamos 0.0
     goal = 0.0
     if current_location and current_location.daily_goal is not None:
@@ -2069,21 +2434,58 @@ def get_dashboard_summary(db: Session, location_id: int, target_date: date):
         "work_order_summary": work_order_summary
     }
 
-def get_inventory_audit(db: Session, start_date: date | None = None, end_date: date | None = None, user_id: int | None = None):
-    query = db.query(models.InventoryMovement).options(
-        joinedload(models.InventoryMovement.product),
-        joinedload(models.InventoryMovement.location),
-        joinedload(models.InventoryMovement.user)
-    )
+# --- KARDEX (AUDITORÍA DE MOVIMIENTOS) ---
+# Un año de movimientos de una empresa grande son cientos de miles de filas:
+# nunca se cargan todas. Se proyectan solo las columnas necesarias (tuplas,
+# no objetos ORM) y se entregan por páginas (cursor) o en streaming (CSV/NDJSON).
+KARDEX_PAGE_ORDER = (models.InventoryMovement.timestamp, models.InventoryMovement.id)
+KARDEX_MAX_PAGE_SIZE = 1000
 
-    if start_date:
-        query = query.filter(func.date(models.InventoryMovement.timestamp) >= start_date)
-    if end_date:
-        query = query.filter(func.date(models.InventoryMovement.timestamp) <= end_date)
+def kardex_query(
+    db: Session,
+    company_id: int,
+    start_date: date | None = None,
+    end_date: date | None = None,
+    user_id: int | None = None,
+    product_id: int | None = None,
+    location_id: int | None = None,
+    movement_type: str | None = None
+):
+    """Consulta (sin ordenar) de los movimientos DE MI EMPRESA, con los filtros dados."""
+    query = db.query(
+        models.InventoryMovement.id,
+        models.InventoryMovement.timestamp,
+        models.InventoryMovement.quantity_change,
+        models.InventoryMovement.movement_type,
+        models.InventoryMovement.reference_id,
+        models.InventoryMovement.product_id,
+        models.Product.sku,
+        models.Product.name.label("product_name"),
+        models.InventoryMovement.location_id,
+        models.Location.name.label("location_name"),
+        models.InventoryMovement.user_id,
+        models.User.email.label("user_email"),
+    ).join(models.Product, models.InventoryMovement.product_id == models.Product.id)\
+     .join(models.Location, models.InventoryMovement.location_id == models.Location.id)\
+     .join(models.User, models.InventoryMovement.user_id == models.User.id)\
+     .filter(models.Product.company_id == company_id)
+
+    query = query.filter(*date_range_filter(models.InventoryMovement.timestamp, start_date, end_date))
     if user_id:
         query = query.filter(models.InventoryMovement.user_id == user_id)
+    if product_id:
+        query = query.filter(models.InventoryMovement.product_id == product_id)
+    if location_id:
+        query = query.filter(models.InventoryMovement.location_id == location_id)
+    if movement_type:
+        query = query.filter(models.InventoryMovement.movement_type == movement_type)
+    return query
 
-    return query.order_by(models.InventoryMovement.timestamp.desc()).all()
+def get_inventory_audit(db: Session, company_id: int, limit: int = 200, cursor: str | None = None, **filters):
+    """Una página del Kardex (lo más reciente primero). 'filters' son los de kardex_query."""
+    limit = max(1, min(limit, KARDEX_MAX_PAGE_SIZE))
+    query = kardex_query(db, company_id, **filters)
+    return _paginate(query, KARDEX_PAGE_ORDER, 0, limit, cursor)
 
 # --- INICIO DE NUESTRO CÓDIGO (Buscador de Productos Escasos - BLINDADO) ---
 def get_low_stock_items(db: Session, user: models.User, threshold: int = 5):
@@ -2136,8 +2538,7 @@ def get_personnel_report(db: Session, start_date: date, end_date: date, user_id:
     query = db.query(models.Shift).join(models.User).join(models.Location)
     
     # Filtros de fecha (usamos la fecha de inicio del turno)
-    query = query.filter(func.date(models.Shift.start_time) >= start_date)
-    query = query.filter(func.date(models.Shift.start_time) <= end_date)
+    query = query.filter(*date_range_filter(models.Shift.start_time, start_date, end_date))
     
     if user_id:
         query = query.filter(models.Shift.user_id == user_id)
@@ -2282,7 +2683,7 @@ def check_active_notifications(db: Session, user_id: int, event_type: str, compa
     if any(r.condition == "FIRST_SHIFT" for r in rules):
          shifts_today_count = db.query(models.Shift).filter(
             models.Shift.user_id == user_id,
-            func.date(models.Shift.start_time) == today
+            *date_range_filter(models.Shift.start_time, today, today)
         ).count()
 
     for rule in rules:
@@ -2316,7 +2717,7 @@ def get_customer_by_id_card(db: Session, id_card: str, company_id: int):
         models.Customer.company_id == company_id
     ).first()
 
-def get_customers(db: Session, company_id: int, skip: int = 0, limit: int = 100, search: str | None = None):
+def get_customers(db: Session, company_id: int, skip: int = 0, limit: int = 100, search: str | None = None, cursor: str | None = None):
     # Cargamos la relación 'location' para saber el nombre de la sucursal
     query = db.query(models.Customer).filter(models.Customer.company_id == company_id).options(joinedload(models.Customer.location))
     if search:
@@ -2327,7 +2728,8 @@ def get_customers(db: Session, company_id: int, skip: int = 0, limit: int = 100,
                 func.lower(models.Customer.id_card).like(search_term)
             )
         )
-    return query.order_by(models.Customer.name).offset(skip).limit(limit).all()
+    # Orden alfabético (A-Z); el id desempata clientes con el mismo nombre
+    return _paginate(query, CUSTOMER_PAGE_ORDER, skip, limit, cursor, descending=False)
 
 def create_customer(db: Session, customer: schemas.CustomerCreate, company_id: int, location_id: int | None = None):
     # 1. Validar Integridad: Verificar si la Cédula ya existe en ESTA empresa
@@ -2405,9 +2807,12 @@ def process_refund(db: Session, refund: schemas.RefundCreate, user: models.User,
             amount = refund.amount * -1, # Negativo porque sale dinero
             description = f"DEVOLUCIÓN EFECTIVO VENTA #{sale.id}: {refund.reason} (Aut: {user.email})",
             user_id = user.id,
-            account_id = cash_account.id
+            account_id = cash_account.id,
+            transaction_type = CASH_TX_REFUND,
+            sale_id = sale.id
         )
         db.add(transaction)
+        _record_cash_expense(db, cash_account, transaction.amount, transaction.transaction_type)
         db.commit()
         return {"status": "success", "message": "Dinero devuelto de caja exitosamente."}
 
@@ -2537,6 +2942,8 @@ def update_company_logo(db: Session, logo_url: str, company_id: int):
     db_settings.logo_url = logo_url
     db.commit()
     db.refresh(db_settings)
+    # Olvidamos el logo ya decodificado en este proceso (pdf_worker lo detecta por URL/mtime)
+    pdf_utils.invalidate_company_logo(db_settings.id)
     return db_settings
 
 
@@ -2608,80 +3015,90 @@ def deliver_unrepaired_with_sale(db: Session, work_order_id: int, diagnostic_fee
 # --- FIN DE NUESTRO CÓDIGO ---
 
 # --- INICIO DE NUESTRO CÓDIGO (Lógica de Arqueo de Caja DETALLADA v3) ---
-def get_cash_closure_report_data(db: Session, account_id: int, closure_id: int | None = None):
-    """
-    Calcula totales y busca DETALLES DE PRODUCTOS para el reporte.
-    """
+def _closure_boundaries(db: Session, account_id: int, closure_id: int | None):
+    """(inicio, fin, cierre) del periodo: desde el cierre anterior hasta el pedido (o hasta ahora)."""
     from datetime import datetime
-    
-    # 1. Definir el rango de tiempo (Igual que antes)
+
+    closures = db.query(models.CashTransaction).filter(
+        models.CashTransaction.account_id == account_id,
+        models.CashTransaction.transaction_type == CASH_TX_CLOSURE
+    )
     if closure_id:
         target_closure = db.query(models.CashTransaction).filter(models.CashTransaction.id == closure_id).first()
         if not target_closure: raise ValueError("Cierre no encontrado")
         end_time = target_closure.timestamp
-        previous_closure = db.query(models.CashTransaction).filter(
-            models.CashTransaction.account_id == account_id,
-            models.CashTransaction.description.like("CIERRE DE CAJA%"),
+        previous_closure = closures.filter(
             models.CashTransaction.timestamp < end_time
         ).order_by(models.CashTransaction.timestamp.desc()).first()
-        start_time = previous_closure.timestamp if previous_closure else datetime.min
     else:
-        last_closure = db.query(models.CashTransaction).filter(
-            models.CashTransaction.account_id == account_id,
-            models.CashTransaction.description.like("CIERRE DE CAJA%")
-        ).order_by(models.CashTransaction.timestamp.desc()).first()
-        start_time = last_closure.timestamp if last_closure else datetime.min
+        target_closure = None
+        previous_closure = closures.order_by(models.CashTransaction.timestamp.desc()).first()
         end_time = func.now()
+    start_time = previous_closure.timestamp if previous_closure else datetime.min
+    return start_time, end_time, target_closure
 
-    # 2. Obtenemos movimientos de CAJA
-    transactions = db.query(models.CashTransaction).filter(
-        models.CashTransaction.account_id == account_id,
-        models.CashTransaction.timestamp > start_time,
-        models.CashTransaction.timestamp < end_time
-    ).order_by(models.CashTransaction.timestamp.asc()).all()
 
+def get_cash_closure_report_data(db: Session, account_id: int, closure_id: int | None = None):
+    """
+    Calcula totales y busca DETALLES DE PRODUCTOS para el reporte.
+    Una sola consulta: cada movimiento trae su venta (sale_id) con el resumen de
+    items armado en SQL, y los totales del periodo como funciones de ventana.
+    """
+    from datetime import datetime
+
+    # 1. Definir el rango de tiempo
+    start_time, end_time, target_closure = _closure_boundaries(db, account_id, closure_id)
+
+    # 2. Movimientos de CAJA + venta de origen + totales, todo en la BD
+    tx = models.CashTransaction
+    is_sale = and_(tx.amount > 0, tx.transaction_type == CASH_TX_SALE)
+    is_income = and_(tx.amount > 0, tx.transaction_type != CASH_TX_SALE)
+    items_summary = db.query(
+        func.string_agg(
+            func.concat(models.SaleItem.quantity, "x ", models.SaleItem.description),
+            aggregate_order_by(literal_column("', '"), models.SaleItem.id)
+        )
+    ).filter(models.SaleItem.sale_id == tx.sale_id).correlate(tx).scalar_subquery()
+
+    rows = db.query(
+        tx.timestamp,
+        tx.description,
+        tx.amount,
+        models.Sale.id.label("sale_id"),
+        models.Sale.customer_name,
+        case((is_sale, items_summary), else_=None).label("items_summary"),
+        case((is_sale, "sale"), (is_income, "income"), else_="expense").label("kind"),
+        func.sum(case((is_sale, tx.amount), else_=0.0)).over().label("total_cash_sales"),
+        func.sum(case((is_income, tx.amount), else_=0.0)).over().label("total_incomes"),
+        func.sum(case((tx.amount <= 0, -tx.amount), else_=0.0)).over().label("total_expenses"),
+    ).outerjoin(models.Sale, models.Sale.id == tx.sale_id)\
+     .filter(
+        tx.account_id == account_id,
+        tx.transaction_type != CASH_TX_CLOSURE,
+        tx.timestamp > start_time,
+        tx.timestamp < end_time
+    ).order_by(tx.timestamp.asc()).all()
+
+    first = rows[0] if rows else None
     summary = {
         "start_time": start_time if start_time != datetime.min else None,
         "end_time": end_time if isinstance(end_time, datetime) else datetime.now(),
-        "total_cash_sales": 0.0, "total_incomes": 0.0, "total_expenses": 0.0, "final_balance": 0.0,
-        "closure_amount": abs(target_closure.amount) if closure_id and target_closure else 0.0,
+        "total_cash_sales": float(first.total_cash_sales) if first else 0.0,
+        "total_incomes": float(first.total_incomes) if first else 0.0,
+        "total_expenses": float(first.total_expenses) if first else 0.0,
+        "final_balance": 0.0,
+        "closure_amount": abs(target_closure.amount) if target_closure else 0.0,
         "sales_list": [], "expenses_list": [], "incomes_list": []
     }
 
-    for t in transactions:
-        if "CIERRE DE CAJA" in t.description.upper(): continue
-
-        item = { "time": t.timestamp, "description": t.description, "amount": abs(t.amount), "details": "" }
-
-        if t.amount > 0:
-            if "Venta #" in t.description or "Ingreso Venta" in t.description:
-                summary["total_cash_sales"] += t.amount
-                
-                # --- AQUÍ ESTÁ LA MAGIA: BUSCAR DETALLES DE LA VENTA ---
-                # Intentamos extraer el ID de la venta del string "Ingreso Venta #15..."
-                try:
-                    import re
-                    match = re.search(r'Venta #(\d+)', t.description)
-                    if match:
-                        sale_id = int(match.group(1))
-                        sale = db.query(models.Sale).options(joinedload(models.Sale.items)).filter(models.Sale.id == sale_id).first()
-                        if sale:
-                            # Armamos el detalle: "Cliente: Juan | Items: 1x Cargador..."
-                            client_info = sale.customer_name if sale.customer_name else "Consumidor Final"
-                            products_info = ", ".join([f"{i.quantity}x {i.description}" for i in sale.items])
-                            item["description"] = f"Venta #{sale.id} - {client_info}" # Reemplazamos la descripción genérica
-                            item["details"] = products_info # Guardamos los productos aparte
-                except Exception as e:
-                    print(f"No se pudo detallar venta {t.description}: {e}")
-                # -------------------------------------------------------
-                
-                summary["sales_list"].append(item)
-            else:
-                summary["total_incomes"] += t.amount
-                summary["incomes_list"].append(item)
-        else:
-            summary["total_expenses"] += abs(t.amount)
-            summary["expenses_list"].append(item)
+    for row in rows:
+        item = { "time": row.timestamp, "description": row.description, "amount": abs(row.amount), "details": "" }
+        if row.kind == "sale" and row.sale_id:
+            # "Venta #15 - Juan" y aparte "1x Cargador, 2x Mica"
+            client_info = row.customer_name if row.customer_name else "Consumidor Final"
+            item["description"] = f"Venta #{row.sale_id} - {client_info}"
+            item["details"] = row.items_summary or ""
+        summary[f"{row.kind}s_list"].append(item) # sales_list / incomes_list / expenses_list
 
     summary["final_balance"] = summary["total_cash_sales"] + summary["total_incomes"] - summary["total_expenses"]
     if not closure_id: summary["closure_amount"] = summary["final_balance"]
@@ -2752,9 +3169,11 @@ def create_expense(db: Session, expense: schemas.ExpenseCreate, user: models.Use
             amount=expense.amount * -1, # Negativo = Salida
             description=f"GASTO #{db_expense.id}: {expense.description}",
             user_id=user.id,
-            account_id=expense.account_id
+            account_id=expense.account_id,
+            transaction_type=CASH_TX_EXPENSE
         )
         db.add(transaction)
+        _record_cash_expense(db, account, transaction.amount, transaction.transaction_type)
 
     db.commit()
     db.refresh(db_expense)
@@ -2783,13 +3202,8 @@ def get_expenses(
     if location_id:
         query = query.filter(models.Expense.location_id == location_id)
 
-    # Filtro por Fecha Inicio
-    if start_date:
-        query = query.filter(func.date(models.Expense.expense_date) >= start_date)
-
-    # Filtro por Fecha Fin
-    if end_date:
-        query = query.filter(func.date(models.Expense.expense_date) <= end_date)
+    # Filtro por Fechas (inicio y fin)
+    query = query.filter(*date_range_filter(models.Expense.expense_date, start_date, end_date))
 
     # Ordenar: Lo más reciente primero
     return query.order_by(models.Expense.expense_date.desc()).offset(skip).limit(limit).all()
@@ -2817,14 +3231,12 @@ def generate_financial_report(
     # Filtros base para fechas y EMPRESA
     date_filter_sales = and_(
         models.Sale.company_id == company_id, # <--- Filtro de empresa
-        func.date(models.Sale.created_at) >= start_date,
-        func.date(models.Sale.created_at) <= end_date
+        *date_range_filter(models.Sale.created_at, start_date, end_date)
     )
     
     date_filter_expenses = and_(
         models.Expense.company_id == company_id, # <--- Filtro de empresa
-        func.date(models.Expense.expense_date) >= start_date,
-        func.date(models.Expense.expense_date) <= end_date
+        *date_range_filter(models.Expense.expense_date, start_date, end_date)
     )
 
     # Filtro opcional por sucursal
@@ -2915,8 +3327,7 @@ def get_top_sellers(db: Session, company_id: int, start_date: date, end_date: da
         func.sum(models.Sale.total_amount).label("total_sales")
     ).join(models.Sale).filter(
         models.Sale.company_id == company_id,
-        func.date(models.Sale.created_at) >= start_date,
-        func.date(models.Sale.created_at) <= end_date
+        *date_range_filter(models.Sale.created_at, start_date, end_date)
     ).group_by(models.User.id).order_by(desc("total_sales")).limit(5).all()
 
 # ===================================================================
@@ -2930,7 +3341,8 @@ def get_transfers(
     limit: int = 100,
     status: str | None = None,
     location_id: int | None = None,
-    force_filter: bool = False # <--- NUEVO PARÁMETRO DE SEGURIDAD
+    force_filter: bool = False, # <--- NUEVO PARÁMETRO DE SEGURIDAD
+    cursor: str | None = None
 ):
     """
     Lista los envíos de mercadería.
@@ -2955,7 +3367,7 @@ def get_transfers(
             )
         )
 
-    return query.order_by(models.Transfer.created_at.desc()).offset(skip).limit(limit).all()
+    return _paginate(query, TRANSFER_PAGE_ORDER, skip, limit, cursor)
 
 def get_transfer(db: Session, transfer_id: int):
     """Obtiene el detalle completo de un envío (con productos y nombres)."""
@@ -2987,7 +3399,7 @@ def create_transfer(db: Session, transfer_in: schemas.TransferCreate, user: mode
     
     # Si no encontramos bodega hija, asumimos que la ubicación YA ES la bodega
     if not source_bodega:
-        current_loc = get_location(db, location_id=origin_id_to_use)
+        current_loc = get_location_info(db, location_id=origin_id_to_use)
         if current_loc:
              source_bodega = current_loc
         else:
@@ -2998,7 +3410,7 @@ def create_transfer(db: Session, transfer_in: schemas.TransferCreate, user: mode
     
     if not dest_bodega:
         # Si el destino no tiene hijos, tal vez es una bodega directa
-        dest_loc = get_location(db, transfer_in.destination_location_id)
+        dest_loc = get_location_info(db, transfer_in.destination_location_id)
         if dest_loc: 
              dest_bodega = dest_loc
         else:
@@ -3193,6 +3605,7 @@ def repair_location_hierarchy(db: Session, company_id: int):
     
     if updates_count > 0:
         db.commit()
+        invalidate_location_cache(company_id)
         print(f"✅ Se repararon {updates_count} relaciones de jerarquía.")
     else:
         print("👌 La jerarquía de ubicaciones parece correcta.")
@@ -3263,6 +3676,7 @@ def saas_toggle_user_status(db: Session, user_id: int, is_active: bool):
     user.is_active = is_active
     db.commit()
     db.refresh(user)
+    security.invalidate_principal_cache(user_id=user_id)
     return user
 
 def saas_toggle_company_status(db: Session, company_id: int, is_active: bool):
@@ -3276,6 +3690,7 @@ def saas_toggle_company_status(db: Session, company_id: int, is_active: bool):
     company.is_active = is_active
     db.commit()
     db.refresh(company)
+    security.invalidate_principal_cache(company_id=company_id)
     return company
 
 def saas_update_company_modules(db: Session, company_id: int, modules_config: dict):
@@ -3303,6 +3718,7 @@ def saas_update_company_modules(db: Session, company_id: int, modules_config: di
     
     db.commit()
     db.refresh(company)
+    security.invalidate_principal_cache(company_id=company_id)
     return company
 
 
@@ -3433,6 +3849,7 @@ def saas_register_payment(db: Session, company_id: int, months: int, plan_type:
 
     db.commit()
     db.refresh(company)
+    security.invalidate_principal_cache(company_id=company.id)
     return company
 # -------------------------------------------------
 
@@ -3612,6 +4029,12 @@ def reset_demo_company_data(db: Session, company_id: int):
             models.Customer.created_at > frozen_point
         ).delete(synchronize_session=False)
 
+        # G. Resumen diario del dashboard: se recalcula con lo que quedó
+        # (en la misma transacción, para no dejar totales de ventas borradas)
+        location_ids = [row[0] for row in db.query(models.Location.id).filter(models.Location.company_id == company_id)]
+        for location_id in location_ids:
+            _rebuild_daily_location_summary(db, location_id)
+
         db.commit()
         print(f"✨ RESTAURACIÓN COMPLETADA: {company.name} ha vuelto a su estado original (Clientes y Ventas limpiados).")
         return True
@@ -3667,111 +4090,93 @@ def get_sri_config(db: Session, company_id: int):
         "emission_point": settings.sri_emission_point_code
     }
 
-def retry_failed_invoices(db: Session, company_id: int):
+def enqueue_sri_invoice(db: Session, sale: models.Sale):
     """
-    Busca todas las ventas del DÍA ACTUAL que intentaron facturarse pero fallaron,
-    y vuelve a ejecutar el proceso de envío al SRI una por una.
+    Deja la venta en la cola de facturación electrónica (tabla sri_invoice_jobs).
+    Si ya tenía un encargo (ej: falló antes), lo reinicia. NO hace commit.
     """
-    # 1. Definir rango: Solo hoy (para evitar reintentar cosas viejas accidentalmente)
-    # Si quisieras más días, cambia esta lógica, pero por seguridad empezamos con hoy.
-    today = date.today()
-    
-    # 2. Buscar ventas fallidas
-    # Criterio: Tienen estado devuelto/error Y NO son notas de venta simples (NONE)
-    failed_sales = db.query(models.Sale).filter(
+    job = db.query(models.SriInvoiceJob).filter(models.SriInvoiceJob.sale_id == sale.id).first()
+    if not job:
+        job = models.SriInvoiceJob(sale_id=sale.id, company_id=sale.company_id)
+        db.add(job)
+
+    job.status = "PENDIENTE"
+    job.attempts = 0
+    job.locked_at = None
+    job.last_error = None
+    job.next_attempt_at = func.now()
+
+    # NO AUTORIZADO: consultar esa clave devolvería lo mismo. Se olvida para que
+    # el worker arme, firme y envíe un comprobante nuevo (DEVUELTA conserva la suya:
+    # el SRI no la registró y se reenvía con la misma).
+    if sale.sri_auth_status == "NO AUTORIZADO":
+        sale.sri_access_key = None
+    sale.sri_auth_status = "PENDIENTE"
+    sale.sri_error_message = None
+    return job
+
+# Estados que NO son error: ya enviadas, en cola o simples notas de venta
+SRI_OK_STATUSES = schemas.SRI_OK_STATUSES
+
+def get_failed_invoices(
+    db: Session,
+    company_id: int,
+    start_date: date | None = None,
+    end_date: date | None = None,
+    location_id: int | None = None,
+    statuses: list[str] | None = None,
+    limit: int | None = None
+):
+    """
+    Ventas con factura electrónica fallida, filtradas por fechas, sucursal y/o estado.
+    Sin 'statuses' se toman todos los estados de error.
+    """
+    # Nunca se toman las que no son error, aunque las pidan en 'statuses'
+    query = db.query(models.Sale).filter(
         models.Sale.company_id == company_id,
-        func.date(models.Sale.created_at) == today,
-        models.Sale.sri_auth_status.notin_(["RECIBIDA", "AUTORIZADO", "NONE"])
-    ).all()
-    
-    results = {
-        "processed": 0,
-        "success": 0,
-        "failed": 0,
-        "details": []
-    }
-    
-    # 3. Configuración SRI
-    sri_config = get_sri_config(db, company_id)
-    company_settings = get_company_settings(db, company_id)
-    
-    if not sri_config:
-        raise ValueError("No hay firma electrónica configurada para reintentar.")
+        models.Sale.sri_auth_status.notin_(SRI_OK_STATUSES)
+    )
 
-    print(f"🔄 Reintentando {len(failed_sales)} facturas fallidas...")
+    if statuses:
+        query = query.filter(models.Sale.sri_auth_status.in_(statuses))
 
-    for sale in failed_sales:
-        results["processed"] += 1
-        try:
-            # --- REUTILIZAMOS LA LÓGICA DE CREATE_SALE (MODO RESCATE) ---
-            
-            # A. Preparar datos
-            venta_data = {
-                "cliente_nombre": sale.customer_name,
-                "cliente_id": sale.customer_ci,
-                "cliente_email": sale.customer_email or "consumidor@final.com",
-                "cliente_direccion": sale.customer_address or "Ciudad",
-                "subtotal": sale.subtotal_amount,
-                "total": sale.total_amount,
-                "items": []
-            }
-            for item in sale.items:
-                venta_data["items"].append({
-                    "nombre": item.description,
-                    "cantidad": item.quantity,
-                    "precio": item.unit_price
-                })
-
-            # B. Generar Clave (Usamos la misma fecha de hoy para no complicar el secuencial)
-            secuencial = str(sale.id).zfill(9)
-            now = datetime.now()
-            
-            clave_acceso = sri_utils.generar_clave_acceso(
-                fecha=now,
-                tipo_comprobante="01", 
-                ruc=sri_config["ruc"],
-                ambiente=sri_config["env"],
-                serie=f"{sri_config['establishment']}{sri_config['emission_point']}",
-                numero=secuencial,
-                codigo_numerico="12345678"
-            )
+    query = query.filter(*date_range_filter(models.Sale.created_at, start_date, end_date))
+    if location_id:
+        query = query.filter(models.Sale.location_id == location_id)
 
-            sri_config_temp = sri_config.copy()
-            sri_config_temp.update({
-                "razon_social": company_settings.name,
-                "direccion": company_settings.address or "Matriz",
-                "clave_acceso": clave_acceso,
-                "secuencial": secuencial,
-                "fecha_emision": now.strftime("%d/%m/%Y")
-            })
+    query = query.order_by(models.Sale.id)
+    if limit:
+        query = query.limit(limit)
+    return query.all()
 
-            # C. Proceso Técnico
-            xml_raw = sri_utils.crear_xml_factura(venta_data, sri_config_temp)
-            xml_signed = sri_utils.firmar_xml(xml_raw, sri_config["signature_path"], sri_config["password"])
-            respuesta_sri = sri_utils.enviar_comprobante_sri(xml_signed, ambiente=sri_config["env"])
+def retry_failed_invoices(
+    db: Session,
+    company_id: int,
+    start_date: date | None = None,
+    end_date: date | None = None,
+    location_id: int | None = None
+):
+    """
+    Vuelve a ENCOLAR las facturas fallidas del rango (mismo criterio que el
+    reenvío masivo: get_failed_invoices). El envío real lo hacen los workers
+    de la cola SRI.
+    """
+    # Sin firma no tiene sentido encolar
+    if not get_sri_config(db, company_id):
+        raise ValueError("No hay firma electrónica configurada para reintentar.")
 
-            # D. Actualizar Venta
-            sale.sri_access_key = clave_acceso
-            sale.sri_auth_status = respuesta_sri["status"]
-            sale.sri_auth_date = now
-            
-            if respuesta_sri["status"] == "RECIBIDA":
-                sale.sri_error_message = None # Limpiamos error previo
-                results["success"] += 1
-                results["details"].append(f"Venta #{sale.id}: RECIBIDA")
-            else:
-                detalles = respuesta_sri.get("detalles", [])
-                msg = " | ".join(detalles) if detalles else respuesta_sri.get("mensaje")
-                sale.sri_error_message = msg
-                results["failed"] += 1
-                results["details"].append(f"Venta #{sale.id}: FALLÓ - {msg}")
-
-            db.commit() # Guardamos cada intento individualmente
+    failed_sales = get_failed_invoices(
+        db, company_id, start_date=start_date, end_date=end_date, location_id=location_id
+    )
+    for sale in failed_sales:
+        enqueue_sri_invoice(db, sale)
+    db.commit()
 
-        except Exception as e:
-            results["failed"] += 1
-            sale.sri_error_message = f"Error Crítico: {str(e)}"
-            db.commit()
-            results["details"].append(f"Venta #{sale.id}: CRÍTICO - {str(e)}")
+    print(f"🔄 {len(failed_sales)} facturas fallidas devueltas a la cola SRI.")
 
-    return results
\ No newline at end of file
+    return {
+        "processed": len(failed_sales),
+        "success": len(failed_sales), # Encoladas correctamente
+        "failed": 0,
+        "details": [f"Venta #{sale.id}: EN COLA" for sale in failed_sales]
+    }
\ No newline at end of file
@@ -1,24 +1,229 @@
 import os
-from sqlalchemy import create_engine
+import threading
+import time
+from sqlalchemy import create_engine, event, exc, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
 # Leemos la variable de entorno que definimos en docker-compose
 SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL")
 
+# --- CONFIGURACIÓN DEL POOL DE CONEXIONES (variables de entorno) ---
+# Los endpoints síncronos de FastAPI corren en un threadpool (40 hilos por defecto),
+# así que el pool por defecto (5 + 10) se quedaba corto en horas pico.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))          # Segundos esperando una conexión libre
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))        # Renovar conexiones cada 30 min
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "0"))  # 0 = sin límite
+
+# --- MÉTRICAS DEL POOL ---
+# Solo con eventos públicos del pool (connect / checkout / checkin) y
+# pool.checkedout()/overflow(): nada de métodos internos de SQLAlchemy.
+# - Conexiones nuevas, préstamos y cuánto tiempo se retiene cada conexión: eventos.
+# - Espera por una conexión libre: se mide al abrir la sesión de cada petición
+#   (get_db / get_report_db), que pide su conexión con Session.connection().
+# Histograma de esperas (límite superior en ms de cada cubeta).
+# Si hay réplica, sus métricas se suman en las mismas.
+POOL_WAIT_BUCKETS_MS = [1, 5, 10, 50, 100, 500, 1000, 5000]
+
+_pool_metrics_lock = threading.Lock()
+_pool_metrics = {
+    "connects": 0,
+    "checkouts": 0,
+    "timeouts": 0,
+    "wait_samples": 0,
+    "max_wait_ms": 0.0,
+    "total_wait_ms": 0.0,
+    "wait_histogram": [0] * (len(POOL_WAIT_BUCKETS_MS) + 1),  # La última cubeta es "más de 5000 ms"
+    "max_held_ms": 0.0,
+    "total_held_ms": 0.0,
+    "checkins": 0,
+}
+
+def _record_wait(wait_ms: float, timed_out: bool = False):
+    with _pool_metrics_lock:
+        if timed_out:
+            _pool_metrics["timeouts"] += 1
+        _pool_metrics["wait_samples"] += 1
+        _pool_metrics["total_wait_ms"] += wait_ms
+        _pool_metrics["max_wait_ms"] = max(_pool_metrics["max_wait_ms"], wait_ms)
+        for i, limit in enumerate(POOL_WAIT_BUCKETS_MS):
+            if wait_ms <= limit:
+                _pool_metrics["wait_histogram"][i] += 1
+                break
+        else:
+            _pool_metrics["wait_histogram"][-1] += 1
+
+def _on_connect(dbapi_connection, connection_record):
+    with _pool_metrics_lock:
+        _pool_metrics["connects"] += 1
+
+def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+    connection_record.info["checked_out_at"] = time.perf_counter()
+    with _pool_metrics_lock:
+        _pool_metrics["checkouts"] += 1
+
+def _on_checkin(dbapi_connection, connection_record):
+    checked_out_at = connection_record.info.pop("checked_out_at", None)
+    if checked_out_at is None:
+        return
+    held_ms = (time.perf_counter() - checked_out_at) * 1000
+    with _pool_metrics_lock:
+        _pool_metrics["checkins"] += 1
+        _pool_metrics["total_held_ms"] += held_ms
+        _pool_metrics["max_held_ms"] = max(_pool_metrics["max_held_ms"], held_ms)
+
+def _instrument(engine):
+    event.listen(engine, "connect", _on_connect)
+    event.listen(engine, "checkout", _on_checkout)
+    event.listen(engine, "checkin", _on_checkin)
+    return engine
+
+def _open_timed_session(session_factory):
+    """Abre la sesión y pide ya su conexión, midiendo cuánto esperó al pool."""
+    db = session_factory()
+    start = time.perf_counter()
+    try:
+        db.connection()
+    except exc.TimeoutError:
+        _record_wait((time.perf_counter() - start) * 1000, timed_out=True)
+        db.close()
+        raise
+    except Exception:
+        db.close()
+        raise
+    _record_wait((time.perf_counter() - start) * 1000)
+    return db
+
+def _connect_args():
+    args = {}
+    if DB_STATEMENT_TIMEOUT_MS > 0:
+        # Postgres cancela cualquier consulta que pase de este tiempo
+        args["options"] = f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"
+    return args
+
+def _build_engine(url: str):
+    return _instrument(create_engine(
+        url,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING,
+        connect_args=_connect_args(),
+    ))
+
 # Creamos el "motor" de SQLAlchemy. Es el punto de entrada a la base de datos.
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
+engine = _build_engine(SQLALCHEMY_DATABASE_URL)
 
 # Creamos una "Sesión". Cada sesión es una conversación con la base de datos.
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# --- RÉPLICA DE LECTURA (REPORTES) ---
+# Si hay REPLICA_DATABASE_URL, los reportes pesados leen de ahí y no frenan al POS.
+# Si no hay réplica (o va muy atrasada, o no responde), se usa la principal.
+REPLICA_DATABASE_URL = os.getenv("REPLICA_DATABASE_URL")
+REPLICA_MAX_LAG_SECONDS = float(os.getenv("REPLICA_MAX_LAG_SECONDS", "30"))
+REPLICA_LAG_CHECK_SECONDS = 5  # Cada cuánto volvemos a medir el atraso
+
+replica_engine = _build_engine(REPLICA_DATABASE_URL) if REPLICA_DATABASE_URL else None
+ReplicaSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=replica_engine) if replica_engine else None
+
+_replica_lag = {"seconds": None, "checked_at": 0.0}
+_replica_lag_lock = threading.Lock()
+
+# Si la réplica ya aplicó todo lo recibido, el atraso es 0 (aunque la principal no tenga escrituras)
+_REPLICA_LAG_SQL = text("""
+    SELECT CASE
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+""")
+
+def get_replica_lag_seconds():
+    """Atraso de la réplica en segundos (medido cada pocos segundos). None = réplica caída."""
+    now = time.monotonic()
+    with _replica_lag_lock:
+        if now - _replica_lag["checked_at"] < REPLICA_LAG_CHECK_SECONDS:
+            return _replica_lag["seconds"]
+    try:
+        with replica_engine.connect() as conn:
+            lag = float(conn.execute(_REPLICA_LAG_SQL).scalar() or 0)
+    except exc.SQLAlchemyError as e:
+        print(f"⚠️ [DB] Réplica no disponible, usando la principal: {e}")
+        lag = None
+    with _replica_lag_lock:
+        _replica_lag.update(seconds=lag, checked_at=now)
+    return lag
+
+def open_report_session(max_lag_seconds: float | None = None):
+    """
+    Sesión para reportes de SOLO LECTURA.
+    Usa la réplica si existe y su atraso es <= max_lag_seconds (o REPLICA_MAX_LAG_SECONDS);
+    si no, la principal.
+    """
+    if ReplicaSessionLocal is not None:
+        tolerance = REPLICA_MAX_LAG_SECONDS if max_lag_seconds is None else max_lag_seconds
+        lag = get_replica_lag_seconds()
+        if lag is not None and lag <= tolerance:
+            return _open_timed_session(ReplicaSessionLocal)
+    return _open_timed_session(SessionLocal)
+
 # Creamos una clase "Base". Nuestros modelos de la base de datos heredarán de esta clase.
 Base = declarative_base()
 
 # Esta función se encarga de las sesiones de la base de datos.
 def get_db():
-    db = SessionLocal()
+    db = _open_timed_session(SessionLocal)
+    try:
+        yield db
+    finally:
+        db.close()
+
+# Dependencia para endpoints de reportes. 'max_lag_seconds' llega como parámetro
+# de la URL: cada petición puede pedir datos más frescos (0 = siempre la principal
+# salvo que la réplica esté al día).
+def get_report_db(max_lag_seconds: float | None = None):
+    db = open_report_session(max_lag_seconds)
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+def get_pool_stats():
+    """Foto del pool (por proceso): ocupación actual + histograma de esperas."""
+    pool = engine.pool
+    with _pool_metrics_lock:
+        metrics = dict(_pool_metrics)
+        histogram = list(_pool_metrics["wait_histogram"])
+    labels = [f"<= {limit} ms" for limit in POOL_WAIT_BUCKETS_MS] + [f"> {POOL_WAIT_BUCKETS_MS[-1]} ms"]
+    waits = metrics["wait_samples"]
+    checkins = metrics["checkins"]
+    return {
+        "config": {
+            "pool_size": DB_POOL_SIZE,
+            "max_overflow": DB_MAX_OVERFLOW,
+            "pool_timeout_s": DB_POOL_TIMEOUT,
+            "pool_recycle_s": DB_POOL_RECYCLE,
+            "pre_ping": DB_POOL_PRE_PING,
+            "statement_timeout_ms": DB_STATEMENT_TIMEOUT_MS,
+        },
+        "checked_out": pool.checkedout(),
+        "checked_in": pool.checkedin(),
+        "overflow": max(pool.overflow(), 0),
+        "connects": metrics["connects"],
+        "checkouts": metrics["checkouts"],
+        "timeouts": metrics["timeouts"],
+        "avg_wait_ms": round(metrics["total_wait_ms"] / waits, 3) if waits else 0.0,
+        "max_wait_ms": round(metrics["max_wait_ms"], 3),
+        "wait_histogram": dict(zip(labels, histogram)),
+        "avg_held_ms": round(metrics["total_held_ms"] / checkins, 3) if checkins else 0.0,
+        "max_held_ms": round(metrics["max_held_ms"], 3),
+        "replica": {
+            "checked_out": replica_engine.pool.checkedout(),
+            "overflow": max(replica_engine.pool.overflow(), 0),
+            "lag_seconds": _replica_lag["seconds"],
+        } if replica_engine else None,
+    }
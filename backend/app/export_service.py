@@ -0,0 +1,201 @@
+import csv
+import io
+import json
+import os
+import tempfile
+from sqlalchemy.sql import func
+from sqlalchemy.orm import Session
+from openpyxl import Workbook
+from . import models
+
+# ===================================================================
+# --- MOTOR DE EXPORTACIÓN EN STREAMING (EXCEL / CSV / PARQUET) ---
+# ===================================================================
+# La idea: nunca tener todo el inventario en memoria.
+# - Leemos con cursor del servidor (yield_per) en bloques de EXPORT_CHUNK_SIZE.
+# - Excel: openpyxl en modo write_only (las filas van a disco, no a RAM).
+# - CSV: se envía al navegador a medida que se lee.
+# - Parquet: un "row group" por bloque (requiere pyarrow).
+
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "2000"))
+FILE_CHUNK_BYTES = 64 * 1024
+
+EXPORT_FORMATS = {
+    "xlsx": ("application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", "xlsx"),
+    "csv": ("text/csv; charset=utf-8", "csv"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+# Kardex (auditoría): solo formatos que se pueden mandar mientras se leen
+KARDEX_FORMATS = {
+    "csv": ("text/csv; charset=utf-8", "csv"),
+    "ndjson": ("application/x-ndjson", "ndjson"),
+}
+
+INVENTORY_COLUMNS = [
+    "SKU", "Producto", "Categoría", "Precio Venta", "Costo Promedio",
+    "Stock", "Valor Total (Costo)", "Valor Total (Venta)", "Ubicación Reporte"
+]
+
+def iter_inventory_rows(db: Session, company_id: int, category_id: int | None, bodega_id: int | None, location_name: str):
+    """
+    Devuelve (yield) las filas del reporte de inventario, una tupla por producto activo.
+    - Si hay bodega -> solo se suma el stock de ESA bodega.
+    - Si NO hay bodega -> se suma el stock de TODAS las bodegas.
+    """
+    stock_filters = [models.Stock.product_id == models.Product.id]
+    if bodega_id:
+        stock_filters.append(models.Stock.location_id == bodega_id)
+
+    stock_sq = db.query(func.coalesce(func.sum(models.Stock.quantity), 0))\
+        .filter(*stock_filters)\
+        .correlate(models.Product).scalar_subquery()
+
+    query = db.query(
+        models.Product.sku,
+        models.Product.name,
+        models.Category.name.label("category_name"),
+        models.Product.price_3,
+        models.Product.average_cost,
+        stock_sq.label("stock")
+    ).outerjoin(models.Category, models.Product.category_id == models.Category.id)\
+     .filter(models.Product.company_id == company_id, models.Product.is_active == True)
+
+    if category_id:
+        query = query.filter(models.Product.category_id == category_id)
+
+    for row in query.order_by(models.Product.name).yield_per(EXPORT_CHUNK_SIZE):
+        price = row.price_3 or 0.0
+        cost = row.average_cost or 0.0
+        stock = int(row.stock or 0)
+        yield (
+            row.sku,
+            row.name,
+            row.category_name or "Sin Categoría",
+            price,
+            cost,
+            stock,
+            cost * stock,
+            price * stock,
+            location_name
+        )
+
+KARDEX_COLUMNS = [
+    "ID", "Fecha", "SKU", "Producto", "Ubicación", "Cambio", "Tipo", "Referencia", "Usuario"
+]
+# Claves de cada fila en NDJSON (mismo orden que KARDEX_COLUMNS)
+KARDEX_FIELDS = [
+    "id", "timestamp", "sku", "product_name", "location_name",
+    "quantity_change", "movement_type", "reference_id", "user_email"
+]
+
+def iter_kardex_rows(query):
+    """
+    Recorre la consulta de crud.kardex_query (lo más reciente primero) con cursor
+    del servidor y devuelve (yield) una tupla por movimiento.
+    """
+    order = query.order_by(models.InventoryMovement.timestamp.desc(), models.InventoryMovement.id.desc())
+    for row in order.yield_per(EXPORT_CHUNK_SIZE):
+        yield (
+            row.id,
+            row.timestamp.isoformat() if row.timestamp else None,
+            row.sku,
+            row.product_name,
+            row.location_name,
+            row.quantity_change,
+            row.movement_type,
+            row.reference_id,
+            row.user_email,
+        )
+
+def iter_sales_report_rows(query):
+    """
+    Recorre la proyección de crud.sales_report_query (lo más reciente primero)
+    con cursor del servidor, de a EXPORT_CHUNK_SIZE filas.
+    """
+    order = query.order_by(models.Sale.created_at.desc(), models.Sale.id.desc())
+    yield from order.yield_per(EXPORT_CHUNK_SIZE)
+
+def _chunks(rows, size: int = EXPORT_CHUNK_SIZE):
+    """Agrupa un iterador de filas en listas de 'size' elementos."""
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def stream_csv(columns: list[str], rows):
+    """Genera el CSV por bloques (texto), listo para StreamingResponse."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    # BOM para que Excel abra bien las tildes
+    buffer.write("\ufeff")
+    writer.writerow(columns)
+    for chunk in _chunks(rows):
+        writer.writerows(chunk)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+    if buffer.tell():
+        yield buffer.getvalue()
+
+def stream_ndjson(fields: list[str], rows):
+    """Un objeto JSON por línea (NDJSON), enviado por bloques."""
+    for chunk in _chunks(rows):
+        yield "".join(json.dumps(dict(zip(fields, row)), ensure_ascii=False) + "\n" for row in chunk)
+
+def write_xlsx(columns: list[str], rows, sheet_name: str):
+    """
+    Escribe el Excel en modo write_only a un archivo temporal y lo devuelve abierto
+    (posicionado al inicio). La memoria se mantiene plana sin importar las filas.
+    """
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(title=sheet_name)
+    sheet.append(columns)
+    for row in rows:
+        sheet.append(row)
+
+    tmp = tempfile.TemporaryFile()
+    workbook.save(tmp)
+    tmp.seek(0)
+    return tmp
+
+def write_parquet(columns: list[str], rows):
+    """Escribe un Parquet (un row group por bloque) a un archivo temporal."""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ValueError("La exportación Parquet requiere la librería 'pyarrow' en el servidor.")
+
+    tmp = tempfile.TemporaryFile()
+    writer = None
+    try:
+        for chunk in _chunks(rows):
+            table = pa.Table.from_pylist([dict(zip(columns, row)) for row in chunk])
+            if writer is None:
+                writer = pq.ParquetWriter(tmp, table.schema)
+            writer.write_table(table)
+        if writer is None:
+            # Sin filas: escribimos igual el archivo con solo las columnas
+            writer = pq.ParquetWriter(tmp, pa.schema([(col, pa.string()) for col in columns]))
+    finally:
+        if writer is not None:
+            writer.close()
+    tmp.seek(0)
+    return tmp
+
+def iter_file(file_obj):
+    """Lee un archivo temporal por pedazos y lo cierra (se borra solo) al terminar."""
+    try:
+        while True:
+            data = file_obj.read(FILE_CHUNK_BYTES)
+            if not data:
+                break
+            yield data
+    finally:
+        file_obj.close()
@@ -1,9 +1,14 @@
+import numpy as np
 import pandas as pd
 import io
+import os
 import random
 import string
 import unicodedata
-from sqlalchemy.orm import Session, joinedload
+from sqlalchemy import and_
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import func
 from . import models, crud
 
 # --- DICCIONARIO DE COLUMNAS (TU NUEVA PLANTILLA OFICIAL) ---
@@ -71,6 +76,70 @@ def generate_auto_name(tipo, marca, modelo, color, compatibilidad, condicion):
         
     return name
 
+# ===================================================================
+# --- VALIDACIÓN POR COLUMNAS (SIN iterrows) ---
+# ===================================================================
+# Todo se valida con operaciones de pandas sobre la columna completa.
+# Solo al final recorremos las filas una vez para armar la vista previa.
+
+FORBIDDEN_CHARS = ["@", "*", "#", "$", "%", "!", "?"]
+
+def _clean_col(df, col):
+    """Igual que el antiguo clean_str, pero para toda la columna: texto, sin espacios, MAYÚSCULAS."""
+    if col not in df.columns:
+        return pd.Series("", index=df.index)
+    s = df[col]
+    return s.where(s.notna(), "").astype(str).str.strip().str.upper()
+
+def _normalize_col(s):
+    """normalize_text vectorizado: quita tildes (marcas combinantes) de una columna ya en MAYÚSCULAS."""
+    return s.str.normalize("NFD").str.replace(r"[\u0300-\u036f]", "", regex=True)
+
+def _join_nonempty(parts, sep):
+    """Une varias columnas de texto con 'sep', saltando las vacías (como " ".join de una lista filtrada)."""
+    result = pd.Series("", index=parts[0].index)
+    for part in parts:
+        result = result.mask(part != "", result.where(result == "", result + sep) + part)
+    return result
+
+def _price_col(raw, field_name):
+    """Devuelve (precios, mensajes_de_error). Vacío = 0.0; inválido = 0.0 + mensaje."""
+    as_text = raw.astype(str)
+    blank = raw.isna() | (as_text.str.strip() == "")
+    cleaned = as_text.str.replace("$", "", regex=False).str.replace(",", "", regex=False).str.strip()
+    values = pd.to_numeric(cleaned.where(~blank), errors="coerce")
+    invalid = ~blank & values.isna()
+    errors = ("Precio inválido en '" + field_name + "': '" + as_text + "'. Use punto decimal.").where(invalid, "")
+    return values.where(~blank & ~invalid, 0.0).astype(float), errors
+
+def _quantity_col(raw):
+    """Devuelve (cantidades enteras, mensajes_de_error). Vacío = 0."""
+    as_text = raw.astype(str)
+    values = pd.to_numeric(as_text.str.replace(",", "", regex=False).where(raw.notna()), errors="coerce")
+    invalid = raw.notna() & (values.isna() | np.isinf(values))
+    errors = ("Stock '" + as_text + "' no es un número entero.").where(invalid, "")
+    return values.where(raw.notna() & ~invalid, 0).apply(np.trunc).astype(int), errors
+
+def _load_existing_products(db: Session, company_id: int, target_location_id: int):
+    """
+    Proyección liviana de los productos de la empresa: (name, id, sku, price_1, stock en la bodega destino).
+    Nada de cargar objetos ORM ni todos sus stocks.
+    """
+    rows = db.query(
+        models.Product.name,
+        models.Product.id,
+        models.Product.sku,
+        models.Product.price_1,
+        func.coalesce(models.Stock.quantity, 0).label("stock")
+    ).outerjoin(
+        models.Stock,
+        and_(models.Stock.product_id == models.Product.id, models.Stock.location_id == target_location_id)
+    ).filter(models.Product.company_id == company_id).all()
+
+    existing = pd.DataFrame(rows, columns=["name", "db_id", "db_sku", "db_price", "db_stock"])
+    # Si hay nombres repetidos en el sistema, gana el último (igual que el antiguo dict)
+    return existing.drop_duplicates("name", keep="last")
+
 def process_excel_file(file_content: bytes, db: Session, company_id: int, target_location_id: int):
     try:
         df = pd.read_excel(io.BytesIO(file_content))
@@ -87,132 +156,122 @@ def process_excel_file(file_content: bytes, db: Session, company_id: int, target
                 "message": f"Plantilla inválida. Faltan las columnas: {', '.join(missing_cols)}"
             }
 
-        # --- PRE-CARGAR PRODUCTOS EXISTENTES (Optimización) ---
-        # Traemos productos y cargamos SUS STOCKS de una vez para no hacer 1000 consultas
-        existing_products = db.query(models.Product).options(
-            joinedload(models.Product.stock_entries)
-        ).filter(models.Product.company_id == company_id).all()
-        # Mapa por NOMBRE generado (para detectar duplicados exactos)
-        product_map = {p.name: p for p in existing_products}
+        # 1. Normalización de textos (toda la columna de una vez)
+        tipo = _clean_col(df, "TIPO")
+        marca = _clean_col(df, "MARCA")
+        modelo = _clean_col(df, "MODELO")
 
-        for index, row in df.iterrows():
-            row_errors = []
+        # Filas sin TIPO ni MARCA se ignoran (filas vacías del Excel)
+        keep = (tipo != "") | (marca != "")
+        df, tipo, marca, modelo = df[keep], tipo[keep], marca[keep], modelo[keep]
+        if df.empty:
+            return {"status": "success", "stats": stats, "preview": preview_data}
 
-            def clean_str(val):
-                return str(val).strip().upper() if not pd.isna(val) else ""
+        color = _clean_col(df, "COLOR")
+        compat = _clean_col(df, "COMPATIBILIDAD")
+        categoria = _clean_col(df, "CATEGORIA").replace("", "GENERAL")
 
-            tipo = clean_str(row.get("TIPO", ""))
-            marca = clean_str(row.get("MARCA", ""))
-            modelo = clean_str(row.get("MODELO", ""))
-            
-            if not tipo or not marca or not modelo or tipo == "NAN":
-                if not tipo and not marca: continue
-                row_errors.append("Falta TIPO, MARCA o MODELO.")
-
-            forbidden_chars = ["@", "*", "#", "$", "%", "!", "?"]
-            full_text = f"{tipo} {marca} {modelo}"
-            for char in forbidden_chars:
-                if char in full_text:
-                    row_errors.append(f"No use el símbolo '{char}' en los nombres.")
-                    break
-
-            raw_cond = str(row.get("CONDICION", "NUEVO"))
-            condicion = interpret_condition(raw_cond)
-            if not condicion:
-                row_errors.append(f"Condición '{raw_cond}' no válida.")
-
-            def validate_price(val, field_name):
-                if pd.isna(val) or str(val).strip() == "": return 0.0
-                try:
-                    clean_val = str(val).replace("$", "").replace(",", "").strip()
-                    return float(clean_val)
-                except ValueError:
-                    row_errors.append(f"Precio inválido en '{field_name}': '{val}'. Use punto decimal.")
-                    return 0.0
-
-            p_pvp = validate_price(row.get("PRECIO_PVP"), "PVP")
-            p_desc = validate_price(row.get("PRECIO_DESCUENTO"), "DESCUENTO")
-            p_web = validate_price(row.get("PRECIO_WEB"), "WEB")
-            costo = validate_price(row.get("COSTO_PROMEDIO"), "COSTO")
-            
-            qty = 0
-            try:
-                raw_qty = row.get("STOCK_INICIAL")
-                if not pd.isna(raw_qty):
-                    qty = int(float(str(raw_qty).replace(",", "")))
-            except:
-                row_errors.append(f"Stock '{row.get('STOCK_INICIAL')}' no es un número entero.")
-
-            if row_errors:
-                stats["errores"] += 1
+        # 2. Validaciones (cada una produce una columna de mensajes; "" = sin error)
+        error_cols = []
+
+        missing_ttm = (tipo == "") | (marca == "") | (modelo == "") | (tipo == "NAN")
+        error_cols.append(pd.Series("Falta TIPO, MARCA o MODELO.", index=df.index).where(missing_ttm, ""))
+
+        # Símbolos prohibidos: gana el primero de la lista (recorremos al revés y sobreescribimos)
+        full_text = tipo + " " + marca + " " + modelo
+        forbidden_msg = pd.Series("", index=df.index)
+        for char in reversed(FORBIDDEN_CHARS):
+            forbidden_msg = forbidden_msg.mask(
+                full_text.str.contains(char, regex=False),
+                f"No use el símbolo '{char}' en los nombres."
+            )
+        error_cols.append(forbidden_msg)
+
+        # Condición: solo interpretamos los valores DISTINTOS (suelen ser 4 o 5) y mapeamos la columna
+        raw_cond = df["CONDICION"].astype(str)
+        condicion = raw_cond.map({value: interpret_condition(value) for value in raw_cond.unique()})
+        error_cols.append(("Condición '" + raw_cond + "' no válida.").where(condicion.isna(), ""))
+
+        p_pvp, pvp_err = _price_col(df["PRECIO_PVP"], "PVP")
+        p_desc, desc_err = _price_col(df["PRECIO_DESCUENTO"], "DESCUENTO")
+        p_web, web_err = _price_col(df["PRECIO_WEB"], "WEB")
+        costo, costo_err = _price_col(df["COSTO_PROMEDIO"], "COSTO")
+        qty, qty_err = _quantity_col(df["STOCK_INICIAL"])
+        error_cols += [pvp_err, desc_err, web_err, costo_err, qty_err]
+
+        error_msg = _join_nonempty(error_cols, " | ")
+        has_error = error_msg != ""
+
+        # 3. Nombre automático (misma regla que generate_auto_name)
+        name_parts = [part.where(part != "NAN", "") for part in (tipo, marca, modelo, color)]
+        auto_name = _join_nonempty(name_parts, " ")
+        auto_name = auto_name.mask((compat != "") & (compat != "NAN"), auto_name + " (" + compat + ")")
+        auto_name = auto_name.mask(condicion.notna() & (condicion != "NUEVO"), auto_name + " - " + condicion.fillna(""))
+
+        # 4. Detección de duplicados contra el sistema: un merge por nombre
+        existing = _load_existing_products(db, company_id, target_location_id)
+        matches = pd.DataFrame({"name": auto_name}).reset_index().merge(existing, on="name", how="left").set_index("index")
+        is_existing = matches["db_id"].notna() & ~has_error
+
+        # 5. SKU automático para los nuevos (misma regla que generate_auto_sku)
+        p1, p2, p3 = (_normalize_col(part).str[:3].replace("", "GEN") for part in (tipo, marca, modelo))
+        rand = pd.Series(np.random.randint(0, 10000, size=len(df)), index=df.index).astype(str).str.zfill(4)
+        auto_sku = p1 + "-" + p2 + "-" + p3 + "-" + rand
+        final_sku = matches["db_sku"].where(is_existing, auto_sku)
+
+        stats["errores"] = int(has_error.sum())
+        stats["existentes"] = int(is_existing.sum())
+        stats["nuevos"] = len(df) - stats["errores"] - stats["existentes"]
+
+        # 6. Armado de la vista previa (una sola pasada, ya sin validar nada)
+        columns = zip(
+            df.index.tolist(), has_error.tolist(), error_msg.tolist(), is_existing.tolist(),
+            tipo.tolist(), marca.tolist(), modelo.tolist(), color.tolist(), compat.tolist(),
+            condicion.tolist(), categoria.tolist(), auto_name.tolist(), final_sku.tolist(),
+            p_pvp.tolist(), p_desc.tolist(), p_web.tolist(), costo.tolist(), qty.tolist(),
+            matches["db_price"].tolist(), matches["db_stock"].tolist()
+        )
+        for (index, row_has_error, row_error, row_exists, t, b, m, c, comp, cond, cat,
+             name, sku, pvp, desc, web, cost, q, db_price, db_stock) in columns:
+            if row_has_error:
                 preview_data.append({
                     "row_index": index + 2,
                     "status": "ERROR",
-                    "error_msg": " | ".join(row_errors),
-                    "data": {"name": f"{tipo} {marca}..."}
+                    "error_msg": row_error,
+                    "data": {"name": f"{t} {b}..."}
                 })
                 continue
 
-            color = clean_str(row.get("COLOR"))
-            compat = clean_str(row.get("COMPATIBILIDAD"))
-            categoria = clean_str(row.get("CATEGORIA")) or "GENERAL"
-
-            auto_name = generate_auto_name(tipo, marca, modelo, color, compat, condicion)
-            
-            # Buscamos en el mapa precargado
-            existing_product = product_map.get(auto_name)
-
-            row_status = "NUEVO"
-            final_sku = ""
             conflict_details = None
-
-            # --- NUEVO: Stock Actual del Sistema ---
-            current_system_stock = 0
-
-            if existing_product:
-                row_status = "EXISTE"
-                final_sku = existing_product.sku
-                stats["existentes"] += 1
-                
-                # --- CORRECCIÓN DE STOCK ---
-                # Buscamos el stock SOLO en la bodega destino seleccionada
-                stock_entry = next((s for s in existing_product.stock_entries if s.location_id == target_location_id), None)
-                current_system_stock = stock_entry.quantity if stock_entry else 0
-                # ---------------------------
-
+            if row_exists:
                 conflict_details = {
-                    "db_name": existing_product.name,
-                    "db_price": existing_product.price_1, # P1 es PVP
-                    "excel_price": p_pvp,
-                    "db_stock": current_system_stock,     # <--- DATO CLAVE
-                    "excel_stock": qty
+                    "db_name": name,
+                    "db_price": None if pd.isna(db_price) else db_price, # P1 es PVP
+                    "excel_price": pvp,
+                    "db_stock": int(db_stock),     # Stock SOLO en la bodega destino
+                    "excel_stock": q
                 }
-            else:
-                stats["nuevos"] += 1
-                final_sku = generate_auto_sku(tipo, marca, modelo)
-
-            clean_data = {
-                "sku": final_sku,
-                "name": auto_name,
-                "description": f"{tipo} para {marca} {modelo}",
-                "product_type": tipo,
-                "brand": marca,
-                "model": modelo,
-                "color": color,
-                "compatibility": compat,
-                "condition": condicion,
-                "category": categoria,
-                "price_1": p_pvp,
-                "price_2": p_desc,
-                "price_3": p_web,
-                "average_cost": costo,
-                "quantity": qty
-            }
 
             preview_data.append({
                 "row_index": index,
-                "data": clean_data,
-                "status": row_status,
+                "data": {
+                    "sku": sku,
+                    "name": name,
+                    "description": f"{t} para {b} {m}",
+                    "product_type": t,
+                    "brand": b,
+                    "model": m,
+                    "color": c,
+                    "compatibility": comp,
+                    "condition": cond,
+                    "category": cat,
+                    "price_1": pvp,
+                    "price_2": desc,
+                    "price_3": web,
+                    "average_cost": cost,
+                    "quantity": q
+                },
+                "status": "EXISTE" if row_exists else "NUEVO",
                 "conflict": conflict_details
             })
             
@@ -223,4 +282,156 @@ def process_excel_file(file_content: bytes, db: Session, company_id: int, target
         }
 
     except Exception as e:
-        return {"status": "error", "message": f"Error crítico procesando el archivo: {str(e)}"}
\ No newline at end of file
+        return {"status": "error", "message": f"Error crítico procesando el archivo: {str(e)}"}
+
+# ===================================================================
+# --- CONFIRMACIÓN MASIVA (INSERT ... ON CONFLICT EN BLOQUE) ---
+# ===================================================================
+# En vez de procesar fila por fila (consulta, flush, movimiento...), armamos
+# todo en memoria y lo mandamos a la BD en pocas sentencias por bloque.
+# Todo ocurre en la transacción del endpoint: o entra el lote entero o nada.
+
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", "1000"))
+
+PRODUCT_FIELDS = [
+    "name", "description", "product_type", "brand", "model", "color", "compatibility",
+    "condition", "price_1", "price_2", "price_3", "average_cost"
+]
+
+def _chunked(values: list, size: int = IMPORT_CHUNK_SIZE):
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+def _resolve_categories(db: Session, items, company_id: int) -> dict:
+    """Devuelve {NOMBRE_EN_MAYÚSCULAS: category_id}, creando en bloque las que falten."""
+    existing = db.query(models.Category.id, models.Category.name)\
+        .filter(models.Category.company_id == company_id).all()
+    cat_map = {row.name.upper(): row.id for row in existing}
+
+    new_names = {}
+    for item in items:
+        if item.category:
+            name = item.category.strip()
+            if name.upper() not in cat_map:
+                new_names.setdefault(name.upper(), name)
+
+    for chunk in _chunked(list(new_names.values())):
+        created = db.execute(
+            insert(models.Category)
+            .values([{"name": name, "company_id": company_id} for name in chunk])
+            .returning(models.Category.id, models.Category.name)
+        ).all()
+        cat_map.update({row.name.upper(): row.id for row in created})
+    return cat_map
+
+def apply_import_batch(db: Session, items, company_id: int, target_location_id: int, user_id: int):
+    """
+    Ejecuta el lote confirmado por el usuario (lista de ImportItem).
+    - Categorías nuevas: un INSERT por bloque.
+    - Productos: INSERT ... ON CONFLICT (sku, company_id) DO UPDATE por bloque.
+    - Stock (Sumar / Reemplazar) y Kardex: un upsert de stock y un insert de movimientos por bloque.
+    No hace commit (lo hace el endpoint). Devuelve (creados, actualizados).
+    Lanza ValueError si algún ajuste deja stock negativo.
+    """
+    items = [item for item in items if item.action_to_take in ("CREATE", "UPDATE")]
+    if not items:
+        return 0, 0
+
+    cat_map = _resolve_categories(db, items, company_id)
+
+    # 1. Los UPDATE solo aplican a SKUs que ya existen (igual que antes: si no existe, se ignora)
+    update_skus = list({item.sku for item in items if item.action_to_take == "UPDATE"})
+    existing_skus = set()
+    for chunk in _chunked(update_skus):
+        existing_skus.update(sku for (sku,) in db.query(models.Product.sku).filter(
+            models.Product.company_id == company_id,
+            models.Product.sku.in_(chunk)
+        ))
+    items = [item for item in items if item.action_to_take == "CREATE" or item.sku in existing_skus]
+
+    # 2. Una fila por SKU (si el Excel repite un SKU, manda la última; la categoría, la última no vacía)
+    product_rows = {}
+    for item in items:
+        row = product_rows.setdefault(item.sku, {"sku": item.sku, "company_id": company_id, "is_active": True, "category_id": None})
+        row.update({field: getattr(item, field) for field in PRODUCT_FIELDS})
+        if item.category:
+            row["category_id"] = cat_map[item.category.strip().upper()]
+
+    sku_to_id = {}
+    for chunk in _chunked(list(product_rows.values())):
+        stmt = insert(models.Product).values(chunk)
+        update_cols = {field: getattr(stmt.excluded, field) for field in PRODUCT_FIELDS}
+        # Sin categoría en el Excel -> se conserva la del sistema
+        update_cols["category_id"] = func.coalesce(stmt.excluded.category_id, models.Product.category_id)
+        result = db.execute(
+            stmt.on_conflict_do_update(constraint="_sku_company_uc", set_=update_cols)
+            .returning(models.Product.id, models.Product.sku)
+        ).all()
+        sku_to_id.update({row.sku: row.id for row in result})
+
+    # 3. Stock actual en la bodega destino, bloqueado y en orden (sin deadlocks)
+    product_ids = sorted(set(sku_to_id.values()))
+    current_stock = {}
+    for chunk in _chunked(product_ids):
+        locked = db.query(models.Stock.product_id, models.Stock.quantity).filter(
+            models.Stock.location_id == target_location_id,
+            models.Stock.product_id.in_(chunk)
+        ).order_by(models.Stock.product_id).with_for_update().all()
+        current_stock.update({row.product_id: row.quantity for row in locked})
+
+    # 4. Matemática de stock en memoria, en el orden del Excel
+    created_count = 0
+    updated_count = 0
+    stock_deltas = {}
+    movements = []
+    for item in items:
+        product_id = sku_to_id[item.sku]
+        current_qty = current_stock.get(product_id, 0)
+        qty_change = 0
+
+        if item.action_to_take == "CREATE":
+            created_count += 1
+            # Stock Inicial (Siempre es una entrada si es nuevo)
+            if item.quantity > 0:
+                qty_change, movement_type, reference = item.quantity, "CARGA_INICIAL_EXCEL", "IMPORT"
+        else:
+            updated_count += 1
+            # Solo si el usuario decidió tocar el stock (no eligió "Mantener Sistema")
+            if item.stock_action == "REPLACE":
+                # Queremos que el final sea X. Cambio = X - Actual
+                qty_change, movement_type, reference = item.quantity - current_qty, "CORRECCION_INVENTARIO", "IMPORT_UPDATE"
+            elif item.stock_action == "ADD":
+                qty_change, movement_type, reference = item.quantity, "ENTRADA_MERCADERIA", "IMPORT_UPDATE"
+
+        # Solo creamos movimiento si hay diferencia real
+        if qty_change == 0:
+            continue
+        if current_qty + qty_change < 0:
+            raise ValueError(f"Stock insuficiente para '{item.name}'. Disponible: {current_qty}, Necesario: {abs(qty_change)}")
+
+        current_stock[product_id] = current_qty + qty_change
+        stock_deltas[product_id] = stock_deltas.get(product_id, 0) + qty_change
+        movements.append({
+            "product_id": product_id,
+            "location_id": target_location_id,
+            "quantity_change": qty_change,
+            "movement_type": movement_type,
+            "reference_id": reference,
+            "user_id": user_id
+        })
+
+    # 5. Escritura en bloque: stock (upsert sumando la diferencia) y Kardex
+    stock_rows = [
+        {"product_id": product_id, "location_id": target_location_id, "quantity": delta}
+        for product_id, delta in sorted(stock_deltas.items()) if delta != 0
+    ]
+    for chunk in _chunked(stock_rows):
+        stmt = insert(models.Stock).values(chunk)
+        db.execute(stmt.on_conflict_do_update(
+            constraint="_product_location_uc",
+            set_={"quantity": models.Stock.quantity + stmt.excluded.quantity}
+        ))
+    for chunk in _chunked(movements):
+        db.bulk_insert_mappings(models.InventoryMovement, chunk)
+
+    return created_count, updated_count
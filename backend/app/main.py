@@ -1,6 +1,6 @@
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi import FastAPI, Depends, HTTPException, status, Form
+from fastapi import FastAPI, Depends, HTTPException, status, Form, Response
 from fastapi.security import OAuth2PasswordRequestForm
 from typing import List
 from sqlalchemy.orm import Session
@@ -8,7 +8,7 @@ from pydantic import BaseModel
 
 from fastapi import File, UploadFile
 
-from fastapi.responses import StreamingResponse, PlainTextResponse
+from fastapi.responses import StreamingResponse, PlainTextResponse, FileResponse
 from slowapi import Limiter                      # Núcleo del limitador
 # --- AÑADIMOS ESTAS "HERRAMIENTAS DE RELOJERÍA" ---
 from datetime import date, datetime
@@ -28,6 +28,7 @@ from starlette.middleware.base import BaseHTTPMiddleware
 import shutil
 import os
 import uuid
+import json
 import random # <--- Importamos random para generar el código
 import string # <--- Importamos string para letras y números
 import smtplib # <--- NUEVO: El cartero
@@ -90,10 +91,12 @@ class SecurityHeadersMiddleware(BaseHTTPMiddleware):
         return response
 # --- Fin cabeceras de seguridad ---
 
-from . import pdf_utils
+from . import pdf_cache, pdf_worker
 
-from . import models, schemas, crud, security, import_service
-from .database import get_db
+from . import models, schemas, crud, security, import_service, sri_worker, export_service, media_service, media_worker
+from .database import get_db, get_report_db
+from . import database
+from .utils.cursor import next_cursor
 
 app = FastAPI(title="API de Inventarios de Repara Xpress")
 
@@ -117,7 +120,7 @@ app.add_middleware(
     # para evitar errores raros cuando la conexión viaja por internet.
     allow_methods=["*"], 
     allow_headers=["*"], 
-    expose_headers=["Content-Disposition"]
+    expose_headers=["Content-Disposition", "X-Next-Cursor"]
 )
 
 # ===== Rate limiting: limitar intentos de login =====
@@ -190,8 +193,32 @@ def search_parts_public(
     return crud.search_global_parts(db, query=q)
 # --------------------------------------------
 
+# --- PDFs DESDE CACHÉ (ETag / 304) ---
+# La clave del caché ya depende del diseño, de los datos del documento y de la empresa,
+# así que sirve como ETag: si el navegador ya tiene esa versión, respondemos 304
+# sin leer ni dibujar nada.
+def _cached_pdf_response(request: Request, key: str, render, filename: str):
+    etag = f'"{key}"'
+    cache_headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=cache_headers)
+    try:
+        path = pdf_cache.get_or_render(key, render)
+    except TimeoutError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    headers = {**cache_headers, "Content-Disposition": f'inline; filename="{filename}"'}
+    return FileResponse(path, media_type="application/pdf", headers=headers)
+
+# --- PDFs EN EL POOL DE PROCESOS (ver pdf_worker) ---
+def _render_pdf(generator_name: str, *args):
+    """pdf_utils.<generator_name>(*args) dibujado fuera del proceso de la API."""
+    try:
+        return pdf_worker.render(generator_name, *args)
+    except TimeoutError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
 @app.get("/public/view/sale/{public_id}", response_class=StreamingResponse)
-def view_public_sale_receipt(public_id: str, db: Session = Depends(get_db)):
+def view_public_sale_receipt(public_id: str, request: Request, db: Session = Depends(get_db)):
     """
     Permite a un cliente ver su recibo sin iniciar sesión, usando el enlace secreto.
     """
@@ -204,20 +231,12 @@ def view_public_sale_receipt(public_id: str, db: Session = Depends(get_db)):
     # (Usamos el company_id guardado en la venta)
     company_settings = crud.get_company_settings(db, company_id=db_sale.company_id)
 
-    # 3. Generamos el PDF
-    sale_schema = schemas.Sale.model_validate(db_sale)
-    settings_schema = schemas.CompanySettings.model_validate(company_settings)
-    
-    pdf_buffer = pdf_utils.generate_sale_receipt_pdf(sale_schema, settings_schema)
-    
-    # 4. Lo mostramos en el navegador (inline)
-    headers = {
-        "Content-Disposition": f'inline; filename="recibo_{sale_schema.id}.pdf"'
-    }
-    return StreamingResponse(pdf_buffer, media_type="application/pdf", headers=headers)
+    # 3. PDF desde la caché (se genera solo si esa versión no existe) y se muestra inline
+    key, render = pdf_cache.sale_receipt(db_sale, company_settings)
+    return _cached_pdf_response(request, key, render, f"recibo_{db_sale.id}.pdf")
 
 @app.get("/public/view/work-order/{public_id}", response_class=StreamingResponse)
-def view_public_work_order(public_id: str, db: Session = Depends(get_db)):
+def view_public_work_order(public_id: str, request: Request, db: Session = Depends(get_db)):
     """
     Permite a un cliente ver su orden de trabajo sin iniciar sesión.
     """
@@ -228,15 +247,8 @@ def view_public_work_order(public_id: str, db: Session = Depends(get_db)):
     # Usamos la empresa dueña de la orden
     company_settings = crud.get_company_settings(db, company_id=db_work_order.company_id)
 
-    schema_work_order = schemas.WorkOrder.model_validate(db_work_order)
-    schema_settings = schemas.CompanySettings.model_validate(company_settings)
-
-    pdf_buffer = pdf_utils.generate_work_order_pdf(schema_work_order, schema_settings)
-
-    headers = {
-        "Content-Disposition": f'inline; filename="orden_{schema_work_order.work_order_number}.pdf"'
-    }
-    return StreamingResponse(pdf_buffer, media_type="application/pdf", headers=headers)
+    key, render = pdf_cache.work_order_sheet(db_work_order, company_settings)
+    return _cached_pdf_response(request, key, render, f"orden_{db_work_order.work_order_number}.pdf")
 # -------------------------------------------------------------------
 
 # --- INICIO DE NUESTRO CÓDIGO (ASISTENTE DE CONFIGURACIÓN) ---
@@ -417,7 +429,7 @@ def read_current_user_profile(
 ):
     active_shift = crud.get_active_shift_for_user(db, user_id=current_user.id)
     # Creamos un diccionario con los datos y lo pasamos al schema para validación/formato
-    profile_data = current_user.__dict__
+    profile_data = current_user.orm.__dict__
     profile_data['active_shift'] = active_shift
     return profile_data
 
@@ -518,97 +530,68 @@ def read_products_zero_cost(
 def export_inventory_excel(
     location_id: int | None = None,
     category_id: int | None = None,
-    db: Session = Depends(get_db),
+    format: str = "xlsx", # xlsx | csv | parquet
+    max_lag_seconds: float | None = None, # Atraso tolerado de la réplica (para el CSV en streaming)
+    db: Session = Depends(get_report_db),
     current_user: models.User = Depends(security.get_current_user)
 ):
     """
-    Genera un archivo Excel con el inventario actual.
+    Genera un archivo con el inventario actual (Excel, CSV o Parquet) en streaming.
     Permite filtrar por Sucursal (location_id) y Categoría (category_id).
     """
-    from sqlalchemy.orm import joinedload
-    
-    # 1. Construimos la consulta base
-    query = db.query(models.Product).options(
-        joinedload(models.Product.category),
-        joinedload(models.Product.stock_entries).joinedload(models.Stock.location)
-    )
-
-    # 2. Filtro por Categoría
-    if category_id:
-        query = query.filter(models.Product.category_id == category_id)
-
-    # 3. Traemos TODOS los productos activos
-    products = query.filter(models.Product.is_active == True).all()
+    if format not in export_service.EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail="Formato no soportado. Use xlsx, csv o parquet.")
+    if not current_user.company_id:
+        raise HTTPException(status_code=400, detail="Usuario sin empresa.")
 
-    # 4. Buscamos la bodega de la sucursal seleccionada (si aplica)
+    # 1. Buscamos la bodega de la sucursal seleccionada (si aplica)
     target_bodega_id = None
     target_location_name = "Inventario Global"
     
     if location_id:
         # Buscamos la BODEGA de esta sucursal (porque el stock vive en bodegas, no oficinas)
         bodega = crud.get_primary_bodega_for_location(db, location_id=location_id)
+        if not bodega:
+            # Fallback por si acaso es una bodega directa
+            bodega = crud.get_location_info(db, location_id)
         if bodega:
+            # Seguridad: la bodega debe ser de MI empresa
+            if bodega.company_id != current_user.company_id:
+                raise HTTPException(status_code=403, detail="La sucursal no pertenece a tu empresa.")
             target_bodega_id = bodega.id
             target_location_name = bodega.name
-        else:
-            # Fallback por si acaso es una bodega directa
-            loc = crud.get_location(db, location_id)
-            if loc: 
-                target_bodega_id = loc.id
-                target_location_name = loc.name
 
-    # 5. Preparamos la lista de datos
-    data_list = []
-    
-    for product in products:
-        # Calcular stock:
-        # - Si hay filtro de sucursal -> Solo sumamos el stock de ESA bodega
-        # - Si NO hay filtro -> Sumamos el stock de TODAS las bodegas
-        total_stock = 0
-        
-        for stock_entry in product.stock_entries:
-            if target_bodega_id:
-                if stock_entry.location_id == target_bodega_id:
-                    total_stock += stock_entry.quantity
-            else:
-                total_stock += stock_entry.quantity
-
-        # Si filtramos por sucursal y el producto no tiene stock ahí, lo saltamos (opcional)
-        # O podemos mostrarlo con 0. Mostrémoslo con 0 para que sepa que falta.
-        
-        cat_name = product.category.name if product.category else "Sin Categoría"
-        
-        item = {
-            "SKU": product.sku,
-            "Producto": product.name,
-            "Categoría": cat_name,
-            "Precio Venta": product.price_3,
-            "Costo Promedio": product.average_cost,
-            "Stock": total_stock,
-            "Valor Total (Costo)": product.average_cost * total_stock,
-            "Valor Total (Venta)": product.price_3 * total_stock,
-            "Ubicación Reporte": target_location_name
-        }
-        data_list.append(item)
-
-    # 6. Crear el DataFrame de Pandas
-    df = pd.DataFrame(data_list)
-
-    # 7. Guardar en memoria
-    output = BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        df.to_excel(writer, index=False, sheet_name="Inventario")
-    
-    output.seek(0)
-
-    # 8. Generar nombre del archivo
-    filename = f"Inventario_{date.today()}.xlsx"
-    
+    # 2. Preparamos la descarga
+    media_type, extension = export_service.EXPORT_FORMATS[format]
+    filename = f"Inventario_{date.today()}.{extension}"
     headers = {
         'Content-Disposition': f'attachment; filename="{filename}"'
     }
+    columns = export_service.INVENTORY_COLUMNS
+    company_id = current_user.company_id
 
-    return StreamingResponse(output, media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", headers=headers)
+    # 3. CSV: se va enviando mientras se lee (con su propia sesión, vive durante el streaming)
+    if format == "csv":
+        def csv_stream():
+            stream_db = database.open_report_session(max_lag_seconds)
+            try:
+                rows = export_service.iter_inventory_rows(stream_db, company_id, category_id, target_bodega_id, target_location_name)
+                yield from export_service.stream_csv(columns, rows)
+            finally:
+                stream_db.close()
+        return StreamingResponse(csv_stream(), media_type=media_type, headers=headers)
+
+    # 4. Excel / Parquet: se escribe a un archivo temporal (no a RAM) y se envía por pedazos
+    rows = export_service.iter_inventory_rows(db, company_id, category_id, target_bodega_id, target_location_name)
+    try:
+        if format == "xlsx":
+            file_obj = export_service.write_xlsx(columns, rows, sheet_name="Inventario")
+        else:
+            file_obj = export_service.write_parquet(columns, rows)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return StreamingResponse(export_service.iter_file(file_obj), media_type=media_type, headers=headers)
 # --- FIN EXPORTAR EXCEL ---
 
 # ===================================================================
@@ -754,7 +737,7 @@ def confirm_batch_import(
         
         # Validación de seguridad: ¿Esa bodega es mía?
         # (Aunque el frontend solo muestra las mías, validamos por si acaso)
-        check_loc = crud.get_location(db, location_id=target_location_id)
+        check_loc = crud.get_location_info(db, location_id=target_location_id)
         if not check_loc or check_loc.company_id != current_user.company_id:
              raise HTTPException(status_code=403, detail="La bodega seleccionada no pertenece a tu empresa.")
              
@@ -768,126 +751,17 @@ def confirm_batch_import(
         target_location_id = bodega.id if bodega else active_shift.location_id
     # -----------------------------------
 
-    processed_count = 0
-    updated_count = 0
-    
-    existing_cats = db.query(models.Category).filter(models.Category.company_id == current_user.company_id).all()
-    cat_map = {c.name.upper(): c.id for c in existing_cats}
-
-    for item in request.items:
-        if item.action_to_take == "SKIP":
-            continue
-
-        # 1. Resolver Categoría
-        cat_id = None
-        if item.category:
-            cat_name_upper = item.category.strip().upper()
-            if cat_name_upper in cat_map:
-                cat_id = cat_map[cat_name_upper]
-            else:
-                new_cat = models.Category(name=item.category.strip(), company_id=current_user.company_id)
-                db.add(new_cat)
-                db.flush()
-                cat_id = new_cat.id
-                cat_map[cat_name_upper] = cat_id
-
-        # 2. CREACIÓN (NUEVO PRODUCTO)
-        if item.action_to_take == "CREATE":
-            new_prod = models.Product(
-                sku=item.sku,
-                name=item.name,
-                description=item.description,
-                product_type=item.product_type,
-                brand=item.brand,
-                model=item.model,
-                color=item.color,
-                compatibility=item.compatibility,
-                condition=item.condition,
-                price_1=item.price_1,
-                price_2=item.price_2,
-                price_3=item.price_3,
-                average_cost=item.average_cost,
-                category_id=cat_id,
-                company_id=current_user.company_id,
-                is_active=True
-            )
-            db.add(new_prod)
-            db.flush() 
-            
-            # Stock Inicial (Siempre es una entrada si es nuevo)
-            if item.quantity > 0:
-                crud.create_inventory_movement(db, schemas.InventoryMovementCreate(
-                    product_id=new_prod.id,
-                    location_id=target_location_id,
-                    quantity_change=item.quantity,
-                    movement_type="CARGA_INICIAL_EXCEL",
-                    reference_id="IMPORT",
-                    pin=""
-                ), user_id=current_user.id)
-                
-            processed_count += 1
-
-        # 3. ACTUALIZACIÓN (PRODUCTO EXISTENTE)
-        elif item.action_to_take == "UPDATE":
-            prod = db.query(models.Product).filter(
-                models.Product.sku == item.sku, 
-                models.Product.company_id == current_user.company_id
-            ).first()
-            
-            if prod:
-                # Actualizar ficha técnica
-                prod.name = item.name
-                prod.description = item.description
-                prod.product_type = item.product_type
-                prod.brand = item.brand
-                prod.model = item.model
-                prod.color = item.color
-                prod.compatibility = item.compatibility
-                prod.condition = item.condition
-                prod.price_1 = item.price_1
-                prod.price_2 = item.price_2
-                prod.price_3 = item.price_3
-                prod.average_cost = item.average_cost
-                if cat_id: prod.category_id = cat_id
-                
-                # --- MATEMÁTICA DE STOCK INTELIGENTE ---
-                # Solo si el usuario decidió tocar el stock (es decir, no eligió "Mantener Sistema")
-                if item.stock_action != "KEEP_SYSTEM":
-                    
-                    # Buscamos el stock ACTUAL en ESTA bodega específica
-                    current_stock_entry = db.query(models.Stock).filter(
-                        models.Stock.product_id == prod.id,
-                        models.Stock.location_id == target_location_id
-                    ).first()
-                    current_qty = current_stock_entry.quantity if current_stock_entry else 0
-                    
-                    final_qty_change = 0
-                    movement_type = "AJUSTE_IMPORTACION"
-
-                    if item.stock_action == "REPLACE":
-                        # Queremos que el final sea X.
-                        # Cambio = X - Actual
-                        final_qty_change = item.quantity - current_qty
-                        movement_type = "CORRECCION_INVENTARIO"
-
-                    elif item.stock_action == "ADD":
-                        # Queremos sumar X.
-                        # Cambio = X
-                        final_qty_change = item.quantity
-                        movement_type = "ENTRADA_MERCADERIA"
-                    
-                    # Solo creamos movimiento si hay diferencia real
-                    if final_qty_change != 0:
-                        crud.create_inventory_movement(db, schemas.InventoryMovementCreate(
-                            product_id=prod.id,
-                            location_id=target_location_id,
-                            quantity_change=final_qty_change,
-                            movement_type=movement_type,
-                            reference_id="IMPORT_UPDATE",
-                            pin=""
-                        ), user_id=current_user.id)
-
-                updated_count += 1
+    # --- EJECUCIÓN EN BLOQUE (una sola transacción) ---
+    try:
+        processed_count, updated_count = import_service.apply_import_batch(
+            db, request.items,
+            company_id=current_user.company_id,
+            target_location_id=target_location_id,
+            user_id=current_user.id
+        )
+    except ValueError as e:
+        db.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
 
     db.commit()
     return {"message": f"Proceso completado. Creados: {processed_count}, Actualizados: {updated_count}"}
@@ -912,8 +786,8 @@ def upload_product_image(
     allowed_exts = [".jpg", ".jpeg", ".png", ".webp"]
     # 2) Tipos MIME permitidos
     allowed_types = ["image/jpeg", "image/png", "image/webp"]
-    # 3) Tamaño máximo (5 MB)
-    MAX_BYTES = 5 * 1024 * 1024
+    # 3) Tamaño máximo (las fotos de celular pesan 4-8 MB; luego se reducen a WebP)
+    MAX_BYTES = media_service.MEDIA_MAX_UPLOAD_BYTES
 
     # Revisar el tipo MIME que dice el navegador/cliente
     if file.content_type not in allowed_types:
@@ -924,68 +798,28 @@ def upload_product_image(
     if original_ext not in allowed_exts:
         raise HTTPException(status_code=400, detail="Extensión no permitida (usa .jpg, .jpeg, .png, .webp)")
 
-    # Revisar tamaño leyendo el contenido en memoria y luego regresando el puntero
+    # Revisar tamaño leyendo el contenido en memoria
     contents = file.file.read()
     if len(contents) > MAX_BYTES:
-        raise HTTPException(status_code=400, detail="Archivo demasiado grande (máx 5MB)")
-    
-    # --- ARREGLO #1 (EL DEL "BODEGUERO") ---
-    # Ya no necesitamos "regresar el puntero" (file.file.seek(0))
-    # porque ahora guardaremos la variable 'contents'
-    # file.file.seek(0) # <-- ESTA LÍNEA SE VA O SE COMENTA
-    
+        raise HTTPException(status_code=400, detail=f"Archivo demasiado grande (máx {MAX_BYTES // (1024 * 1024)}MB)")
     # ===== FIN VALIDACIÓN DE ARCHIVO =====
 
-       # --- LÓGICA DE CARPETA Y NOMBRES POR PRODUCTO ---
-    # Carpeta base para uploads
-    base_upload_dir = "/code/uploads"
-    os.makedirs(base_upload_dir, exist_ok=True)
-
-    # 1) Sacamos el nombre del producto para armar carpeta y prefijo de archivo
-    #    - Carpeta: MAYÚSCULAS con '_'
-    #    - Archivo: minúsculas con '_'
-    product_folder = _slugify(db_product.name, case="upper")  # p.ej. "CHIP_CLARO"
-    file_prefix = _slugify(db_product.name, case="lower")     # p.ej. "chip_claro"
-
-    # 2) Subcarpeta del producto
-    product_dir = os.path.join(base_upload_dir, product_folder)
-    os.makedirs(product_dir, exist_ok=True)
-
-    # 3) Determinar el índice siguiente (chip_claro_1, chip_claro_2, ...)
-    #    Buscamos archivos existentes que sigan el patrón 'chip_claro_<n>.<ext>'
-    existing_files = [f for f in os.listdir(product_dir) if f.lower().startswith(f"{file_prefix}_")]
-    max_index = 0
-    pattern = re.compile(rf"^{re.escape(file_prefix)}_(\d+)\.", re.IGNORECASE)
-    for fname in existing_files:
-        m = pattern.match(fname)
-        if m:
-            try:
-                idx = int(m.group(1))
-                if idx > max_index:
-                    max_index = idx
-            except:
-                pass
-    next_index = max_index + 1
-
-    # 4) Armar nombre final con extensión original (normalizada a lower)
-    file_extension = os.path.splitext(file.filename)[1].lower()  # ej: '.jpg'
-    safe_filename = f"{file_prefix}_{next_index}{file_extension}"  # ej: 'chip_claro_3.jpg'
-
-    # 5) Ruta destino final
-    file_path = os.path.join(product_dir, safe_filename)
-    # --- FIN LÓGICA CARPETA/NOMBRE ---
-
-    # --- INICIO DEL ARREGLO #1 (EL DEL "BODEGUERO") ---
-    # En lugar de copiar el flujo del archivo (shutil.copyfileobj),
-    # escribimos directamente la variable 'contents' que ya tiene los datos.
-    with open(file_path, "wb") as buffer:
-        buffer.write(contents)
-    # --- FIN DEL ARREGLO ---
+    # Validación rápida de la cabecera (el decodificado completo lo hace el worker)
+    try:
+        media_service.sniff_image(contents)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-    # Nota: tu app sirve /uploads desde "/code/uploads" (app.mount en main.py)
-    # Por lo tanto, devolvemos la URL relativa correcta con subcarpeta
-    image_url = f"/uploads/{product_folder}/{safe_filename}"
-    crud.add_product_image(db, product_id=product_id, image_url=image_url)
+    # --- VARIANTES WEBP (miniatura / mediana / completa) guardadas por hash ---
+    # Las URLs ya se conocen (dependen del hash). Si la foto es nueva, el registro
+    # queda PROCESANDO y el pool de procesos genera los archivos en segundo plano
+    # (el original se guarda en disco antes, para retomarlo si el proceso se reinicia).
+    stored, ready = media_service.plan_image(contents)
+    if not ready:
+        media_service.save_incoming(contents)
+    db_image = crud.add_product_image(db, product_id=product_id, status="LISTA" if ready else "PROCESANDO", **stored)
+    if not ready:
+        media_worker.submit_product_image(stored["content_hash"], db_image.id)
 
     db.refresh(db_product)
     return db_product
@@ -1000,26 +834,7 @@ def delete_an_image(
     if db_image is None:
         raise HTTPException(status_code=404, detail="Imagen no encontrada para eliminar")
 
-    # --- BORRADO FÍSICO EN DISCO (SEGURO) ---
-    try:
-        # db_image.image_url viene como '/uploads/archivo.ext'
-        # Construimos la ruta absoluta de forma segura
-        relative_path = db_image.image_url.lstrip("/")  # 'uploads/archivo.ext'
-        base_dir = "/code"                              # raíz del contenedor en runtime
-        file_path = os.path.join(base_dir, relative_path)
-
-        # Evitar path traversal: confirmar que está dentro de /code/uploads
-        uploads_dir = os.path.join(base_dir, "uploads")
-        if os.path.commonpath([os.path.abspath(file_path), uploads_dir]) == os.path.abspath(uploads_dir):
-            if os.path.exists(file_path):
-                os.remove(file_path)  # eliminamos el archivo
-        # Si no existe, no pasa nada (quizá ya se borró manualmente)
-    except Exception as e:
-        # No rompemos la API si falla el borrado físico,
-        # solo dejamos un comentario para log futuro.
-        # (Si tienes logger, aquí iría un logger.warning(...))
-        pass
-    # --- FIN BORRADO FÍSICO ---
+    # El borrado físico (variantes WebP compartidas por hash) lo hace crud.delete_product_image
 
     return db_image
 
@@ -1043,19 +858,7 @@ def delete_work_order_image_endpoint(
     if not db_image:
         raise HTTPException(status_code=404, detail="Imagen no encontrada")
 
-    # 2. Borrado físico
-    try:
-        relative_path = db_image.image_url.lstrip("/")
-        base_dir = "/code"
-        file_path = os.path.join(base_dir, relative_path)
-        
-        # Seguridad básica de path
-        uploads_dir = os.path.join(base_dir, "uploads")
-        if os.path.commonpath([os.path.abspath(file_path), uploads_dir]) == os.path.abspath(uploads_dir):
-            if os.path.exists(file_path):
-                os.remove(file_path)
-    except Exception as e:
-        print(f"Error borrando archivo físico: {e}")
+    # 2. El borrado físico lo hace crud.delete_work_order_image (respeta archivos compartidos)
 
     return db_image
 # -----------------------------------------------
@@ -1238,7 +1041,7 @@ def get_personnel_report_endpoint(
     end_date: date,
     user_id: int | None = None,
     location_id: int | None = None,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_report_db),
     _role_check: None = Depends(security.require_role(required_roles=["super_admin", "admin", "inventory_manager"]))
 ):
     return crud.get_personnel_report(
@@ -1279,7 +1082,9 @@ def create_new_work_order(
     if not active_shift:
         raise HTTPException(status_code=400, detail="El usuario debe tener un turno activo para crear una orden de trabajo.")
 
-    return crud.create_work_order(db=db, work_order=work_order, user_id=current_user.id, location_id=active_shift.location_id)
+    db_work_order = crud.create_work_order(db=db, work_order=work_order, user_id=current_user.id, location_id=active_shift.location_id)
+    pdf_cache.prerender_work_order(db_work_order.id)
+    return db_work_order
 
 # --- INICIO DE NUESTRO CÓDIGO (Entrega Sin Reparación con VENTA REAL y RECIBO) ---
 @app.post("/work-orders/{work_order_id}/deliver-unrepaired", response_model=schemas.WorkOrderPublic)
@@ -1319,6 +1124,7 @@ def deliver_work_order_unrepaired(
             location_id=active_shift.location_id, 
             message=f"RETIRADO SIN REPARACIÓN: {form_data.reason}. Cobro revisión: ${form_data.diagnostic_fee}"
         )
+        pdf_cache.prerender_sale_receipt(_new_sale.id)
 
         return db_work_order
     except Exception as e:
@@ -1340,8 +1146,12 @@ def print_withdrawal_receipt(
     # Obtenemos los datos de la empresa dueña de la orden
     company_settings = crud.get_company_settings(db, company_id=db_work_order.company_id)
 
-    # Generamos el PDF usando el nuevo formato que creamos
-    pdf_buffer = pdf_utils.generate_withdrawal_receipt_pdf(db_work_order, company_settings)
+    # Generamos el PDF usando el nuevo formato que creamos (en el pool de PDFs)
+    pdf_buffer = _render_pdf(
+        "generate_withdrawal_receipt_pdf",
+        schemas.WorkOrder.model_validate(db_work_order),
+        schemas.CompanySettings.model_validate(company_settings)
+    )
 
     headers = {
         'Content-Disposition': f'inline; filename="retiro_orden_{work_order_id}.pdf"'
@@ -1363,19 +1173,35 @@ def update_work_order_status(
         raise HTTPException(status_code=404, detail="Orden de trabajo no encontrada")
     return updated_work_order
 
+# --- PAGINACIÓN POR CURSOR ---
+# Los listados siguen devolviendo una lista (compatibilidad). Si la página vino
+# llena, el cursor de la siguiente va en la cabecera X-Next-Cursor; el frontend
+# lo manda de vuelta como ?cursor=... (en lugar de ?skip=...).
+def _with_next_cursor(response: Response, rows, limit: int, order_columns):
+    cursor = next_cursor(rows, limit, order_columns)
+    if cursor:
+        response.headers["X-Next-Cursor"] = cursor
+    return rows
+
 @app.get("/work-orders/", response_model=List[schemas.WorkOrderPublic])
 def read_work_orders(
+    response: Response,
     skip: int = 0, 
     limit: int = 100, 
     active_only: bool = False,
     search: str | None = None, # <--- ACEPTAMOS BÚSQUEDA
+    cursor: str | None = None,
     db: Session = Depends(get_db),
     # Quitamos el chequeo de rol y en su lugar pedimos el usuario actual.
     current_user: models.User = Depends(security.get_current_user)
 ):
     # Le pasamos el usuario actual a nuestra nueva función de CRUD.
     # Ella se encargará de decidir qué órdenes devolver.
-    return crud.get_work_orders(db, user=current_user, skip=skip, limit=limit, active_only=active_only, search=search)
+    try:
+        work_orders = crud.get_work_orders(db, user=current_user, skip=skip, limit=limit, active_only=active_only, search=search, cursor=cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return _with_next_cursor(response, work_orders, limit, crud.WORK_ORDER_PAGE_ORDER)
 
 
 # --- NUEVO ENDPOINT PARA BUSCAR ÓRDENES LISTAS ---
@@ -1424,7 +1250,7 @@ def upload_work_order_image(
         # ===== VALIDACIÓN DE ARCHIVO (Orden de trabajo) =====
     allowed_exts = [".jpg", ".jpeg", ".png", ".webp"]
     allowed_types = ["image/jpeg", "image/png", "image/webp"]
-    MAX_BYTES = 5 * 1024 * 1024
+    MAX_BYTES = media_service.MEDIA_MAX_UPLOAD_BYTES
 
     if file.content_type not in allowed_types:
         raise HTTPException(status_code=400, detail="Solo se permiten imágenes JPG, PNG o WEBP")
@@ -1435,67 +1261,28 @@ def upload_work_order_image(
 
     contents = file.file.read()
     if len(contents) > MAX_BYTES:
-        raise HTTPException(status_code=400, detail="Archivo demasiado grande (máx 5MB)")
-
-    # --- ARREGLO #2 (EL DEL "BODEGUERO") ---
-    # file.file.seek(0) # <-- ESTA LÍNEA SE VA O SE COMENTA
+        raise HTTPException(status_code=400, detail=f"Archivo demasiado grande (máx {MAX_BYTES // (1024 * 1024)}MB)")
     # ===== FIN VALIDACIÓN DE ARCHIVO =====
 
+    # Validación rápida de la cabecera (el decodificado completo lo hace el worker)
+    try:
+        media_service.sniff_image(contents)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-        # --- LÓGICA DE CARPETA Y NOMBRES POR ORDEN ---
-    base_upload_dir = "/code/uploads"
-    os.makedirs(base_upload_dir, exist_ok=True)
-
-    # 1) Nombre seguro para identificar la orden en carpeta/archivo
-    #    preferimos el número visible (p.ej. "00004"); si no existe, usamos el id
-    wo_number_raw = getattr(db_work_order, "work_order_number", None) or str(work_order_id)
-    wo_number_slug_upper = _slugify(wo_number_raw, case="upper")  # para carpeta -> "00004" -> "00004"
-    wo_number_slug_lower = _slugify(wo_number_raw, case="lower")  # para archivo -> "00004" -> "00004"
-
-    # Carpeta: WORK_ORDER_<NUMERO>, p.ej. WORK_ORDER_00004
-    order_folder = f"WORK_ORDER_{wo_number_slug_upper}"
-    order_dir = os.path.join(base_upload_dir, order_folder)
-    os.makedirs(order_dir, exist_ok=True)
-
-    # Prefijo de archivo: work_order_<numero>
-    file_prefix = f"work_order_{wo_number_slug_lower}"
-
-    # 2) Calcular siguiente índice buscando archivos existentes 'work_order_<numero>_<n>.*'
-    existing_files = [f for f in os.listdir(order_dir) if f.lower().startswith(f"{file_prefix}_")]
-    max_index = 0
-    pattern = re.compile(rf"^{re.escape(file_prefix)}_(\d+)\.", re.IGNORECASE)
-    for fname in existing_files:
-        m = pattern.match(fname)
-        if m:
-            try:
-                idx = int(m.group(1))
-                if idx > max_index:
-                    max_index = idx
-            except:
-                pass
-    next_index = max_index + 1
-
-    # 3) Armar nombre final con extensión original normalizada a lower
-    file_extension = os.path.splitext(file.filename)[1].lower()  # ej: '.jpg'
-    safe_filename = f"{file_prefix}_{next_index}{file_extension}"  # ej: 'work_order_00004_3.jpg'
-
-   # 4) Guardar archivo
-    file_path = os.path.join(order_dir, safe_filename)
-    
-    # --- INICIO DEL ARREGLO #2 (EL DEL "BODEGUERO") ---
-    # Aplicamos la misma corrección que en productos:
-    # Escribimos la variable 'contents' que ya leímos durante la validación.
-    with open(file_path, "wb") as buffer:
-        buffer.write(contents)
-    # --- FIN DEL ARREGLO ---
-
-    # 5) Persistir en BD la URL pública (recuerda: app.mount("/uploads", ...))
-    image_url = f"/uploads/{order_folder}/{safe_filename}"
-    crud.add_work_order_image(db, work_order_id=work_order_id, image_url=image_url, tag=tag)
+    # --- VARIANTES WEBP (miniatura / mediana / completa) guardadas por hash ---
+    # Las URLs ya se conocen (dependen del hash). Si la foto es nueva, el registro
+    # queda PROCESANDO y el pool de procesos genera los archivos en segundo plano
+    # (el original se guarda en disco antes, para retomarlo si el proceso se reinicia).
+    stored, ready = media_service.plan_image(contents)
+    if not ready:
+        media_service.save_incoming(contents)
+    db_image = crud.add_work_order_image(db, work_order_id=work_order_id, tag=tag, status="LISTA" if ready else "PROCESANDO", **stored)
+    if not ready:
+        media_worker.submit_work_order_image(stored["content_hash"], db_image.id)
 
     db.refresh(db_work_order)
     return db_work_order
-    # --- FIN LÓGICA DE CARPETA/NOMBRE POR ORDEN ---
 
 
 # --- NUEVO: ENDPOINT PARA SUBIR FIRMA DIGITAL ---
@@ -1595,6 +1382,7 @@ def list_work_order_notes(
 @app.get("/work-orders/{work_order_id}/print", response_class=StreamingResponse)
 def print_work_order(
     work_order_id: int, 
+    request: Request,
     db: Session = Depends(get_db),
     _ok: None = Depends(security.require_internal_roles())
 ):
@@ -1605,18 +1393,9 @@ def print_work_order(
     # 1. Recuperamos la configuración de la empresa dueña de la orden
     company_settings = crud.get_company_settings(db, company_id=db_work_order.company_id)
 
-    # 2. Convertimos a Schema
-    schema_work_order = schemas.WorkOrder.model_validate(db_work_order)
-    schema_settings = schemas.CompanySettings.model_validate(company_settings)
-
-    # 3. Generamos PDF pasándole AMBOS datos
-    pdf_buffer = pdf_utils.generate_work_order_pdf(schema_work_order, schema_settings)
-
-    headers = {
-        'Content-Disposition': f'inline; filename="orden_{schema_work_order.work_order_number}.pdf"'
-    }
-
-    return StreamingResponse(pdf_buffer, media_type="application/pdf", headers=headers)
+    # 2. PDF desde la caché (misma clave que el enlace público)
+    key, render = pdf_cache.work_order_sheet(db_work_order, company_settings)
+    return _cached_pdf_response(request, key, render, f"orden_{db_work_order.work_order_number}.pdf")
 
 # ===================================================================
 # --- RUTAS INTERNAS (SOLO EMPLEADOS) - ÓRDENES COMPLETAS ---
@@ -1641,8 +1420,10 @@ def read_work_order_internal(
 # 2) Listar órdenes completas (aplicando la lógica de tu CRUD)
 @app.get("/internal/work-orders", response_model=List[schemas.WorkOrder])
 def read_work_orders_internal(
+    response: Response,
     skip: int = 0,
     limit: int = 100,
+    cursor: str | None = None,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(security.get_current_user),
     _ok: None = Depends(security.require_internal_roles())  # <- SOLO empleados internos
@@ -1652,7 +1433,11 @@ def read_work_orders_internal(
     - Admin / inventory_manager: verán TODAS.
     - warehouse_operator: verá solo las de su sucursal actual (según su turno activo).
     """
-    return crud.get_work_orders(db=db, user=current_user, skip=skip, limit=limit)
+    try:
+        work_orders = crud.get_work_orders(db=db, user=current_user, skip=skip, limit=limit, cursor=cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return _with_next_cursor(response, work_orders, limit, crud.WORK_ORDER_PAGE_ORDER)
 
 
 
@@ -1764,7 +1549,9 @@ def create_new_sale(
         raise HTTPException(status_code=400, detail="El usuario debe tener un turno activo para crear una venta.")
 
     try:
-        return crud.create_sale(db=db, sale=sale, user_id=current_user.id, location_id=active_shift.location_id)
+        db_sale = crud.create_sale(db=db, sale=sale, user_id=current_user.id, location_id=active_shift.location_id)
+        pdf_cache.prerender_sale_receipt(db_sale.id) # Ya hizo commit: el recibo queda listo en caché
+        return db_sale
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     # --- INICIO DE NUESTRO CÓDIGO ---
@@ -1776,6 +1563,7 @@ def create_new_sale(
 
 @app.get("/sales/", response_model=List[schemas.Sale])
 def read_sales_history(
+    response: Response,
     # --- INICIO DE NUESTRO CÓDIGO ---
     # 1. Le decimos a la "manguera" que acepte estos filtros opcionales
     start_date: date | None = None,
@@ -1785,27 +1573,33 @@ def read_sales_history(
     # --- FIN DE NUESTRO CÓDIGO ---
     skip: int = 0,
     limit: int = 100,
+    cursor: str | None = None,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(security.get_current_user)
 ):
     """
     Obtiene una lista paginada del historial de ventas.
     Aplica filtros de permisos basados en el rol del usuario.
+    Paginación: ?cursor=<X-Next-Cursor> (recomendado) o ?skip=N.
     """
     # 2. Pasamos los filtros que recibimos directo a la función del "archivador"
-    sales_history = crud.get_sales(
-        db, 
-        user=current_user, 
-        skip=skip, 
-        limit=limit,
-        # --- NUESTRAS NUEVAS LÍNEAS ---
-        start_date=start_date,
-        end_date=end_date,
-        search=search,
-        location_id=location_id
-        # --- FIN NUESTRAS NUEVAS LÍNEAS ---
-    )
-    return sales_history
+    try:
+        sales_history = crud.get_sales(
+            db, 
+            user=current_user, 
+            skip=skip, 
+            limit=limit,
+            # --- NUESTRAS NUEVAS LÍNEAS ---
+            start_date=start_date,
+            end_date=end_date,
+            search=search,
+            location_id=location_id,
+            cursor=cursor
+            # --- FIN NUESTRAS NUEVAS LÍNEAS ---
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return _with_next_cursor(response, sales_history, limit, crud.SALE_PAGE_ORDER)
 # --- FIN DE NUESTRO CÓDIGO ---
 
 # --- INICIO: Nuevo Endpoint Imprimir Historial ---
@@ -1815,54 +1609,52 @@ def print_sales_history_report(
     end_date: date | None = None,
     search: str | None = None,
     location_id: int | None = None,
+    max_lag_seconds: float | None = None,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(security.get_current_user)
 ):
     """
-    Genera un PDF con el listado de ventas filtrado.
-    Reutiliza la lógica de búsqueda de get_sales.
+    Genera un PDF con el listado de ventas filtrado (mismos filtros que get_sales).
+    Sin tope de filas: se lee con cursor, se dibuja página por página y los
+    totales salen de SQL (ver crud.sales_report_query).
     """
-    # 1. Obtenemos los datos usando los MISMOS filtros que la vista
-    # Ponemos un límite alto (ej: 1000) para el reporte impreso
-    sales_data = crud.get_sales(
-        db, 
-        user=current_user, 
-        skip=0, 
-        limit=1000, 
-        start_date=start_date, 
-        end_date=end_date, 
-        search=search, 
-        location_id=location_id
-    )
-
-    # 2. Datos de empresa (Usamos la del usuario actual que pide el reporte)
+    # 1. Datos de empresa (Usamos la del usuario actual que pide el reporte)
     if not current_user.company_id:
          raise HTTPException(status_code=400, detail="Usuario sin empresa asignada")
-    settings = crud.get_company_settings(db, company_id=current_user.company_id)
+    settings = schemas.CompanySettings.model_validate(
+        crud.get_company_settings(db, company_id=current_user.company_id)
+    )
 
-    # 3. Generar PDF
     filters = {
         "start_date": str(start_date) if start_date else None,
         "end_date": str(end_date) if end_date else None,
         "search": search,
         "location_id": location_id
     }
-    
-    pdf_buffer = pdf_utils.generate_sales_history_pdf(
-        sales_data=sales_data,
-        company_settings=schemas.CompanySettings.model_validate(settings),
-        filters=filters
-    )
+
+    # 2. Se lee y se dibuja en el pool de PDFs (con su propia sesión)
+    params = {
+        "start_date": start_date,
+        "end_date": end_date,
+        "search": search,
+        "location_id": location_id,
+        "max_lag_seconds": max_lag_seconds,
+    }
+    try:
+        pdf_file = pdf_worker.render_sales_history(current_user.id, params, settings, filters)
+    except TimeoutError as e:
+        raise HTTPException(status_code=503, detail=str(e))
 
     filename = f"reporte_ventas_{date.today()}.pdf"
     headers = {'Content-Disposition': f'inline; filename="{filename}"'}
-    return StreamingResponse(pdf_buffer, media_type="application/pdf", headers=headers)
+    return StreamingResponse(export_service.iter_file(pdf_file), media_type="application/pdf", headers=headers)
 # --- FIN DE NUESTRO CÓDIGO ---
 
 
 @app.get("/sales/{sale_id}/receipt", response_class=StreamingResponse)
 def get_sale_receipt(
     sale_id: int,
+    request: Request,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(security.get_current_user),
 ):
@@ -1873,18 +1665,9 @@ def get_sale_receipt(
     # 1. Recuperamos la configuración de la empresa dueña de la venta
     company_settings = crud.get_company_settings(db, company_id=db_sale.company_id)
 
-    # 2. Convertimos a Schema
-    sale_schema = schemas.Sale.model_validate(db_sale)
-    settings_schema = schemas.CompanySettings.model_validate(company_settings)
-
-    # 3. Generamos PDF pasando los settings
-    pdf_buffer = pdf_utils.generate_sale_receipt_pdf(sale_schema, settings_schema)
-    
-    headers = {
-        "Content-Disposition": f'inline; filename="venta_{sale_schema.id}.pdf"'
-    }
-
-    return StreamingResponse(pdf_buffer, media_type="application/pdf", headers=headers)
+    # 2. PDF desde la caché (normalmente ya pre-generado al crear la venta)
+    key, render = pdf_cache.sale_receipt(db_sale, company_settings)
+    return _cached_pdf_response(request, key, render, f"venta_{db_sale.id}.pdf")
 
 # ===================================================================
 # --- ENDPOINTS PARA GESTIÓN DE CAJA (CUENTAS Y TRANSACCIONES) ---
@@ -1933,8 +1716,12 @@ def create_new_cash_transaction(transaction: schemas.CashTransactionCreate, db:
     return db_transaction
 
 @app.get("/cash-accounts/{account_id}/transactions/", response_model=List[schemas.CashTransaction])
-def read_transactions_for_account(account_id: int, skip: int = 0, limit: int = 100, db: Session = Depends(get_db), _role_check: None = Depends(security.require_role(required_roles=["super_admin", "admin", "inventory_manager"]))):
-    return crud.get_cash_transactions_by_account(db, account_id=account_id, skip=skip, limit=limit)
+def read_transactions_for_account(account_id: int, response: Response, skip: int = 0, limit: int = 100, cursor: str | None = None, db: Session = Depends(get_db), _role_check: None = Depends(security.require_role(required_roles=["super_admin", "admin", "inventory_manager"]))):
+    try:
+        transactions = crud.get_cash_transactions_by_account(db, account_id=account_id, skip=skip, limit=limit, cursor=cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return _with_next_cursor(response, transactions, limit, crud.CASH_TRANSACTION_PAGE_ORDER)
 
 # --- INICIO DE NUESTRO CÓDIGO (Cierre de Caja) ---
 @app.get("/cash-accounts/{account_id}/balance", response_model=schemas.CashAccountBalance)
@@ -2092,7 +1879,7 @@ def confirm_password_recovery(
 # --- ENDPOINTS PARA REPORTES  - DASHBOARDS - ETC ---
 # ===================================================================
 @app.get("/reports/top-sellers", response_model=List[schemas.TopSeller])
-def get_top_sellers_report(start_date: date, end_date: date, db: Session = Depends(get_db), _role_check: None = Depends(security.require_role(required_roles=["super_admin", "admin", "inventory_manager"]))):
+def get_top_sellers_report(start_date: date, end_date: date, db: Session = Depends(get_report_db), _role_check: None = Depends(security.require_role(required_roles=["super_admin", "admin", "inventory_manager"]))):
     top_sellers_data = crud.get_top_sellers(db, start_date=start_date, end_date=end_date)
     response = []
     for user, total_sales in top_sellers_data:
@@ -2102,7 +1889,7 @@ def get_top_sellers_report(start_date: date, end_date: date, db: Session = Depen
 @app.get("/reports/dashboard-summary", response_model=schemas.DashboardSummary)
 def get_dashboard_summary_report(
     location_id: int | None = None, # <--- Nuevo parámetro opcional
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_report_db),
     current_user: schemas.User = Depends(security.get_current_user)
 ):
     target_location_id = location_id
@@ -2134,21 +1921,80 @@ def get_dashboard_summary_report(
     summary = crud.get_dashboard_summary(db, location_id=target_location_id, target_date=today)
     return summary
 
-@app.get("/reports/inventory-audit", response_model=List[schemas.InventoryMovement])
+@app.get("/reports/inventory-audit", response_model=List[schemas.KardexMovement])
 def get_inventory_audit_report(
+    response: Response,
     start_date: date | None = None,
     end_date: date | None = None,
     user_id: int | None = None,
-    db: Session = Depends(get_db),
+    product_id: int | None = None,
+    location_id: int | None = None,
+    movement_type: str | None = None,
+    limit: int = 200, # Máximo crud.KARDEX_MAX_PAGE_SIZE
+    cursor: str | None = None,
+    db: Session = Depends(get_report_db),
+    current_user: models.User = Depends(security.get_current_user),
+    _role_check: None = Depends(security.require_role(required_roles=["super_admin", "admin"]))
+):
+    """Kardex por páginas (cursor en X-Next-Cursor). Para descargarlo completo: /reports/inventory-audit/export."""
+    if not current_user.company_id:
+        raise HTTPException(status_code=400, detail="Usuario sin empresa.")
+    limit = max(1, min(limit, crud.KARDEX_MAX_PAGE_SIZE))
+    try:
+        movements = crud.get_inventory_audit(
+            db, company_id=current_user.company_id, limit=limit, cursor=cursor,
+            start_date=start_date, end_date=end_date, user_id=user_id,
+            product_id=product_id, location_id=location_id, movement_type=movement_type
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return _with_next_cursor(response, movements, limit, crud.KARDEX_PAGE_ORDER)
+
+@app.get("/reports/inventory-audit/export")
+def export_inventory_audit(
+    start_date: date | None = None,
+    end_date: date | None = None,
+    user_id: int | None = None,
+    product_id: int | None = None,
+    location_id: int | None = None,
+    movement_type: str | None = None,
+    format: str = "csv", # csv | ndjson
+    max_lag_seconds: float | None = None,
+    current_user: models.User = Depends(security.get_current_user),
     _role_check: None = Depends(security.require_role(required_roles=["super_admin", "admin"]))
 ):
-    movements = crud.get_inventory_audit(db, start_date=start_date, end_date=end_date, user_id=user_id)
-    return movements
+    """Kardex completo en streaming (CSV o NDJSON): la memoria no crece con las filas."""
+    if format not in export_service.KARDEX_FORMATS:
+        raise HTTPException(status_code=400, detail="Formato no soportado. Use csv o ndjson.")
+    if not current_user.company_id:
+        raise HTTPException(status_code=400, detail="Usuario sin empresa.")
+
+    media_type, extension = export_service.KARDEX_FORMATS[format]
+    headers = {'Content-Disposition': f'attachment; filename="Kardex_{date.today()}.{extension}"'}
+    company_id = current_user.company_id
+
+    # Sesión propia: vive mientras dura el streaming
+    def kardex_stream():
+        stream_db = database.open_report_session(max_lag_seconds)
+        try:
+            query = crud.kardex_query(
+                stream_db, company_id, start_date=start_date, end_date=end_date, user_id=user_id,
+                product_id=product_id, location_id=location_id, movement_type=movement_type
+            )
+            rows = export_service.iter_kardex_rows(query)
+            if format == "csv":
+                yield from export_service.stream_csv(export_service.KARDEX_COLUMNS, rows)
+            else:
+                yield from export_service.stream_ndjson(export_service.KARDEX_FIELDS, rows)
+        finally:
+            stream_db.close()
+
+    return StreamingResponse(kardex_stream(), media_type=media_type, headers=headers)
 
 # --- ENDPOINT DE ALERTAS DE PRODUCTO ESCASO ---
 @app.get("/reports/low-stock", response_model=List[schemas.LowStockItem])
 def get_low_stock_report(
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_report_db),
     current_user: schemas.User = Depends(security.get_current_user)
 ):
     # 1. Llamamos a la función del archivista
@@ -2261,14 +2107,20 @@ def create_new_customer(
 
 @app.get("/customers/", response_model=List[schemas.Customer])
 def read_customers(
+    response: Response,
     skip: int = 0, 
     limit: int = 100, 
     search: str | None = None, 
+    cursor: str | None = None,
     db: Session = Depends(get_db), 
     current_user: models.User = Depends(security.get_current_user)
 ):
     if not current_user.company_id: return []
-    return crud.get_customers(db, company_id=current_user.company_id, skip=skip, limit=limit, search=search)
+    try:
+        customers = crud.get_customers(db, company_id=current_user.company_id, skip=skip, limit=limit, search=search, cursor=cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return _with_next_cursor(response, customers, limit, crud.CUSTOMER_PAGE_ORDER)
 
 @app.put("/customers/{customer_id}", response_model=schemas.Customer)
 def update_customer_details(customer_id: int, customer: schemas.CustomerCreate, db: Session = Depends(get_db), current_user: schemas.User = Depends(security.get_current_user)):
@@ -2432,16 +2284,24 @@ def upload_company_logo(
     os.makedirs(base_upload_dir, exist_ok=True)
     
     file_ext = os.path.splitext(file.filename)[1].lower()
-    filename = f"logo_empresa{file_ext}" # Siempre se llamará logo_empresa para reemplazar el viejo
-    file_path = os.path.join(base_upload_dir, filename)
-    
     contents = file.file.read()
+    # Nombre por empresa + hash del contenido: si cambia el logo cambia la URL, y con
+    # ella la clave/ETag de los PDFs en caché (pdf_cache) y el logo en memoria (pdf_utils)
+    digest = media_service.content_hash(contents)[:16]
+    filename = f"logo_{current_user.company_id}_{digest}{file_ext}"
+    file_path = os.path.join(base_upload_dir, filename)
+
     with open(file_path, "wb") as buffer:
         buffer.write(contents)
-        
-    # 3. Actualizar BD
+
+    # 3. Actualizar BD (y borrar el archivo del logo anterior)
+    old_settings = crud.get_company_settings(db, company_id=current_user.company_id)
+    old_logo_url = old_settings.logo_url if old_settings else None
     logo_url = f"/uploads/company/{filename}"
-    return crud.update_company_logo(db, logo_url, company_id=current_user.company_id)
+    db_settings = crud.update_company_logo(db, logo_url, company_id=current_user.company_id)
+    if old_logo_url and old_logo_url != logo_url:
+        media_service.remove_files([old_logo_url])
+    return db_settings
 
 # ===================================================================
 # --- ENDPOINTS FACTURACIÓN ELECTRÓNICA (SRI) ---
@@ -2494,18 +2354,25 @@ async def upload_sri_signature(
 
 @app.post("/sales/retry-sri-failures")
 def retry_sri_failures_endpoint(
+    start_date: date | None = None,
+    end_date: date | None = None,
+    location_id: int | None = None,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(security.get_current_user),
     _role: None = Depends(security.require_role(["super_admin", "admin", "inventory_manager"]))
 ):
     """
-    Intenta reenviar todas las facturas fallidas del día actual.
+    Devuelve a la cola SRI las facturas fallidas del rango de fechas (y sucursal).
+    Para reenviarlas aquí mismo con progreso, ver /sales/sri-resubmit.
     """
     if not current_user.company_id:
         raise HTTPException(status_code=400, detail="Usuario sin empresa.")
         
     try:
-        results = crud.retry_failed_invoices(db, current_user.company_id)
+        results = crud.retry_failed_invoices(
+            db, current_user.company_id,
+            start_date=start_date, end_date=end_date, location_id=location_id
+        )
         return results
     except ValueError as e:
         # Capturamos errores de configuración (ej: Falta firma) y enviamos alerta 400
@@ -2515,6 +2382,75 @@ def retry_sri_failures_endpoint(
         print(f"Error en reintento masivo: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/sales/sri-resubmit")
+def bulk_resubmit_sri_invoices(
+    request_data: schemas.SriResubmitRequest,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(security.get_current_user),
+    _role: None = Depends(security.require_role(["super_admin", "admin", "inventory_manager"]))
+):
+    """
+    Reenvío masivo de facturas fallidas (por rango de fechas, sucursal y/o estado).
+    Responde en streaming (NDJSON): una línea por factura a medida que termina
+    y una última línea con el resumen. El resumen separa las facturas que se
+    reenviaron al SRI de las que solo se consultaron (ya las tenía).
+    """
+    if not current_user.company_id:
+        raise HTTPException(status_code=400, detail="Usuario sin empresa.")
+    if not crud.get_sri_config(db, current_user.company_id):
+        raise HTTPException(status_code=400, detail="No hay firma electrónica configurada para reintentar.")
+
+    # 1. Seleccionar y encolar (una sola transacción)
+    failed_sales = crud.get_failed_invoices(
+        db,
+        company_id=current_user.company_id,
+        start_date=request_data.start_date,
+        end_date=request_data.end_date,
+        location_id=request_data.location_id,
+        statuses=request_data.statuses,
+        limit=request_data.limit
+    )
+    for sale in failed_sales:
+        crud.enqueue_sri_invoice(db, sale)
+    db.commit()
+
+    # 2. Reservar esos encargos para procesarlos aquí mismo (con pool acotado)
+    sale_ids = [sale.id for sale in failed_sales]
+    job_ids = sri_worker.claim_jobs_for_sales(db, sale_ids)
+
+    def progress_stream():
+        started_at = datetime.now()
+        by_status = {}
+        yield json.dumps({
+            "type": "start",
+            "total": len(sale_ids),
+            "processing": len(job_ids),
+            # Los que ya tomó el worker periódico se procesan igual, pero allá
+            "queued_elsewhere": len(sale_ids) - len(job_ids)
+        }) + "\n"
+
+        done = 0
+        by_action = {"ENVIADA": 0, "CONSULTADA": 0, None: 0}
+        for result in sri_worker.process_jobs_streaming(job_ids, max_workers=request_data.max_workers):
+            done += 1
+            by_status[result["status"]] = by_status.get(result["status"], 0) + 1
+            by_action[result.get("action")] += 1
+            yield json.dumps({"type": "progress", "done": done, "total": len(job_ids), **result}, default=str) + "\n"
+
+        yield json.dumps({
+            "type": "summary",
+            "total": len(sale_ids),
+            "processed": done,
+            "resent": by_action["ENVIADA"],
+            "status_checked_only": by_action["CONSULTADA"],
+            "not_sent": by_action[None], # No se llegó al SRI (sin conexión, sin firma, error interno)
+            "queued_elsewhere": len(sale_ids) - len(job_ids),
+            "by_status": by_status,
+            "elapsed_seconds": round((datetime.now() - started_at).total_seconds(), 2)
+        }) + "\n"
+
+    return StreamingResponse(progress_stream(), media_type="application/x-ndjson")
+
 # ===================================================================
 # --- ENDPOINTS SUPER ADMIN (PANEL DE CONTROL) ---
 # ===================================================================
@@ -2682,7 +2618,11 @@ def print_credit_note(
     company_settings = crud.get_company_settings(db, company_id=db_credit_note.user.company_id)
     
     # Generamos PDF
-    pdf_buffer = pdf_utils.generate_credit_note_pdf(db_credit_note, company_settings)
+    pdf_buffer = _render_pdf(
+        "generate_credit_note_pdf",
+        schemas.CreditNote.model_validate(db_credit_note),
+        schemas.CompanySettings.model_validate(company_settings)
+    )
 
     headers = {
         'Content-Disposition': f'inline; filename="NC_{db_credit_note.code}.pdf"'
@@ -2712,17 +2652,20 @@ def get_cash_closure_report(
         location = crud.get_location(db, location_id=account.location_id)
         location_name = location.name if location else "Desconocida"
 
-        pdf_buffer = pdf_utils.generate_cash_closure_pdf(
-            closure_data=data,
-            company_settings=schemas.CompanySettings.model_validate(settings),
-            user_email=current_user.email,
-            location_name=location_name
+        pdf_buffer = _render_pdf(
+            "generate_cash_closure_pdf",
+            data,
+            schemas.CompanySettings.model_validate(settings),
+            current_user.email,
+            location_name
         )
 
         filename = f"cierre_{closure_id if closure_id else 'actual'}.pdf"
         headers = {'Content-Disposition': f'inline; filename="{filename}"'}
         return StreamingResponse(pdf_buffer, media_type="application/pdf", headers=headers)
     
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error generando reporte: {e}") # Log para debug
         raise HTTPException(status_code=500, detail="Error generando el PDF del cierre.")
@@ -2737,7 +2680,7 @@ def get_past_closures(
     """Devuelve la lista de cierres de caja anteriores."""
     return db.query(models.CashTransaction).filter(
         models.CashTransaction.account_id == account_id,
-        models.CashTransaction.description.like("CIERRE DE CAJA%")
+        models.CashTransaction.transaction_type == crud.CASH_TX_CLOSURE
     ).order_by(models.CashTransaction.timestamp.desc()).limit(limit).all()
 # --- FIN BLOQUE ---
 
@@ -2836,7 +2779,7 @@ def get_financial_report_endpoint(
     start_date: date,
     end_date: date,
     location_id: int | None = None,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_report_db),
     current_user: models.User = Depends(security.get_current_user), # <---
     _role: None = Depends(security.require_role(["super_admin", "admin", "inventory_manager"])),
     # --- GUARDIA SaaS: Requiere módulo FINANZAS ---
@@ -2873,9 +2816,11 @@ def create_transfer_endpoint(
 
 @app.get("/transfers/", response_model=List[schemas.TransferRead])
 def list_transfers(
+    response: Response,
     status: str | None = None,
     skip: int = 0,
     limit: int = 100,
+    cursor: str | None = None,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(security.get_current_user)
 ):
@@ -2900,15 +2845,20 @@ def list_transfers(
                 loc_id = active_shift.location_id 
     
     # Llamamos al CRUD con la orden de "forzar filtro" si es empleado
-    return crud.get_transfers(
-        db, 
-        company_id=current_user.company_id, 
-        skip=skip, 
-        limit=limit, 
-        status=status, 
-        location_id=loc_id,
-        force_filter=should_restrict # <--- AQUÍ ESTÁ LA SEGURIDAD
-    )
+    try:
+        transfers = crud.get_transfers(
+            db, 
+            company_id=current_user.company_id, 
+            skip=skip, 
+            limit=limit, 
+            status=status, 
+            location_id=loc_id,
+            force_filter=should_restrict, # <--- AQUÍ ESTÁ LA SEGURIDAD
+            cursor=cursor
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return _with_next_cursor(response, transfers, limit, crud.TRANSFER_PAGE_ORDER)
 
 @app.get("/transfers/{transfer_id}", response_model=schemas.TransferRead)
 def get_transfer_detail(
@@ -2966,7 +2916,7 @@ def print_transfer_manifest(
     transfer_schema = schemas.TransferRead.model_validate(transfer)
     settings_schema = schemas.CompanySettings.model_validate(company_settings)
 
-    pdf_buffer = pdf_utils.generate_transfer_manifest_pdf(transfer_schema, settings_schema)
+    pdf_buffer = _render_pdf("generate_transfer_manifest_pdf", transfer_schema, settings_schema)
 
     headers = {
         'Content-Disposition': f'inline; filename="manifiesto_{transfer_id}.pdf"'
@@ -3057,8 +3007,60 @@ def run_scheduled_tasks():
 # Configuramos el planificador para que corra a las 23:55 todos los días
 scheduler = BackgroundScheduler()
 scheduler.add_job(run_scheduled_tasks, 'cron', hour=23, minute=55)
+# Cola de facturación electrónica: cada pocos segundos los workers toman lo pendiente
+scheduler.add_job(
+    sri_worker.run_pending_jobs, 'interval',
+    seconds=int(os.getenv("SRI_QUEUE_POLL_SECONDS", "10")),
+    max_instances=1, coalesce=True
+)
+# Imágenes que quedaron PROCESANDO (reinicio, cola llena): al arrancar y luego periódicamente
+scheduler.add_job(
+    media_worker.resume_pending_images, 'interval',
+    seconds=int(os.getenv("MEDIA_SWEEP_SECONDS", "60")),
+    max_instances=1, coalesce=True, next_run_time=datetime.now()
+)
 scheduler.start()
 
+# --- NUEVO: Métricas de la caché de ubicaciones ---
+@app.get("/super-admin/cache/locations")
+def get_location_cache_stats_endpoint(
+    _role: None = Depends(security.require_role(["super_admin"]))
+):
+    """Aciertos/fallos de la caché del árbol de ubicaciones (por proceso)."""
+    return crud.get_location_cache_stats()
+
+# --- NUEVO: Métricas de la caché de usuarios autenticados ---
+@app.get("/super-admin/cache/principals")
+def get_principal_cache_stats_endpoint(
+    _role: None = Depends(security.require_role(["super_admin"]))
+):
+    """Aciertos/fallos de la caché del vigilante (get_current_user, por proceso)."""
+    return security.get_principal_cache_stats()
+
+# --- NUEVO: Métricas de la caché de PDFs ---
+@app.get("/super-admin/cache/pdf")
+def get_pdf_cache_stats_endpoint(
+    _role: None = Depends(security.require_role(["super_admin"]))
+):
+    """Aciertos/fallos, PDFs pre-generados y borrados por LRU (por proceso)."""
+    return pdf_cache.get_pdf_cache_stats()
+
+# --- NUEVO: Métricas del pool de PDFs ---
+@app.get("/super-admin/pdf/workers")
+def get_pdf_worker_stats_endpoint(
+    _role: None = Depends(security.require_role(["super_admin"]))
+):
+    """Colas de los pools de PDFs (documentos y reportes): en espera, dibujándose, rechazados, timeouts, procesos reciclados y tiempos."""
+    return pdf_worker.get_pdf_worker_stats()
+
+# --- NUEVO: Métricas del pool de conexiones a la BD ---
+@app.get("/super-admin/db/pool")
+def get_db_pool_stats_endpoint(
+    _role: None = Depends(security.require_role(["super_admin"]))
+):
+    """Conexiones en uso, overflow y tiempos de espera del pool (por proceso)."""
+    return database.get_pool_stats()
+
 # --- NUEVO ENDPOINT MANUAL: REINICIO DE EMERGENCIA ---
 @app.post("/super-admin/reset-demo-now")
 def trigger_demo_reset(
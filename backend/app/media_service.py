@@ -0,0 +1,191 @@
+import hashlib
+import io
+import os
+import tempfile
+
+from PIL import Image, ImageOps
+
+# ===================================================================
+# --- PROCESAMIENTO DE IMÁGENES (VARIANTES WEBP + ALMACÉN POR HASH) ---
+# ===================================================================
+# Las fotos del celular llegan de 4-8 MB. Aquí las convertimos a WebP en tres
+# tamaños (miniatura para grillas, mediana para el detalle, completa para zoom),
+# quitando el EXIF (GPS, modelo del teléfono...) y respetando la rotación.
+# Los archivos se guardan por el hash SHA-256 del original:
+#   /code/uploads/media/ab/abcdef..._thumb.webp
+# Si alguien sube la misma foto dos veces, no se vuelve a escribir nada.
+# Mientras se procesa, el original queda en MEDIA_INCOMING_DIR (fuera de
+# /code/uploads, que es público, porque todavía trae el EXIF): si el proceso
+# se reinicia, media_worker lo retoma desde ahí.
+
+UPLOADS_ROOT = "/code/uploads"
+MEDIA_DIR = "media"
+MEDIA_INCOMING_DIR = os.getenv("MEDIA_INCOMING_DIR", "/code/media_incoming")
+MEDIA_MAX_UPLOAD_BYTES = int(os.getenv("MEDIA_MAX_UPLOAD_MB", "10")) * 1024 * 1024
+WEBP_QUALITY = int(os.getenv("MEDIA_WEBP_QUALITY", "80"))
+
+# Lado mayor (px) de cada variante
+IMAGE_VARIANTS = {
+    "thumb": 240,
+    "medium": 800,
+    "full": 1600,
+}
+
+# Protección contra "bombas de descompresión" (imágenes gigantes en pocos bytes)
+Image.MAX_IMAGE_PIXELS = 50_000_000
+
+
+def content_hash(contents: bytes) -> str:
+    return hashlib.sha256(contents).hexdigest()
+
+
+def _variant_path(digest: str, variant: str) -> tuple[str, str]:
+    """Devuelve (ruta en disco, URL pública) de una variante."""
+    relative = f"{MEDIA_DIR}/{digest[:2]}/{digest}_{variant}.webp"
+    return os.path.join(UPLOADS_ROOT, relative), f"/uploads/{relative}"
+
+
+def _incoming_path(digest: str) -> str:
+    return os.path.join(MEDIA_INCOMING_DIR, digest)
+
+
+def variants_ready(digest: str) -> bool:
+    """True si ya están escritas todas las variantes de ese hash."""
+    return all(os.path.exists(_variant_path(digest, variant)[0]) for variant in IMAGE_VARIANTS)
+
+
+def save_incoming(contents: bytes) -> str:
+    """Guarda el original en disco ANTES de responder (para no perderlo si se cae el worker). Devuelve el hash."""
+    digest = content_hash(contents)
+    path = _incoming_path(digest)
+    if not os.path.exists(path):
+        _write_atomic(path, contents)
+    return digest
+
+
+def has_incoming(digest: str) -> bool:
+    return os.path.exists(_incoming_path(digest))
+
+
+def remove_incoming(digest: str):
+    try:
+        os.remove(_incoming_path(digest))
+    except FileNotFoundError:
+        pass
+
+
+def _render_variants(contents: bytes) -> dict:
+    """Decodifica la imagen y genera los bytes WebP de cada variante."""
+    try:
+        with Image.open(io.BytesIO(contents)) as original:
+            original.load()
+            image = ImageOps.exif_transpose(original)  # Gira según EXIF antes de descartarlo
+    except Exception:
+        raise ValueError("El archivo no es una imagen válida.")
+
+    if image.mode not in ("RGB", "RGBA"):
+        has_alpha = "A" in image.getbands() or "transparency" in image.info
+        image = image.convert("RGBA" if has_alpha else "RGB")
+
+    rendered = {}
+    for variant, max_side in IMAGE_VARIANTS.items():
+        copy = image.copy()
+        copy.thumbnail((max_side, max_side), Image.LANCZOS)  # Nunca agranda
+        buffer = io.BytesIO()
+        # Al no pasar exif=..., el WebP sale sin metadatos
+        copy.save(buffer, format="WEBP", quality=WEBP_QUALITY, method=4)
+        rendered[variant] = buffer.getvalue()
+    return rendered
+
+
+def _write_atomic(path: str, data: bytes):
+    """Escribe a un temporal y lo renombra (nadie ve un archivo a medias)."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as tmp:
+            tmp.write(data)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def sniff_image(contents: bytes):
+    """
+    Validación rápida (solo lee la cabecera, no decodifica los píxeles).
+    Lanza ValueError si no es JPG, PNG o WEBP.
+    """
+    try:
+        with Image.open(io.BytesIO(contents)) as image:
+            image_format = image.format
+    except Exception:
+        raise ValueError("El archivo no es una imagen válida.")
+    if image_format not in ("JPEG", "PNG", "WEBP"):
+        raise ValueError("Solo se permiten imágenes JPG, PNG o WEBP")
+
+
+def plan_image(contents: bytes) -> tuple[dict, bool]:
+    """
+    Calcula el hash y las URLs finales SIN procesar nada (las URLs dependen solo del hash).
+    Devuelve ({"content_hash", "image_url" (full), "medium_url", "thumbnail_url"}, ya_existe).
+    """
+    digest = content_hash(contents)
+    paths = {variant: _variant_path(digest, variant) for variant in IMAGE_VARIANTS}
+    urls = {
+        "content_hash": digest,
+        "image_url": paths["full"][1],
+        "medium_url": paths["medium"][1],
+        "thumbnail_url": paths["thumb"][1],
+    }
+    # Deduplicación: si ya tenemos todas las variantes, no hay nada que procesar
+    return urls, variants_ready(digest)
+
+
+def render_and_store(contents: bytes) -> str:
+    """
+    El trabajo pesado: decodificar, quitar EXIF, redimensionar y escribir las variantes.
+    Corre en un proceso aparte (ver media_worker). Devuelve el hash.
+    Lanza ValueError si el archivo no se puede decodificar.
+    """
+    digest = content_hash(contents)
+    paths = {variant: _variant_path(digest, variant)[0] for variant in IMAGE_VARIANTS}
+    if not all(os.path.exists(path) for path in paths.values()):
+        for variant, data in _render_variants(contents).items():
+            _write_atomic(paths[variant], data)
+    return digest
+
+
+def render_incoming(digest: str) -> str:
+    """
+    Igual que render_and_store, pero leyendo el original guardado con save_incoming.
+    Si otra subida del mismo hash ya generó las variantes, no hace nada.
+    """
+    if variants_ready(digest):
+        return digest
+    try:
+        with open(_incoming_path(digest), "rb") as incoming:
+            contents = incoming.read()
+    except FileNotFoundError:
+        # Otra subida del mismo hash terminó y lo borró justo ahora
+        if variants_ready(digest):
+            return digest
+        raise
+    return render_and_store(contents)
+
+
+def remove_files(urls: list[str | None]):
+    """Borra del disco las URLs dadas (solo si están dentro de /code/uploads)."""
+    uploads_dir = os.path.abspath(UPLOADS_ROOT)
+    for url in urls:
+        if not url:
+            continue
+        file_path = os.path.abspath(os.path.join(os.path.dirname(uploads_dir), url.lstrip("/")))
+        if os.path.commonpath([file_path, uploads_dir]) != uploads_dir:
+            continue
+        try:
+            if os.path.exists(file_path):
+                os.remove(file_path)
+        except OSError as e:
+            print(f"Advertencia: No se pudo borrar el archivo físico {file_path}: {e}")
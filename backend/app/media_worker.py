@@ -0,0 +1,161 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from . import models, media_service
+from .database import SessionLocal
+
+# ===================================================================
+# --- WORKER DE IMÁGENES (POOL DE PROCESOS) ---
+# ===================================================================
+# El endpoint de subida solo valida, calcula el hash y crea el registro con
+# status PROCESANDO (las URLs finales ya se conocen: dependen del hash).
+# Decodificar, quitar EXIF, redimensionar y escribir los WebP es trabajo de CPU:
+# lo hace un pool de PROCESOS para no frenar al resto de peticiones del worker
+# de uvicorn. Al terminar, un hilo aparte marca el registro como LISTA (o ERROR).
+# - El original se guarda en disco (media_service.save_incoming) antes de
+#   responder: si el proceso se reinicia, resume_pending_images lo retoma.
+# - Como mucho MEDIA_MAX_PENDING imágenes a la vez (en cola + procesándose).
+#   Si no hay lugar en MEDIA_QUEUE_TIMEOUT_SECONDS, el registro queda
+#   PROCESANDO y lo toma el barrido periódico (resume_pending_images).
+
+MEDIA_WORKERS = int(os.getenv("MEDIA_WORKERS", "2"))
+MEDIA_MAX_PENDING = int(os.getenv("MEDIA_MAX_PENDING", "32"))
+MEDIA_QUEUE_TIMEOUT = float(os.getenv("MEDIA_QUEUE_TIMEOUT_SECONDS", "5"))
+
+_pool = None
+_pool_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(MEDIA_MAX_PENDING)
+# Imágenes ya enviadas al pool por este proceso: (tabla, id)
+_inflight_lock = threading.Lock()
+_inflight = set()
+# Un solo hilo para escribir el resultado en la BD (no bloquea al pool)
+_finalizer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="media-finalizer")
+
+
+def _get_pool(reset: bool = False) -> ProcessPoolExecutor:
+    """Crea el pool la primera vez (o de nuevo si un proceso hijo murió)."""
+    global _pool
+    with _pool_lock:
+        if reset and _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+        if _pool is None:
+            # "spawn": los hijos no heredan conexiones a BD ni hilos del proceso padre
+            _pool = ProcessPoolExecutor(
+                max_workers=MEDIA_WORKERS,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _pool
+
+
+def _finalize(model, image_id: int, digest: str, error: BaseException | None):
+    """Marca el registro de la imagen como LISTA o ERROR (en su propia sesión)."""
+    if isinstance(error, BrokenProcessPool):
+        # Se cayó el proceso hijo, no es culpa de la imagen: queda PROCESANDO para el barrido
+        # (el pool se recrea en el próximo submit_image)
+        print(f"⚠️ [MEDIA] Se cayó el pool procesando la imagen #{image_id}; se reintentará.")
+        return
+    db = SessionLocal()
+    try:
+        db_image = db.query(model).filter(model.id == image_id).first()
+        if db_image:  # Si no, la borraron mientras se procesaba
+            if error is None:
+                db_image.status = "LISTA"
+            else:
+                print(f"❌ [MEDIA] No se pudo procesar la imagen #{image_id}: {error}")
+                db_image.status = "ERROR"
+            db.commit()
+        media_service.remove_incoming(digest)
+    except Exception as e:
+        db.rollback()
+        print(f"❌ [MEDIA] Error finalizando imagen #{image_id}: {e}")
+    finally:
+        db.close()
+
+
+def submit_image(digest: str, model, image_id: int, timeout: float | None = None) -> bool:
+    """
+    Manda al pool el original ya guardado con media_service.save_incoming.
+    'model' es models.ProductImage o models.WorkOrderImage; al terminar se
+    actualiza el status de 'image_id'. Devuelve False si la cola está llena
+    (el registro queda PROCESANDO para el barrido).
+    """
+    key = (model.__tablename__, image_id)
+    with _inflight_lock:
+        if key in _inflight:
+            return True
+        _inflight.add(key)
+
+    def _release(_done=None):
+        with _inflight_lock:
+            _inflight.discard(key)
+        _slots.release()
+
+    if not _slots.acquire(timeout=MEDIA_QUEUE_TIMEOUT if timeout is None else timeout):
+        with _inflight_lock:
+            _inflight.discard(key)
+        return False
+    try:
+        try:
+            future = _get_pool().submit(media_service.render_incoming, digest)
+        except BrokenProcessPool:
+            future = _get_pool(reset=True).submit(media_service.render_incoming, digest)
+    except Exception:
+        _release()
+        raise
+
+    def _on_done(done):
+        _release()
+        error = BrokenProcessPool() if done.cancelled() else done.exception()
+        _finalizer.submit(_finalize, model, image_id, digest, error)
+
+    future.add_done_callback(_on_done)
+    return True
+
+
+def submit_product_image(digest: str, image_id: int):
+    if not submit_image(digest, models.ProductImage, image_id):
+        print(f"⏳ [MEDIA] Cola llena: la imagen de producto #{image_id} espera al barrido.")
+
+
+def submit_work_order_image(digest: str, image_id: int):
+    if not submit_image(digest, models.WorkOrderImage, image_id):
+        print(f"⏳ [MEDIA] Cola llena: la imagen de orden #{image_id} espera al barrido.")
+
+
+def resume_pending_images():
+    """
+    Barrido (al arrancar y periódico): reenvía al pool las imágenes que quedaron
+    PROCESANDO (reinicio del proceso, cola llena o pool caído). Si el original
+    ya no está en disco, la marca LISTA (las variantes existen) o ERROR.
+    """
+    db = SessionLocal()
+    resumed = 0
+    try:
+        for model in (models.ProductImage, models.WorkOrderImage):
+            pending = db.query(model).filter(model.status == "PROCESANDO").order_by(model.id).all()
+            for db_image in pending:
+                with _inflight_lock:
+                    if (model.__tablename__, db_image.id) in _inflight:
+                        continue
+                digest = db_image.content_hash
+                if digest and media_service.has_incoming(digest):
+                    if not submit_image(digest, model, db_image.id, timeout=0):
+                        break  # Cola llena: el resto en el próximo barrido
+                    resumed += 1
+                elif digest and media_service.variants_ready(digest):
+                    db_image.status = "LISTA"
+                else:
+                    print(f"❌ [MEDIA] La imagen #{db_image.id} perdió su original; se marca ERROR.")
+                    db_image.status = "ERROR"
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        print(f"❌ [MEDIA] Error en el barrido de imágenes pendientes: {e}")
+    finally:
+        db.close()
+    if resumed:
+        print(f"🔄 [MEDIA] Se retomaron {resumed} imágenes pendientes.")
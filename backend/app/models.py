@@ -1,6 +1,6 @@
 import uuid # <--- NUEVO IMPORT
 from sqlalchemy import (
-    Column, Integer, String, Float, Boolean, ForeignKey, UniqueConstraint, DateTime, desc
+    Column, Integer, String, Float, Boolean, ForeignKey, UniqueConstraint, DateTime, Date, Index, desc
 )
 from sqlalchemy.dialects.postgresql import JSON
 from sqlalchemy.sql import func
@@ -146,6 +146,11 @@ class Product(Base):
     condition = Column(String, nullable=True)               # Ej: NUEVO, SEMI-NUEVO
     # ---------------------------------------------------------
 
+    # --- NUEVO: DOCUMENTO DE BÚSQUEDA (POS) ---
+    # Texto en MAYÚSCULAS y sin tildes (igual que import_service.normalize_text).
+    # Lo mantiene un trigger de Postgres y tiene índice GIN trigram (ver migración).
+    search_document = Column(String, nullable=True)
+
     price_1 = Column(Float)
     price_2 = Column(Float)
     price_3 = Column(Float)
@@ -207,6 +212,12 @@ class InventoryMovement(Base):
     location = relationship("Location", back_populates="movements")
     user = relationship("User", back_populates="movements")
 
+    # Índices para filtrar por rango de fechas (auditoría de inventario)
+    __table_args__ = (
+        Index('ix_inventory_movements_timestamp', 'timestamp'),
+        Index('ix_inventory_movements_user_timestamp', 'user_id', 'timestamp'),
+    )
+
 class Shift(Base):
     __tablename__ = "shifts"
     id = Column(Integer, primary_key=True, index=True)
@@ -217,6 +228,12 @@ class Shift(Base):
     user = relationship("User", back_populates="shifts")
     location = relationship("Location", back_populates="shifts")
 
+    # Índices para el reporte de asistencia y las alertas de "primer turno"
+    __table_args__ = (
+        Index('ix_shifts_user_start_time', 'user_id', 'start_time'),
+        Index('ix_shifts_location_start_time', 'location_id', 'start_time'),
+    )
+
 class LostSaleLog(Base):
     __tablename__ = "lost_sale_logs"
     id = Column(Integer, primary_key=True, index=True)
@@ -260,7 +277,7 @@ class WorkOrder(Base):
     final_cost = Column(Float, nullable=True)
 
     # --- NUEVO: ID Público para compartir enlace ---
-    public_id = Column(String, unique=True, index=True, default=lambda: str(uuid.uuid4()))
+    public_id = Column(String, unique=True, index=True, nullable=False, default=lambda: str(uuid.uuid4()))
     # -----------------------------------------------
 
     # --- NUEVOS CAMPOS AÑADIDOS ---
@@ -301,6 +318,12 @@ class WorkOrder(Base):
     order_by=lambda: desc(WorkOrderNote.created_at)
 )
 
+    # Paginación por cursor (created_at, id), global y por sucursal
+    __table_args__ = (
+        Index('ix_work_orders_created_at_id', 'created_at', 'id'),
+        Index('ix_work_orders_location_created_at_id', 'location_id', 'created_at', 'id'),
+    )
+
 
 
 # ===== Bitácora interna por orden de trabajo =====
@@ -327,6 +350,11 @@ class WorkOrderImage(Base):
     __tablename__ = "work_order_images"
     id = Column(Integer, primary_key=True, index=True)
     image_url = Column(String, nullable=False)
+    # --- NUEVO: VARIANTES WEBP (ver media_service) ---
+    thumbnail_url = Column(String, nullable=True)
+    medium_url = Column(String, nullable=True)
+    content_hash = Column(String, index=True, nullable=True)
+    status = Column(String, nullable=False, default="LISTA") # PROCESANDO, LISTA, ERROR (ver media_worker)
     # NUEVO CAMPO: Para saber qué foto es (frontal, borde derecho, etc.)
     tag = Column(String, nullable=False) 
     work_order_id = Column(Integer, ForeignKey("work_orders.id"), nullable=False)
@@ -350,7 +378,7 @@ class Sale(Base):
     payment_method_details = Column(JSON, nullable=True)
 
     # --- NUEVO: ID Público para compartir enlace ---
-    public_id = Column(String, unique=True, index=True, default=lambda: str(uuid.uuid4()))
+    public_id = Column(String, unique=True, index=True, nullable=False, default=lambda: str(uuid.uuid4()))
     # -----------------------------------------------
 
     # --- FACTURACIÓN ELECTRÓNICA SRI ---
@@ -381,6 +409,57 @@ class Sale(Base):
     location = relationship("Location", back_populates="sales")
     work_order = relationship("WorkOrder", back_populates="sale")
     items = relationship("SaleItem", back_populates="sale", cascade="all, delete-orphan")
+
+    # Índices para historial y reportes por rango de fechas (ver crud.date_range_filter)
+    __table_args__ = (
+        Index('ix_sales_company_created_at', 'company_id', 'created_at'),
+        Index('ix_sales_location_created_at', 'location_id', 'created_at'),
+        Index('ix_sales_created_at_id', 'created_at', 'id'), # Paginación por cursor (todas las sucursales)
+    )
+
+# --- NUEVO: COLA DE FACTURACIÓN ELECTRÓNICA (OUTBOX SRI) ---
+# create_sale solo deja aquí el "encargo" (en la misma transacción que la venta).
+# Los workers de sri_worker.py lo toman, generan/firman/envían el XML, consultan
+# la autorización y actualizan Sale.sri_auth_status.
+class SriInvoiceJob(Base):
+    __tablename__ = "sri_invoice_jobs"
+    id = Column(Integer, primary_key=True, index=True)
+    sale_id = Column(Integer, ForeignKey("sales.id", ondelete="CASCADE"), unique=True, nullable=False)
+    company_id = Column(Integer, ForeignKey("companies.id"), nullable=True, index=True)
+
+    status = Column(String, nullable=False, default="PENDIENTE") # PENDIENTE, PROCESANDO, COMPLETADA, FALLIDA
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    locked_at = Column(DateTime(timezone=True), nullable=True) # Cuándo lo tomó un worker
+    last_error = Column(String, nullable=True)
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    sale = relationship("Sale")
+# -----------------------------------------------------------
+
+# --- NUEVO: RESUMEN DIARIO POR SUCURSAL (DASHBOARD) ---
+# Totales ya calculados por sucursal y día LOCAL (zona horaria del negocio).
+# Se actualiza sumando en create_sale, create_cash_transaction, create_expense,
+# process_refund y en los cambios de estado de órdenes. Para reconstruirlo:
+#   python -m app.rebuild_daily_summary
+class DailyLocationSummary(Base):
+    __tablename__ = "daily_location_summary"
+    id = Column(Integer, primary_key=True, index=True)
+    location_id = Column(Integer, ForeignKey("locations.id", ondelete="CASCADE"), nullable=False)
+    summary_date = Column(Date, nullable=False)
+
+    sales_total = Column(Float, nullable=False, default=0.0)
+    expenses_total = Column(Float, nullable=False, default=0.0) # Egresos de CAJA_VENTAS (sin cierres), en positivo
+    # Conteo de órdenes por estado al último cambio del día. Ej: {"RECIBIDO": 3, "LISTO": 1}
+    work_order_counts = Column(JSON, nullable=True)
+
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    __table_args__ = (UniqueConstraint('location_id', 'summary_date', name='_daily_summary_location_date_uc'),)
+# -----------------------------------------------------------
+
 class SaleItem(Base):
     __tablename__ = "sale_items"
     id = Column(Integer, primary_key=True, index=True)
@@ -465,14 +544,30 @@ class CashTransaction(Base):
     description = Column(String, nullable=False)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     account_id = Column(Integer, ForeignKey("cash_accounts.id"), nullable=False)
+    # --- NUEVO: Tipo de movimiento y venta de origen (antes se adivinaban por la descripción) ---
+    # VENTA, DEVOLUCION, GASTO, CIERRE o MANUAL (ver crud.CASH_TX_*)
+    transaction_type = Column(String, nullable=False, default="MANUAL", server_default="MANUAL")
+    # SET NULL: al fusionar un abono con la venta final, la venta del abono se borra
+    sale_id = Column(Integer, ForeignKey("sales.id", name="fk_cash_transactions_sale_id", ondelete="SET NULL"), nullable=True, index=True)
+    # -------------------------------------------------------------------------------------------
     user = relationship("User", back_populates="cash_transactions")
     account = relationship("CashAccount", back_populates="transactions")
 
+    __table_args__ = (
+        Index('ix_cash_transactions_account_timestamp', 'account_id', 'timestamp'),
+        Index('ix_cash_transactions_account_type_timestamp', 'account_id', 'transaction_type', 'timestamp'),
+    )
+
 class ProductImage(Base):
     __tablename__ = "product_images"
 
     id = Column(Integer, primary_key=True, index=True)
-    image_url = Column(String, nullable=False)
+    image_url = Column(String, nullable=False)  # Variante "full" (o el archivo original en fotos antiguas)
+    # --- NUEVO: VARIANTES WEBP (ver media_service) ---
+    thumbnail_url = Column(String, nullable=True)
+    medium_url = Column(String, nullable=True)
+    content_hash = Column(String, index=True, nullable=True)
+    status = Column(String, nullable=False, default="LISTA") # PROCESANDO, LISTA, ERROR (ver media_worker)
     product_id = Column(Integer, ForeignKey("products.id"), nullable=False)
 
     product = relationship("Product", back_populates="images")
@@ -523,7 +618,10 @@ class Customer(Base):
     location = relationship("Location")
 
     # REGLA DE INTEGRIDAD: La cédula debe ser única DENTRO de cada empresa.
-    __table_args__ = (UniqueConstraint('id_card', 'company_id', name='_id_card_company_uc'),)
+    __table_args__ = (
+        UniqueConstraint('id_card', 'company_id', name='_id_card_company_uc'),
+        Index('ix_customers_company_name_id', 'company_id', 'name', 'id'), # Listado A-Z por cursor
+    )
 
 # --- INICIO DE NUESTRO CÓDIGO (Tabla Notas de Crédito) ---
 class CreditNote(Base):
@@ -647,6 +745,12 @@ class Expense(Base):
     account = relationship("CashAccount", back_populates="expenses")
     work_order = relationship("WorkOrder", back_populates="expenses")
 
+    # Índices para el listado de gastos y el reporte financiero
+    __table_args__ = (
+        Index('ix_expenses_company_expense_date', 'company_id', 'expense_date'),
+        Index('ix_expenses_location_expense_date', 'location_id', 'expense_date'),
+    )
+
 # --- INICIO DE NUESTRO CÓDIGO (Módulo de Transferencias entre Sucursales) ---
 # --- INICIO DE NUESTRO CÓDIGO (Módulo de Transferencias entre Sucursales) ---
 class Transfer(Base):
@@ -686,6 +790,8 @@ class Transfer(Base):
     
     items = relationship("TransferItem", back_populates="transfer")
 
+    __table_args__ = (Index('ix_transfers_company_created_at_id', 'company_id', 'created_at', 'id'),)
+
     # --- PROPIEDADES MÁGICAS (TRADUCTORES PARA EL REPORTE) ---
     @property
     def source_location_name(self):
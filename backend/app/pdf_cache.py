@@ -0,0 +1,172 @@
+import hashlib
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from . import crud, schemas, pdf_utils, pdf_worker
+from .database import SessionLocal
+
+# ===================================================================
+# --- CACHÉ DE PDFs (RECIBOS Y ÓRDENES DE TRABAJO) ---
+# ===================================================================
+# Los clientes abren varias veces el enlace de WhatsApp del mismo recibo.
+# En vez de dibujar el PDF cada vez, lo guardamos en disco con una clave que
+# depende de TODO lo que se imprime:
+#   versión del diseño + tipo + id del documento + huella de sus datos + huella de la empresa
+# Si la venta/orden, la configuración de la empresa o el diseño
+# (pdf_utils.PDF_LAYOUT_VERSION) cambian, la clave cambia sola (no hay que
+# invalidar nada). La misma clave sirve de ETag (304).
+# Cuando la carpeta pasa de PDF_CACHE_MAX_MB se borran los menos usados (LRU).
+# Por defecto vive fuera de /code (el código montado): no sobrevive a un despliegue.
+
+PDF_CACHE_DIR = os.getenv("PDF_CACHE_DIR", os.path.join(tempfile.gettempdir(), "pdf_cache"))
+PDF_CACHE_MAX_BYTES = int(os.getenv("PDF_CACHE_MAX_MB", "200")) * 1024 * 1024
+
+_stats_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "evicted": 0, "prerendered": 0}
+_evict_lock = threading.Lock()
+
+# Pre-render después del commit (un hilo: no compite con las peticiones)
+_prerender = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pdf-prerender")
+
+
+def _count(key: str, amount: int = 1):
+    with _stats_lock:
+        _stats[key] += amount
+
+
+def _fingerprint(schema) -> str:
+    return hashlib.sha256(schema.model_dump_json().encode()).hexdigest()
+
+
+def cache_key(kind: str, doc_id: int, doc_schema, settings_schema) -> str:
+    """Clave (y ETag) del PDF: versión del diseño, tipo, id, versión de los datos y de la empresa."""
+    raw = f"v{pdf_utils.PDF_LAYOUT_VERSION}:{kind}:{doc_id}:{_fingerprint(doc_schema)}:{_fingerprint(settings_schema)}"
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def _cache_path(key: str) -> str:
+    return os.path.join(PDF_CACHE_DIR, key[:2], f"{key}.pdf")
+
+
+def _write_atomic(path: str, data: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as tmp:
+            tmp.write(data)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _evict():
+    """Borra los PDFs menos usados (mtime = último uso) hasta quedar bajo el límite."""
+    if not _evict_lock.acquire(blocking=False):
+        return  # Ya hay otro hilo limpiando
+    try:
+        files = []
+        total = 0
+        for root, _, names in os.walk(PDF_CACHE_DIR):
+            for name in names:
+                if not name.endswith(".pdf"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                files.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+        if total <= PDF_CACHE_MAX_BYTES:
+            return
+        for _, size, path in sorted(files):
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            _count("evicted")
+            if total <= PDF_CACHE_MAX_BYTES:
+                break
+    finally:
+        _evict_lock.release()
+
+
+def get_or_render(key: str, render) -> str:
+    """
+    Devuelve la ruta del PDF en caché. Si no está, llama a render() (que
+    devuelve un BytesIO), lo guarda y aplica el límite de tamaño.
+    """
+    path = _cache_path(key)
+    if os.path.exists(path):
+        try:
+            os.utime(path)  # Marca de "usado hace poco" para el LRU
+        except OSError:
+            pass
+        _count("hits")
+        return path
+
+    _count("misses")
+    _write_atomic(path, render().getvalue())
+    _evict()
+    return path
+
+
+# --- Documentos concretos ---
+def sale_receipt(db_sale, company_settings) -> tuple[str, callable]:
+    """(clave, render) del recibo de una venta."""
+    sale_schema = schemas.Sale.model_validate(db_sale)
+    settings_schema = schemas.CompanySettings.model_validate(company_settings)
+    key = cache_key("sale", sale_schema.id, sale_schema, settings_schema)
+    return key, lambda: pdf_worker.render("generate_sale_receipt_pdf", sale_schema, settings_schema)
+
+
+def work_order_sheet(db_work_order, company_settings) -> tuple[str, callable]:
+    """(clave, render) de la hoja de una orden de trabajo."""
+    order_schema = schemas.WorkOrder.model_validate(db_work_order)
+    settings_schema = schemas.CompanySettings.model_validate(company_settings)
+    key = cache_key("work_order", order_schema.id, order_schema, settings_schema)
+    return key, lambda: pdf_worker.render("generate_work_order_pdf", order_schema, settings_schema)
+
+
+def _prerender_job(kind: str, doc_id: int):
+    db = SessionLocal()
+    try:
+        if kind == "sale":
+            document = crud.get_sale(db, sale_id=doc_id)
+            builder = sale_receipt
+        else:
+            document = crud.get_work_order(db, work_order_id=doc_id)
+            builder = work_order_sheet
+        if not document:
+            return
+        settings = crud.get_company_settings(db, company_id=document.company_id)
+        key, render = builder(document, settings)
+        get_or_render(key, render)
+        _count("prerendered")
+    except Exception as e:
+        print(f"⚠️ [PDF] No se pudo pre-generar {kind} #{doc_id}: {e}")
+    finally:
+        db.close()
+
+
+def prerender_sale_receipt(sale_id: int):
+    """Llamar DESPUÉS del commit: el primer 'ver recibo' ya sale de la caché."""
+    _prerender.submit(_prerender_job, "sale", sale_id)
+
+
+def prerender_work_order(work_order_id: int):
+    _prerender.submit(_prerender_job, "work_order", work_order_id)
+
+
+def get_pdf_cache_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+    total = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = round(stats["hits"] / total, 3) if total else 0.0
+    stats["max_mb"] = PDF_CACHE_MAX_BYTES // (1024 * 1024)
+    return stats
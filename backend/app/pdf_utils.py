@@ -2,128 +2,280 @@ from io import BytesIO
 from . import schemas
 from reportlab.pdfgen import canvas
 from reportlab.lib.units import mm
+from reportlab.lib.utils import ImageReader
 from reportlab.platypus import Paragraph
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.enums import TA_CENTER
 # --- LIBRERÍAS DE TIEMPO ---
 import pytz
+import itertools
 import os
+import tempfile
+import threading
+
+# ===================================================================
+# --- CONTEXTO DE DIBUJO COMPARTIDO (ESTILOS, LOGO, TICKET 58mm) ---
+# ===================================================================
+# Antes cada generador armaba su getSampleStyleSheet() + sus ParagraphStyle y
+# sus propias funciones draw_paragraph/draw_line en CADA llamada. En un recibo
+# chico eso era casi todo el tiempo de render. Ahora:
+# - STYLES se arma UNA vez al importar el módulo (los estilos no se modifican).
+# - El logo de cada empresa se decodifica una vez y queda en memoria como
+#   ImageReader (se vuelve a leer si cambia la URL o el archivo en disco).
+# - ThermalLayout es el "motor" de ticket térmico que comparten los generadores.
+
+# Versión del diseño de los PDFs: forma parte de la clave/ETag de pdf_cache.
+# ¡Subirla cada vez que cambie lo que se dibuja! Si no, se siguen sirviendo
+# (y respondiendo 304 a) los PDFs viejos guardados en caché.
+# 2: recibos y órdenes con el logo de la empresa en la cabecera
+PDF_LAYOUT_VERSION = 2
+
+THERMAL_WIDTH = 58 * mm
+THERMAL_HEIGHT = 297 * mm
+
+_BASE_STYLE = getSampleStyleSheet()["Normal"]
+
+
+def _style(name, font_size, leading, bold=False, centered=False, font_name=None):
+    return ParagraphStyle(
+        name=name,
+        parent=_BASE_STYLE,
+        alignment=TA_CENTER if centered else _BASE_STYLE.alignment,
+        fontName=font_name or ("Helvetica-Bold" if bold else _BASE_STYLE.fontName),
+        fontSize=font_size,
+        leading=leading,
+    )
 
-# --- NOTA: Ahora las funciones reciben 'company_settings' ---
 
-def generate_work_order_pdf(work_order: schemas.WorkOrder, company_settings: schemas.CompanySettings):
-    buffer = BytesIO()
-    width, height = 58 * mm, 297 * mm 
-    c = canvas.Canvas(buffer, pagesize=(width, height))
-
-    styles = getSampleStyleSheet()
-    
-    # --- ESTILOS ---
-    style_title = ParagraphStyle(name='centered_bold', parent=styles['Normal'], alignment=TA_CENTER, fontName='Helvetica-Bold', fontSize=9, leading=11)
-    style_centered = ParagraphStyle(name='centered', parent=styles['Normal'], alignment=TA_CENTER, fontSize=7, leading=9)
-    style_normal = ParagraphStyle(name='normal', parent=styles['Normal'], fontSize=8, leading=10)
-    style_bold = ParagraphStyle(name='bold', parent=styles['Normal'], fontName='Helvetica-Bold', fontSize=8, leading=10)
-    
-    y = height - (5 * mm)
-
-    def draw_paragraph(text, style, margin_left=4*mm):
-        nonlocal y
-        para = Paragraph(text, style)
-        para.wrapOn(c, width - (margin_left * 2), height)
-        p_height = para.height
-        para.drawOn(c, margin_left, y - p_height)
-        y -= p_height + (0.5 * mm)
+STYLES = {
+    "title": _style("title", 9, 11, bold=True, centered=True),
+    "title_lg": _style("title_lg", 10, 12, bold=True, centered=True),
+    "subtitle": _style("subtitle", 8, 10, bold=True, centered=True),
+    "centered": _style("centered", 7, 9, centered=True),
+    "centered_tight": _style("centered_tight", 7, 8, centered=True),
+    "centered_md": _style("centered_md", 8, 10, centered=True),
+    "normal": _style("normal", 8, 10),
+    "normal_sm": _style("normal_sm", 7, 9),
+    "small": _style("small", 7, 8),
+    "bold": _style("bold", 8, 10, bold=True),
+    "code": _style("code", 14, 16, centered=True, font_name="Courier-Bold"),
+}
+
+# --- LOGO POR EMPRESA ---
+# Clave: id de CompanySettings -> (versión, ImageReader o None si no se pudo leer).
+# La versión es (logo_url, mtime del archivo). Los logos nuevos se guardan con el
+# hash del contenido en el nombre, así que la URL cambia; el mtime cubre los logos
+# antiguos (logo_empresa.png) sobrescritos en el mismo archivo. Cada proceso de
+# pdf_worker lo comprueba solo: invalidate_company_logo solo limpia el proceso que la llama.
+LOGO_MAX_HEIGHT = 14 * mm
+
+_logo_cache = {}
+_logo_lock = threading.Lock()
+
+
+def _logo_path(logo_url: str) -> str:
+    # La BD guarda "/uploads/..." -> en disco es "/code/uploads/..."
+    return f"/code{logo_url}"
+
+
+def _load_logo(logo_url: str):
+    path = _logo_path(logo_url)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "rb") as f:
+            reader = ImageReader(BytesIO(f.read()))
+        reader.getRGBData()  # Decodifica ya (ImageReader guarda los píxeles)
+        return reader
+    except Exception as e:
+        print(f"⚠️ [PDF] No se pudo leer el logo {path}: {e}")
+        return None
+
+
+def get_company_logo(company_settings: schemas.CompanySettings):
+    """ImageReader del logo de la empresa (decodificado una sola vez) o None."""
+    logo_url = getattr(company_settings, "logo_url", None)
+    if not logo_url:
+        return None
+    try:
+        mtime = os.stat(_logo_path(logo_url)).st_mtime_ns
+    except OSError:
+        mtime = None
+    version = (logo_url, mtime)
+    with _logo_lock:
+        cached = _logo_cache.get(company_settings.id)
+    if cached and cached[0] == version:
+        return cached[1]
 
-    def draw_line(weight=0.5):
-        nonlocal y
-        y -= 2 * mm
-        c.setLineWidth(weight)
-        c.line(4 * mm, y, width - (4 * mm), y)
-        y -= 2.5 * mm
+    reader = _load_logo(logo_url)
+    with _logo_lock:
+        _logo_cache[company_settings.id] = (version, reader)
+    return reader
 
-    # --- CABECERA DINÁMICA INTELIGENTE (ORDEN DE TRABAJO) ---
-    # Lógica de prioridad: Sucursal > Empresa
-    
+
+def invalidate_company_logo(settings_id: int):
+    """Olvida el logo en memoria de ESTE proceso (los demás lo detectan por la versión)."""
+    with _logo_lock:
+        _logo_cache.pop(settings_id, None)
+
+
+class ThermalLayout:
+    """
+    Ticket térmico dibujado de arriba hacia abajo. Lleva la 'y' actual y el
+    lienzo; 'margin' es el margen izquierdo por defecto de los párrafos,
+    'gap' el espacio después de cada párrafo e 'inset' cuánto se angosta el
+    ancho útil además de los márgenes.
+    """
+
+    def __init__(self, width=THERMAL_WIDTH, height=THERMAL_HEIGHT, margin=4 * mm, gap=0.5 * mm, inset=0):
+        self.buffer = BytesIO()
+        self.width, self.height = width, height
+        self.c = canvas.Canvas(self.buffer, pagesize=(width, height))
+        self.margin, self.gap, self.inset = margin, gap, inset
+        self.y = height - (5 * mm)
+
+    def paragraph(self, text, style, margin_left=None, gap=None):
+        margin_left = self.margin if margin_left is None else margin_left
+        para = Paragraph(text, style)
+        _, p_height = para.wrapOn(self.c, self.width - (margin_left * 2) - self.inset, self.height)
+        para.drawOn(self.c, margin_left, self.y - p_height)
+        self.y -= p_height + (self.gap if gap is None else gap)
+
+    def line(self, weight=0.5):
+        """Línea sólida de lado a lado (4mm de margen)."""
+        self.y -= 2 * mm
+        self.c.setLineWidth(weight)
+        self.c.line(4 * mm, self.y, self.width - (4 * mm), self.y)
+        self.y -= 2.5 * mm
+
+    def separator(self, before=1.5 * mm, after=2.5 * mm):
+        """Línea punteada (2mm de margen)."""
+        self.y -= before
+        self.c.setLineWidth(0.5)
+        self.c.setDash(1, 2)
+        self.c.line(2 * mm, self.y, self.width - (2 * mm), self.y)
+        self.c.setDash([])
+        self.y -= after
+
+    def signature_line(self, inset=8 * mm):
+        """Raya para firmar (no mueve la 'y')."""
+        self.c.line(inset, self.y, self.width - inset, self.y)
+
+    def logo(self, reader):
+        """Logo centrado, escalado para no pasar de LOGO_MAX_HEIGHT ni del ancho útil."""
+        if reader is None:
+            return
+        img_width, img_height = reader.getSize()
+        max_width = self.width - (self.margin * 2)
+        scale = min(LOGO_MAX_HEIGHT / img_height, max_width / img_width)
+        draw_width, draw_height = img_width * scale, img_height * scale
+        self.c.drawImage(reader, (self.width - draw_width) / 2, self.y - draw_height,
+                         width=draw_width, height=draw_height, mask='auto')
+        self.y -= draw_height + (2 * mm)
+
+    def finish(self):
+        self.c.showPage()
+        self.c.save()
+        self.buffer.seek(0)
+        return self.buffer
+
+
+def draw_branch_header(layout: ThermalLayout, company_settings: schemas.CompanySettings, location):
+    """
+    Cabecera de los documentos del cliente (orden y venta): logo, nombre y datos
+    de contacto. Lógica de prioridad: Sucursal > Empresa.
+    """
     # 1. Dirección
     display_address = company_settings.address
-    if work_order.location and work_order.location.address:
-        display_address = work_order.location.address # Gana la sucursal
+    if location and location.address:
+        display_address = location.address # Gana la sucursal
 
     # 2. Teléfono
     display_phone = company_settings.phone
-    if work_order.location and work_order.location.phone:
-        display_phone = work_order.location.phone # Gana la sucursal
+    if location and location.phone:
+        display_phone = location.phone # Gana la sucursal
 
     # 3. Email
     display_email = company_settings.email
-    if work_order.location and work_order.location.email:
-        display_email = work_order.location.email # Gana la sucursal
+    if location and location.email:
+        display_email = location.email # Gana la sucursal
 
     # --- DIBUJAR ---
-    draw_paragraph(company_settings.name, style_title)
-    
+    layout.logo(get_company_logo(company_settings))
+    layout.paragraph(company_settings.name, STYLES["title"])
+
     if display_address:
-        draw_paragraph(display_address, style_centered)
-    
-    draw_paragraph(f"RUC: {company_settings.ruc}", style_centered)
-    
+        layout.paragraph(display_address, STYLES["centered"])
+
+    layout.paragraph(f"RUC: {company_settings.ruc}", STYLES["centered"])
+
     if display_phone:
-        draw_paragraph(f"Telf: {display_phone}", style_centered)
-        
+        layout.paragraph(f"Telf: {display_phone}", STYLES["centered"])
+
     if display_email:
-        draw_paragraph(display_email, style_centered)
+        layout.paragraph(display_email, STYLES["centered"])
 
-    y -= 3 * mm
-    draw_line()
-    # ---------------------------------------
+    layout.y -= 3 * mm
+    layout.line()
+
+
+# --- NOTA: Ahora las funciones reciben 'company_settings' ---
+
+def generate_work_order_pdf(work_order: schemas.WorkOrder, company_settings: schemas.CompanySettings):
+    layout = ThermalLayout()
+    c = layout.c
+    style_centered, style_normal, style_bold = STYLES["centered"], STYLES["normal"], STYLES["bold"]
+
+    # --- CABECERA DINÁMICA INTELIGENTE (ORDEN DE TRABAJO) ---
+    draw_branch_header(layout, company_settings, work_order.location)
 
     c.setFont("Helvetica-Bold", 8)
-    c.drawString(5 * mm, y, f"Orden N°: {work_order.work_order_number}")
+    c.drawString(5 * mm, layout.y, f"Orden N°: {work_order.work_order_number}")
     c.setFont("Helvetica", 8)
-    c.drawString(30 * mm, y, f"Fecha: {work_order.created_at.strftime('%d/%m/%Y')}")
-    y -= 4 * mm
-    
+    c.drawString(30 * mm, layout.y, f"Fecha: {work_order.created_at.strftime('%d/%m/%Y')}")
+    layout.y -= 4 * mm
+
     # --- TÉCNICO RESPONSABLE ---
     if work_order.user:
-        draw_paragraph(f"<b>Atendido por:</b> {work_order.user.email}", style_normal)
-    
-    draw_line()
+        layout.paragraph(f"<b>Atendido por:</b> {work_order.user.email}", style_normal)
+
+    layout.line()
 
-    draw_paragraph("<b>CLIENTE:</b>", style_bold)
-    draw_paragraph(f"{work_order.customer_name}", style_normal)
-    draw_paragraph(f"<b>C.I:</b> {work_order.customer_id_card}", style_normal)
-    draw_paragraph(f"<b>Telf:</b> {work_order.customer_phone}", style_normal)
+    layout.paragraph("<b>CLIENTE:</b>", style_bold)
+    layout.paragraph(f"{work_order.customer_name}", style_normal)
+    layout.paragraph(f"<b>C.I:</b> {work_order.customer_id_card}", style_normal)
+    layout.paragraph(f"<b>Telf:</b> {work_order.customer_phone}", style_normal)
     if work_order.customer_email:
-        draw_paragraph(f"<b>Email:</b> {work_order.customer_email}", style_normal)
+        layout.paragraph(f"<b>Email:</b> {work_order.customer_email}", style_normal)
     if work_order.customer_address:
-        draw_paragraph(f"<b>Dir:</b> {work_order.customer_address}", style_normal)
-    y -= 2 * mm
-    
-    draw_paragraph("<b>EQUIPO:</b>", style_bold)
-    draw_paragraph(f"{work_order.device_type} {work_order.device_brand} {work_order.device_model}", style_normal)
+        layout.paragraph(f"<b>Dir:</b> {work_order.customer_address}", style_normal)
+    layout.y -= 2 * mm
+
+    layout.paragraph("<b>EQUIPO:</b>", style_bold)
+    layout.paragraph(f"{work_order.device_type} {work_order.device_brand} {work_order.device_model}", style_normal)
     if work_order.device_serial:
-        draw_paragraph(f"S/N: {work_order.device_serial}", style_normal)
-    y -= 2 * mm
+        layout.paragraph(f"S/N: {work_order.device_serial}", style_normal)
+    layout.y -= 2 * mm
 
     if work_order.physical_condition:
-        draw_paragraph("<b>ESTADO DEL EQUIPO (Recepción):</b>", style_bold)
-        draw_paragraph(work_order.physical_condition, style_normal)
-        y -= 3 * mm
-    
-    draw_paragraph("<b>PROBLEMA REPORTADO:</b>", style_bold)
-    draw_paragraph(work_order.reported_issue, style_normal)
-    y -= 3 * mm
-
-    draw_paragraph(f"<b>COSTO ESTIMADO:</b> ${work_order.estimated_cost:.2f}", style_normal)
-    draw_paragraph(f"<b>ABONO:</b> ${work_order.deposit_amount:.2f}", style_normal)
-    y -= 3 * mm
-    draw_line()
+        layout.paragraph("<b>ESTADO DEL EQUIPO (Recepción):</b>", style_bold)
+        layout.paragraph(work_order.physical_condition, style_normal)
+        layout.y -= 3 * mm
+
+    layout.paragraph("<b>PROBLEMA REPORTADO:</b>", style_bold)
+    layout.paragraph(work_order.reported_issue, style_normal)
+    layout.y -= 3 * mm
+
+    layout.paragraph(f"<b>COSTO ESTIMADO:</b> ${work_order.estimated_cost:.2f}", style_normal)
+    layout.paragraph(f"<b>ABONO:</b> ${work_order.deposit_amount:.2f}", style_normal)
+    layout.y -= 3 * mm
+    layout.line()
 
     # Pie de página dinámico (mensaje configurado)
     if company_settings.footer_message:
-        draw_paragraph(company_settings.footer_message, style_centered)
+        layout.paragraph(company_settings.footer_message, style_centered)
 
-    y -= 5 * mm # Bajamos un poco antes de la firma
+    layout.y -= 5 * mm # Bajamos un poco antes de la firma
 
     # --- DIBUJAR FIRMA DIGITAL (SI EXISTE) ---
     if work_order.customer_signature:
@@ -131,121 +283,46 @@ def generate_work_order_pdf(work_order: schemas.WorkOrder, company_settings: sch
             # 1. Construimos la ruta real del archivo en el servidor
             # La base de datos tiene: "/uploads/..." -> El disco tiene: "/code/uploads/..."
             image_path = f"/code{work_order.customer_signature}"
-            
+
             if os.path.exists(image_path):
                 # 2. Dibujamos la imagen centrada
                 # Ajustamos coordenadas para que quede sobre la línea
                 # x = centro (29mm) - mitad ancho firma (15mm) = 14mm
-                c.drawImage(image_path, 14 * mm, y - 12 * mm, width=30 * mm, height=15 * mm, mask='auto')
+                c.drawImage(image_path, 14 * mm, layout.y - 12 * mm, width=30 * mm, height=15 * mm, mask='auto')
         except Exception as e:
             print(f"Error dibujando firma en PDF: {e}")
     # -----------------------------------------
 
-    y -= 10 * mm # Espacio que ocupa la firma visualmente
-
-    c.line(8 * mm, y, width - (8 * mm), y)
-    y -= 4 * mm
-    draw_paragraph("Firma Cliente", style_centered)
-    draw_paragraph(f"C.C: {work_order.customer_id_card}", style_centered)
-    
-    y -= 15 * mm
-    c.line(8 * mm, y, width - (8 * mm), y)
-    y -= 4 * mm
-    draw_paragraph("Técnico Responsable", style_centered)
-
-    c.showPage()
-    c.save()
-    buffer.seek(0)
-    return buffer
+    layout.y -= 10 * mm # Espacio que ocupa la firma visualmente
 
+    layout.signature_line()
+    layout.y -= 4 * mm
+    layout.paragraph("Firma Cliente", style_centered)
+    layout.paragraph(f"C.C: {work_order.customer_id_card}", style_centered)
 
-def generate_sale_receipt_pdf(sale: schemas.Sale, company_settings: schemas.CompanySettings):
-    buffer = BytesIO()
-    width, height = 58 * mm, 297 * mm
-    c = canvas.Canvas(buffer, pagesize=(width, height))
-
-    styles = getSampleStyleSheet()
-    style_title = ParagraphStyle(
-        name="sale_centered_bold",
-        parent=styles["Normal"],
-        alignment=TA_CENTER,
-        fontName="Helvetica-Bold",
-        fontSize=9,
-        leading=11,
-    )
-    style_centered = ParagraphStyle(
-        name="sale_centered",
-        parent=styles["Normal"],
-        alignment=TA_CENTER,
-        fontSize=7,
-        leading=9,
-    )
-    style_normal = ParagraphStyle(
-        name="sale_normal",
-        parent=styles["Normal"],
-        fontSize=8,
-        leading=10,
-    )
+    layout.y -= 15 * mm
+    layout.signature_line()
+    layout.y -= 4 * mm
+    layout.paragraph("Técnico Responsable", style_centered)
 
-    y = height - (5 * mm)
+    return layout.finish()
 
-    def draw_paragraph(text, style, margin_left=4 * mm):
-        nonlocal y
-        para = Paragraph(text, style)
-        para.wrapOn(c, width - (margin_left * 2), height)
-        p_height = para.height
-        para.drawOn(c, margin_left, y - p_height)
-        y -= p_height + (0.5 * mm)
 
-    def draw_line(weight=0.5):
-        nonlocal y
-        y -= 2 * mm
-        c.setLineWidth(weight)
-        c.line(4 * mm, y, width - (4 * mm), y)
-        y -= 2.5 * mm
+def generate_sale_receipt_pdf(sale: schemas.Sale, company_settings: schemas.CompanySettings):
+    layout = ThermalLayout()
+    c = layout.c
+    style_title, style_centered, style_normal = STYLES["title"], STYLES["centered"], STYLES["normal"]
 
     # --- CABECERA DINÁMICA INTELIGENTE (VENTA) ---
-    
-    # 1. Dirección
-    display_address = company_settings.address
-    if sale.location and sale.location.address:
-        display_address = sale.location.address
-
-    # 2. Teléfono
-    display_phone = company_settings.phone
-    if sale.location and sale.location.phone:
-        display_phone = sale.location.phone
-
-    # 3. Email
-    display_email = company_settings.email
-    if sale.location and sale.location.email:
-        display_email = sale.location.email
-
-    # --- DIBUJAR ---
-    draw_paragraph(company_settings.name, style_title)
-    
-    if display_address:
-        draw_paragraph(display_address, style_centered)
-        
-    draw_paragraph(f"RUC: {company_settings.ruc}", style_centered)
-    
-    if display_phone:
-        draw_paragraph(f"Telf: {display_phone}", style_centered)
-    
-    if display_email:
-        draw_paragraph(display_email, style_centered)
-
-    y -= 3 * mm
-    draw_line()
-    # -----------------------------------------------
+    draw_branch_header(layout, company_settings, sale.location)
 
     c.setFont("Helvetica-Bold", 8)
-    c.drawString(5 * mm, y, f"Venta N°: {sale.id}")
-    
-    y -= 4 * mm 
+    c.drawString(5 * mm, layout.y, f"Venta N°: {sale.id}")
+
+    layout.y -= 4 * mm
 
     c.setFont("Helvetica", 8)
-    
+
     # 1. Obtenemos la zona horaria
     try:
         app_timezone_str = os.getenv("TZ", "America/Guayaquil")
@@ -255,206 +332,163 @@ def generate_sale_receipt_pdf(sale: schemas.Sale, company_settings: schemas.Comp
 
     # 2. Convertimos la hora
     local_sale_time = sale.created_at.astimezone(ecuador_tz)
-    
+
     # 3. Formateamos
-    sale_date = local_sale_time.strftime("%d/%m/%Y %I:%M %p") 
-    
-    c.drawString(5 * mm, y, f"Fecha: {sale_date}")
-    
-    y -= 4 * mm
+    sale_date = local_sale_time.strftime("%d/%m/%Y %I:%M %p")
+
+    c.drawString(5 * mm, layout.y, f"Fecha: {sale_date}")
+
+    layout.y -= 4 * mm
 
     if sale.location:
-        draw_paragraph(f"<b>Sucursal:</b> {sale.location.name}", style_normal)
+        layout.paragraph(f"<b>Sucursal:</b> {sale.location.name}", style_normal)
     if sale.user:
-        draw_paragraph(f"<b>Atendido por:</b> {sale.user.email}", style_normal)
-    draw_line()
+        layout.paragraph(f"<b>Atendido por:</b> {sale.user.email}", style_normal)
+    layout.line()
 
-    draw_paragraph("<b>CLIENTE:</b>", style_normal)
-    draw_paragraph(f"{sale.customer_name}", style_normal)
-    draw_paragraph(f"<b>C.I:</b> {sale.customer_ci}", style_normal)
+    layout.paragraph("<b>CLIENTE:</b>", style_normal)
+    layout.paragraph(f"{sale.customer_name}", style_normal)
+    layout.paragraph(f"<b>C.I:</b> {sale.customer_ci}", style_normal)
     if sale.customer_phone:
-        draw_paragraph(f"<b>Telf:</b> {sale.customer_phone}", style_normal)
+        layout.paragraph(f"<b>Telf:</b> {sale.customer_phone}", style_normal)
     if sale.customer_email:
-        draw_paragraph(f"<b>Email:</b> {sale.customer_email}", style_normal)
+        layout.paragraph(f"<b>Email:</b> {sale.customer_email}", style_normal)
     if sale.customer_address:
-        draw_paragraph(f"<b>Dir:</b> {sale.customer_address}", style_normal)
-    y -= 2 * mm
+        layout.paragraph(f"<b>Dir:</b> {sale.customer_address}", style_normal)
+    layout.y -= 2 * mm
 
-    draw_paragraph("<b>DETALLE DE LA VENTA</b>", style_normal)
-    draw_line()
+    layout.paragraph("<b>DETALLE DE LA VENTA</b>", style_normal)
+    layout.line()
 
     for item in sale.items:
-        draw_paragraph(
-            f"{item.quantity} x {item.description}",
-            style_normal,
-        )
-        draw_paragraph(
+        layout.paragraph(f"{item.quantity} x {item.description}", style_normal)
+        layout.paragraph(
             f"P.Unit: ${item.unit_price:.2f} | Subtotal: ${item.line_total:.2f}",
             style_normal,
             margin_left=6 * mm,
         )
-        y -= 1 * mm
+        layout.y -= 1 * mm
 
-    draw_line()
-    draw_paragraph(f"<b>Subtotal:</b> ${sale.subtotal_amount:.2f}", style_normal)
-    draw_paragraph(
+    layout.line()
+    layout.paragraph(f"<b>Subtotal:</b> ${sale.subtotal_amount:.2f}", style_normal)
+    layout.paragraph(
         f"<b>IVA ({sale.iva_percentage:.0f}%):</b> ${sale.tax_amount:.2f}",
         style_normal,
     )
-    draw_paragraph(f"<b>Total:</b> ${sale.total_amount:.2f}", style_normal)
+    layout.paragraph(f"<b>Total:</b> ${sale.total_amount:.2f}", style_normal)
 
     formatted_payment_method = sale.payment_method.replace("_", " ").title()
-    draw_paragraph(
-        f"<b>Método de Pago:</b> {formatted_payment_method}",
-        style_normal,
-    )
+    layout.paragraph(f"<b>Método de Pago:</b> {formatted_payment_method}", style_normal)
     if sale.payment_method_details:
         if isinstance(sale.payment_method_details, list):
             for p in sale.payment_method_details:
                 method = p.get("method", "PAGO")
                 amount = p.get("amount", 0)
                 ref = p.get("reference", "")
-                
+
                 text = f"- {method}: ${float(amount):.2f}"
                 if ref:
                     text += f" (Ref: {ref})"
-                
-                draw_paragraph(text, style_normal, margin_left=6 * mm)
-        
+
+                layout.paragraph(text, style_normal, margin_left=6 * mm)
+
         elif isinstance(sale.payment_method_details, dict):
             details_str = ", ".join(
                 f"{key}: {value}" for key, value in sale.payment_method_details.items()
             )
-            draw_paragraph(details_str, style_normal, margin_left=6 * mm)
+            layout.paragraph(details_str, style_normal, margin_left=6 * mm)
 
     if sale.work_order_id:
-        draw_paragraph(
-            f"Orden asociada: #{sale.work_order_id}",
-            style_normal,
-        )
+        layout.paragraph(f"Orden asociada: #{sale.work_order_id}", style_normal)
 
-    y -= 4 * mm
+    layout.y -= 4 * mm
 
-   # --- SECCIÓN GARANTÍA CORREGIDA ---
+    # --- SECCIÓN GARANTÍA ---
     if sale.warranty_terms:
-        y -= 2 * mm # Un poco de aire antes
-        draw_line(weight=0.25)
-        
-        # Título
-        draw_paragraph("POLÍTICAS DE GARANTÍA", style_title) # Usamos style_title (centrado, negrita)
-        y -= 1 * mm
-        
-        # Texto: Usamos un estilo normal pero centrado para que se vea ordenado
-        # Importante: Paragraph se encarga de los saltos de línea automáticos
-        p = Paragraph(sale.warranty_terms, style_centered) 
-        w, h = p.wrap(width - 8*mm, height) # Le damos ancho para envolver
-        p.drawOn(c, 4*mm, y - h)
-        y -= h + (2 * mm) # Restamos la altura del párrafo + margen
-        
-        draw_line(weight=0.25)
+        layout.y -= 2 * mm # Un poco de aire antes
+        layout.line(weight=0.25)
+
+        # Título (centrado, negrita)
+        layout.paragraph("POLÍTICAS DE GARANTÍA", style_title)
+        layout.y -= 1 * mm
+
+        # Texto normal pero centrado para que se vea ordenado
+        # (Paragraph se encarga de los saltos de línea automáticos)
+        layout.paragraph(sale.warranty_terms, style_centered, gap=2 * mm)
+
+        layout.line(weight=0.25)
     # -------------------------------------------------
 
-    # Pie de página dinámico (mensaje configurado)
     # Pie de página dinámico (mensaje configurado)
     if company_settings.footer_message:
-        draw_paragraph(company_settings.footer_message, style_centered)
-    
-    y -= 10 * mm 
+        layout.paragraph(company_settings.footer_message, style_centered)
+
+    layout.y -= 10 * mm
 
     # Firma Cliente
-    c.line(8 * mm, y, width - (8 * mm), y)
-    y -= 4 * mm
-    draw_paragraph("Firma Cliente", style_centered)
-    draw_paragraph(f"C.C: {sale.customer_ci}", style_centered)
+    layout.signature_line()
+    layout.y -= 4 * mm
+    layout.paragraph("Firma Cliente", style_centered)
+    layout.paragraph(f"C.C: {sale.customer_ci}", style_centered)
 
-    y -= 10 * mm 
+    layout.y -= 10 * mm
 
     # Firma Vendedor
-    c.line(8 * mm, y, width - (8 * mm), y) 
-    y -= 4 * mm
-    draw_paragraph("Vendedor", style_centered)
+    layout.signature_line()
+    layout.y -= 4 * mm
+    layout.paragraph("Vendedor", style_centered)
     if sale.user:
-        draw_paragraph(f"{sale.user.email}", style_centered)
+        layout.paragraph(f"{sale.user.email}", style_centered)
 
-    y -= 10 * mm 
-    draw_paragraph("Notas:", style_normal, margin_left=5 * mm)
-    y -= 15 * mm 
-    c.rect(5 * mm, y, width - (10 * mm), 15 * mm)
+    layout.y -= 10 * mm
+    layout.paragraph("Notas:", style_normal, margin_left=5 * mm)
+    layout.y -= 15 * mm
+    c.rect(5 * mm, layout.y, layout.width - (10 * mm), 15 * mm)
 
-    c.showPage()
-    c.save()
-    buffer.seek(0)
-    return buffer
+    return layout.finish()
 
 # --- INICIO: Generador de Nota de Crédito ---
 def generate_credit_note_pdf(credit_note: schemas.CreditNote, company_settings: schemas.CompanySettings):
-    buffer = BytesIO()
-    width, height = 58 * mm, 297 * mm 
-    c = canvas.Canvas(buffer, pagesize=(width, height))
-
-    styles = getSampleStyleSheet()
-    style_title = ParagraphStyle(name='centered_bold', parent=styles['Normal'], alignment=TA_CENTER, fontName='Helvetica-Bold', fontSize=10, leading=12)
-    style_centered = ParagraphStyle(name='centered', parent=styles['Normal'], alignment=TA_CENTER, fontSize=8, leading=10)
-    style_normal = ParagraphStyle(name='normal', parent=styles['Normal'], fontSize=8, leading=10)
-    style_code = ParagraphStyle(name='code', parent=styles['Normal'], alignment=TA_CENTER, fontName='Courier-Bold', fontSize=14, leading=16)
-
-    y = height - (5 * mm)
-
-    def draw_paragraph(text, style, margin_left=4*mm):
-        nonlocal y
-        para = Paragraph(text, style)
-        para.wrapOn(c, width - (margin_left * 2), height)
-        p_height = para.height
-        para.drawOn(c, margin_left, y - p_height)
-        y -= p_height + (0.5 * mm)
-
-    def draw_line():
-        nonlocal y
-        y -= 2 * mm
-        c.setLineWidth(0.5)
-        c.line(4 * mm, y, width - (4 * mm), y)
-        y -= 2.5 * mm
+    layout = ThermalLayout()
+    style_title, style_centered, style_normal = STYLES["title_lg"], STYLES["centered_md"], STYLES["normal"]
 
     # --- CABECERA EMPRESA ---
-    draw_paragraph(company_settings.name, style_title)
-    draw_paragraph(f"RUC: {company_settings.ruc}", style_centered)
+    layout.paragraph(company_settings.name, style_title)
+    layout.paragraph(f"RUC: {company_settings.ruc}", style_centered)
     if company_settings.phone:
-        draw_paragraph(f"Telf: {company_settings.phone}", style_centered)
-    y -= 3 * mm
-    draw_line()
+        layout.paragraph(f"Telf: {company_settings.phone}", style_centered)
+    layout.y -= 3 * mm
+    layout.line()
 
     # --- TÍTULO ---
-    draw_paragraph("NOTA DE CRÉDITO", style_title)
-    draw_paragraph("(Saldo a Favor)", style_centered)
-    y -= 3 * mm
+    layout.paragraph("NOTA DE CRÉDITO", style_title)
+    layout.paragraph("(Saldo a Favor)", style_centered)
+    layout.y -= 3 * mm
 
     # --- CÓDIGO (EL DINERO) ---
-    c.rect(4 * mm, y - 10*mm, width - 8*mm, 12*mm) # Caja alrededor del código
-    y -= 2 * mm # Margen interno top
-    draw_paragraph(credit_note.code, style_code)
-    y -= 4 * mm # Margen interno bottom
-    
-    y -= 4 * mm
+    layout.c.rect(4 * mm, layout.y - 10*mm, layout.width - 8*mm, 12*mm) # Caja alrededor del código
+    layout.y -= 2 * mm # Margen interno top
+    layout.paragraph(credit_note.code, STYLES["code"])
+    layout.y -= 4 * mm # Margen interno bottom
+
+    layout.y -= 4 * mm
 
     # --- DETALLES ---
     fecha_str = credit_note.created_at.strftime('%d/%m/%Y %H:%M') if credit_note.created_at else "N/A"
 
-    draw_paragraph(f"Fecha Emisión: {fecha_str}", style_normal)
-    draw_paragraph(f"Valor: ${credit_note.amount:.2f}", style_title) # Valor en grande/negrita
-    
-    draw_line()
-    
-    draw_paragraph("<b>Motivo:</b>", style_normal)
-    draw_paragraph(credit_note.reason, style_normal)
-    
-    y -= 5 * mm
-    draw_paragraph("Este documento representa un saldo a favor. Preséntelo en caja para su próxima compra.", style_centered)
-    draw_paragraph("Válido en todas nuestras sucursales.", style_centered)
+    layout.paragraph(f"Fecha Emisión: {fecha_str}", style_normal)
+    layout.paragraph(f"Valor: ${credit_note.amount:.2f}", style_title) # Valor en grande/negrita
 
-    c.showPage()
-    c.save()
-    buffer.seek(0)
-    return buffer
+    layout.line()
+
+    layout.paragraph("<b>Motivo:</b>", style_normal)
+    layout.paragraph(credit_note.reason, style_normal)
+
+    layout.y -= 5 * mm
+    layout.paragraph("Este documento representa un saldo a favor. Preséntelo en caja para su próxima compra.", style_centered)
+    layout.paragraph("Válido en todas nuestras sucursales.", style_centered)
+
+    return layout.finish()
 # --- FIN: Generador de Nota de Crédito ---
 
 
@@ -464,157 +498,90 @@ def generate_withdrawal_receipt_pdf(work_order: schemas.WorkOrder, company_setti
     Genera un ACTA DE ENTREGA Y DESCARGO DE RESPONSABILIDAD.
     Detalla el estado de ingreso, el problema y la conformidad del retiro.
     """
-    buffer = BytesIO()
-    # Usamos un largo dinámico o fijo suficiente para el detalle. 
-    # 200mm suele ser suficiente para recibos térmicos largos con detalles.
-    width, height = 58 * mm, 220 * mm 
-    c = canvas.Canvas(buffer, pagesize=(width, height))
-    styles = getSampleStyleSheet()
-    
-    # --- Estilos Personalizados ---
-    style_title = ParagraphStyle(
-        name='title', 
-        parent=styles['Normal'], 
-        alignment=TA_CENTER, 
-        fontName='Helvetica-Bold', 
-        fontSize=10, 
-        leading=12
-    )
-    style_subtitle = ParagraphStyle(
-        name='subtitle', 
-        parent=styles['Normal'], 
-        alignment=TA_CENTER, 
-        fontName='Helvetica-Bold', 
-        fontSize=8, 
-        leading=10
-    )
-    style_normal = ParagraphStyle(
-        name='normal', 
-        parent=styles['Normal'], 
-        fontSize=8, 
-        leading=10
-    )
-    style_small = ParagraphStyle(
-        name='small', 
-        parent=styles['Normal'], 
-        fontSize=7, 
-        leading=8
-    )
-    style_centered = ParagraphStyle(
-        name='centered', 
-        parent=styles['Normal'], 
-        alignment=TA_CENTER, 
-        fontSize=7, 
-        leading=8
-    )
-    style_bold = ParagraphStyle(
-        name='bold', 
-        parent=styles['Normal'], 
-        fontName='Helvetica-Bold', 
-        fontSize=8, 
-        leading=10
-    )
-
-    y = height - (5 * mm)
-
-    # --- Funciones de Ayuda ---
-    def draw_paragraph(text, style, margin_left=2*mm):
-        nonlocal y
-        # Envolver texto para que no se salga del ancho de 58mm
-        p = Paragraph(text, style)
-        avail_width = width - (margin_left * 2) - (2 * mm)
-        w, h = p.wrap(avail_width, height)
-        p.drawOn(c, margin_left, y - h)
-        y -= h + (1 * mm) # Salto de línea
-
-    def draw_separator():
-        nonlocal y
-        y -= 1.5 * mm
-        c.setLineWidth(0.5)
-        c.setDash(1, 2) # Línea punteada
-        c.line(2 * mm, y, width - (2 * mm), y)
-        c.setDash([]) # Resetear línea sólida
-        y -= 2.5 * mm
+    # 220mm alcanza para el detalle; márgenes más angostos para que quepa el texto legal
+    layout = ThermalLayout(height=220 * mm, margin=2 * mm, gap=1 * mm, inset=2 * mm)
+    style_title, style_normal, style_bold = STYLES["title_lg"], STYLES["normal"], STYLES["bold"]
+    style_small, style_centered = STYLES["small"], STYLES["centered_tight"]
 
     # ==========================================
     # 1. CABECERA (DATOS DE LA SUCURSAL)
     # ==========================================
-    
+
     # Prioridad: Datos de la Sucursal > Datos de la Empresa
     branch_name = work_order.location.name if work_order.location else "Sucursal Principal"
     branch_address = work_order.location.address if (work_order.location and work_order.location.address) else company_settings.address
     branch_phone = work_order.location.phone if (work_order.location and work_order.location.phone) else company_settings.phone
 
-    draw_paragraph(company_settings.name.upper(), style_title)
-    draw_paragraph(f"RUC: {company_settings.ruc}", style_centered)
-    
+    layout.paragraph(company_settings.name.upper(), style_title)
+    layout.paragraph(f"RUC: {company_settings.ruc}", style_centered)
+
     # Datos específicos de la sucursal donde se emite
     if branch_name:
-        draw_paragraph(branch_name, style_centered)
+        layout.paragraph(branch_name, style_centered)
     if branch_address:
-        draw_paragraph(branch_address, style_centered)
+        layout.paragraph(branch_address, style_centered)
     if branch_phone:
-        draw_paragraph(f"Telf: {branch_phone}", style_centered)
-    
-    draw_separator()
+        layout.paragraph(f"Telf: {branch_phone}", style_centered)
+
+    layout.separator()
 
     # ==========================================
     # 2. TÍTULO DEL DOCUMENTO
     # ==========================================
-    draw_paragraph("ACTA DE ENTREGA", style_title)
-    draw_paragraph("(Retiro Sin Reparación)", style_subtitle)
-    
+    layout.paragraph("ACTA DE ENTREGA", style_title)
+    layout.paragraph("(Retiro Sin Reparación)", STYLES["subtitle"])
+
     import datetime
     # Ajuste de hora (asumiendo servidor UTC, ajustamos visualmente si es necesario o usamos la del sistema)
     ahora = datetime.datetime.now().strftime("%d/%m/%Y %H:%M")
-    
-    y -= 2 * mm
-    draw_paragraph(f"<b>Fecha Emisión:</b> {ahora}", style_normal)
-    draw_paragraph(f"<b>Orden N°:</b> {work_order.id}", style_bold)
-    
-    draw_separator()
+
+    layout.y -= 2 * mm
+    layout.paragraph(f"<b>Fecha Emisión:</b> {ahora}", style_normal)
+    layout.paragraph(f"<b>Orden N°:</b> {work_order.id}", style_bold)
+
+    layout.separator()
 
     # ==========================================
     # 3. DATOS DEL CLIENTE Y EQUIPO
     # ==========================================
-    draw_paragraph("<b>DATOS DEL CLIENTE:</b>", style_bold)
-    draw_paragraph(f"{work_order.customer_name}", style_normal)
-    draw_paragraph(f"CI/RUC: {work_order.customer_id_card}", style_normal)
-    
-    y -= 2 * mm
-    draw_paragraph("<b>EQUIPO:</b>", style_bold)
+    layout.paragraph("<b>DATOS DEL CLIENTE:</b>", style_bold)
+    layout.paragraph(f"{work_order.customer_name}", style_normal)
+    layout.paragraph(f"CI/RUC: {work_order.customer_id_card}", style_normal)
+
+    layout.y -= 2 * mm
+    layout.paragraph("<b>EQUIPO:</b>", style_bold)
     device_str = f"{work_order.device_type} {work_order.device_brand} {work_order.device_model}"
-    draw_paragraph(device_str, style_normal)
+    layout.paragraph(device_str, style_normal)
     if work_order.device_serial:
-        draw_paragraph(f"Serie/IMEI: {work_order.device_serial}", style_small)
+        layout.paragraph(f"Serie/IMEI: {work_order.device_serial}", style_small)
 
-    draw_separator()
+    layout.separator()
 
     # ==========================================
     # 4. HISTORIAL DE INGRESO (LA DEFENSA)
     # ==========================================
     # Aquí mostramos cómo llegó el equipo para evitar reclamos de "me lo rayaron aquí"
-    
-    draw_paragraph("<b>CONDICIÓN DE INGRESO:</b>", style_bold)
+
+    layout.paragraph("<b>CONDICIÓN DE INGRESO:</b>", style_bold)
     condition = work_order.physical_condition or "No registrada"
-    draw_paragraph(condition, style_small)
-    
-    y -= 1.5 * mm
-    draw_paragraph("<b>FALLA REPORTADA:</b>", style_bold)
+    layout.paragraph(condition, style_small)
+
+    layout.y -= 1.5 * mm
+    layout.paragraph("<b>FALLA REPORTADA:</b>", style_bold)
     issue = work_order.reported_issue or "No registrada"
-    draw_paragraph(issue, style_small)
+    layout.paragraph(issue, style_small)
 
-    draw_separator()
+    layout.separator()
 
     # ==========================================
     # 5. DETALLE DEL COBRO
     # ==========================================
-    draw_paragraph(f"<b>COSTO REVISIÓN:</b> ${work_order.final_cost:.2f}", style_bold)
+    layout.paragraph(f"<b>COSTO REVISIÓN:</b> ${work_order.final_cost:.2f}", style_bold)
     # Si hubo abono, lo mostramos para claridad
     if work_order.deposit_amount > 0:
-        draw_paragraph(f"(Abono Previo: ${work_order.deposit_amount:.2f})", style_small)
-    
-    draw_separator()
+        layout.paragraph(f"(Abono Previo: ${work_order.deposit_amount:.2f})", style_small)
+
+    layout.separator()
 
     # ==========================================
     # 6. DECLARACIÓN LEGAL (DESCARGO)
@@ -627,190 +594,180 @@ def generate_withdrawal_receipt_pdf(work_order: schemas.WorkOrder, company_setti
         "La empresa queda liberada de cualquier responsabilidad posterior sobre el funcionamiento "
         "del equipo relacionado con la falla original no reparada."
     )
-    draw_paragraph(disclaimer, style_small) # Texto legal en letra pequeña pero legible
-    
-    y -= 2 * mm
-    draw_paragraph("Recibí Conforme:", style_centered)
+    layout.paragraph(disclaimer, style_small) # Texto legal en letra pequeña pero legible
+
+    layout.y -= 2 * mm
+    layout.paragraph("Recibí Conforme:", style_centered)
 
     # ==========================================
     # 7. FIRMAS
     # ==========================================
-    y -= 12 * mm # Espacio para firmar
-    c.line(8 * mm, y, width - (8 * mm), y) # Línea de firma cliente
-    y -= 3 * mm
-    draw_paragraph("FIRMA CLIENTE", style_centered)
-    draw_paragraph(f"CI: {work_order.customer_id_card}", style_centered)
-
-    y -= 10 * mm # Espacio
-    
+    layout.y -= 12 * mm # Espacio para firmar
+    layout.signature_line() # Línea de firma cliente
+    layout.y -= 3 * mm
+    layout.paragraph("FIRMA CLIENTE", style_centered)
+    layout.paragraph(f"CI: {work_order.customer_id_card}", style_centered)
+
+    layout.y -= 10 * mm # Espacio
+
     # Datos del Empleado (Usuario que atiende)
     employee_name = "Técnico Responsable"
     if work_order.user:
         # Intentamos usar nombre completo, sino email
         employee_name = getattr(work_order.user, 'full_name', None) or work_order.user.email
-    
-    c.line(8 * mm, y, width - (8 * mm), y) # Línea de firma empleado
-    y -= 3 * mm
-    draw_paragraph("ENTREGADO POR:", style_centered)
-    draw_paragraph(str(employee_name), style_centered)
 
-    c.showPage()
-    c.save()
-    buffer.seek(0)
-    return buffer
+    layout.signature_line() # Línea de firma empleado
+    layout.y -= 3 * mm
+    layout.paragraph("ENTREGADO POR:", style_centered)
+    layout.paragraph(str(employee_name), style_centered)
+
+    return layout.finish()
 # --- FIN DE NUESTRO CÓDIGO ---
 
 # --- INICIO: Generador de Reporte de Cierre DETALLADO ---
 def generate_cash_closure_pdf(closure_data: dict, company_settings: schemas.CompanySettings, user_email: str, location_name: str):
-    buffer = BytesIO()
     # Calculamos altura dinámica según la cantidad de items
     base_height = 200 * mm
     extra_height = (len(closure_data['sales_list']) + len(closure_data['expenses_list']) + len(closure_data['incomes_list'])) * 5 * mm
-    width, height = 72 * mm, base_height + extra_height # Un poco más ancho (72mm) para que quepa el detalle
-    
-    c = canvas.Canvas(buffer, pagesize=(width, height))
-    styles = getSampleStyleSheet()
-
-    # Estilos
-    style_title = ParagraphStyle(name='title', parent=styles['Normal'], alignment=TA_CENTER, fontName='Helvetica-Bold', fontSize=10, leading=12)
-    style_centered = ParagraphStyle(name='centered', parent=styles['Normal'], alignment=TA_CENTER, fontSize=8, leading=10)
-    style_normal = ParagraphStyle(name='normal', parent=styles['Normal'], fontSize=7, leading=9) # Letra más pequeña para detalle
-    style_bold = ParagraphStyle(name='bold', parent=styles['Normal'], fontName='Helvetica-Bold', fontSize=8, leading=10)
-
-    y = height - (5 * mm)
-
-    def draw_paragraph(text, style):
-        nonlocal y
-        p = Paragraph(text, style)
-        w, h = p.wrap(width - 6*mm, height)
-        p.drawOn(c, 3*mm, y - h)
-        y -= h + (1.5 * mm)
+    # Un poco más ancho (72mm) para que quepa el detalle
+    layout = ThermalLayout(width=72 * mm, height=base_height + extra_height, margin=3 * mm, gap=1.5 * mm)
+    c, width = layout.c, layout.width
+    style_centered, style_bold = STYLES["centered_md"], STYLES["bold"]
 
     def draw_line():
-        nonlocal y
-        y -= 1 * mm
-        c.setLineWidth(0.5)
-        c.setDash(1, 2)
-        c.line(2 * mm, y, width - (2 * mm), y)
-        c.setDash([])
-        y -= 2 * mm
+        layout.separator(before=1 * mm, after=2 * mm)
 
     def draw_row(label, value, is_bold=False):
-        nonlocal y
         font = "Helvetica-Bold" if is_bold else "Helvetica"
         c.setFont(font, 8)
-        c.drawString(3 * mm, y, label)
-        c.drawRightString(width - 3 * mm, y, f"${value:,.2f}")
-        y -= 4 * mm
+        c.drawString(3 * mm, layout.y, label)
+        c.drawRightString(width - 3 * mm, layout.y, f"${value:,.2f}")
+        layout.y -= 4 * mm
 
     def draw_detail_row(item):
-        nonlocal y
         # Hora
         c.setFont("Helvetica", 6)
         time_str = item['time'].strftime("%H:%M")
-        c.drawString(2 * mm, y, time_str)
-        
+        c.drawString(2 * mm, layout.y, time_str)
+
         # Descripción Principal (Negrita si es Venta)
         desc = item['description'][:35] # Un poco más largo
         c.setFont("Helvetica-Bold", 7)
-        c.drawString(10 * mm, y, desc)
-        
+        c.drawString(10 * mm, layout.y, desc)
+
         # Monto
         c.setFont("Helvetica-Bold", 7)
-        c.drawRightString(width - 3 * mm, y, f"${item['amount']:.2f}")
-        y -= 3 * mm
+        c.drawRightString(width - 3 * mm, layout.y, f"${item['amount']:.2f}")
+        layout.y -= 3 * mm
 
         # --- NUEVO: Línea de Detalle (Productos) ---
         if item.get('details'):
             c.setFont("Helvetica", 6)
             # Si es muy largo, lo cortamos para que no rompa el diseño
             det = item['details'][:60] + "..." if len(item['details']) > 60 else item['details']
-            c.drawString(10 * mm, y, det)
-            y -= 3 * mm
+            c.drawString(10 * mm, layout.y, det)
+            layout.y -= 3 * mm
         # -------------------------------------------
-        
-        y -= 1 * mm # Separador extra entre items
+
+        layout.y -= 1 * mm # Separador extra entre items
 
     # --- CONTENIDO ---
-    
+
     # Cabecera
-    draw_paragraph(company_settings.name.upper(), style_title)
-    draw_paragraph("REPORTE DE CIERRE DETALLADO", style_centered)
-    
-    y -= 2 * mm
-    draw_paragraph(f"<b>Sucursal:</b> {location_name}", style_centered)
-    draw_paragraph(f"<b>Cajero:</b> {user_email}", style_centered)
-    
+    layout.paragraph(company_settings.name.upper(), STYLES["title_lg"])
+    layout.paragraph("REPORTE DE CIERRE DETALLADO", style_centered)
+
+    layout.y -= 2 * mm
+    layout.paragraph(f"<b>Sucursal:</b> {location_name}", style_centered)
+    layout.paragraph(f"<b>Cajero:</b> {user_email}", style_centered)
+
     from datetime import datetime
     start_val = closure_data.get('start_time')
     end_val = closure_data.get('end_time')
 
     start_str = start_val.strftime("%d/%m %H:%M") if isinstance(start_val, datetime) else "Inicio"
     end_str = end_val.strftime("%d/%m %H:%M") if isinstance(end_val, datetime) else "Actual"
-    
-    draw_paragraph(f"<b>Periodo:</b> {start_str} - {end_str}", style_centered)
-    
+
+    layout.paragraph(f"<b>Periodo:</b> {start_str} - {end_str}", style_centered)
+
     draw_line()
 
     # Resumen Financiero
-    draw_paragraph("<b>RESUMEN GENERAL</b>", style_bold)
-    y -= 2 * mm
+    layout.paragraph("<b>RESUMEN GENERAL</b>", style_bold)
+    layout.y -= 2 * mm
     draw_row("Ventas Efectivo (+)", closure_data['total_cash_sales'])
     draw_row("Otros Ingresos (+)", closure_data['total_incomes'])
     draw_row("Gastos/Salidas (-)", closure_data['total_expenses'])
-    
-    y -= 2 * mm
+
+    layout.y -= 2 * mm
     c.setFont("Helvetica-Bold", 10)
-    c.drawString(3 * mm, y, "TOTAL EN CAJA:")
-    c.drawRightString(width - 3 * mm, y, f"${closure_data['final_balance']:,.2f}")
-    y -= 5 * mm
+    c.drawString(3 * mm, layout.y, "TOTAL EN CAJA:")
+    c.drawRightString(width - 3 * mm, layout.y, f"${closure_data['final_balance']:,.2f}")
+    layout.y -= 5 * mm
 
     draw_line()
 
     # --- DETALLES ---
-    
-    if closure_data['sales_list']:
-        draw_paragraph("<b>DETALLE VENTAS EFECTIVO</b>", style_bold)
-        y -= 2 * mm
-        for item in closure_data['sales_list']:
-            draw_detail_row(item)
-        y -= 2 * mm
-
-    if closure_data['expenses_list']:
-        draw_paragraph("<b>DETALLE GASTOS / SALIDAS</b>", style_bold)
-        y -= 2 * mm
-        for item in closure_data['expenses_list']:
-            draw_detail_row(item)
-        y -= 2 * mm
-
-    if closure_data['incomes_list']:
-        draw_paragraph("<b>OTROS INGRESOS</b>", style_bold)
-        y -= 2 * mm
-        for item in closure_data['incomes_list']:
+    sections = [
+        ("DETALLE VENTAS EFECTIVO", closure_data['sales_list']),
+        ("DETALLE GASTOS / SALIDAS", closure_data['expenses_list']),
+        ("OTROS INGRESOS", closure_data['incomes_list']),
+    ]
+    for title, items in sections:
+        if not items:
+            continue
+        layout.paragraph(f"<b>{title}</b>", style_bold)
+        layout.y -= 2 * mm
+        for item in items:
             draw_detail_row(item)
-        y -= 2 * mm
+        layout.y -= 2 * mm
 
     draw_line()
-    
+
     # Firmas
-    y -= 15 * mm
-    c.line(10 * mm, y, width - 10 * mm, y)
-    draw_paragraph("Firma Responsable", style_centered)
+    layout.y -= 15 * mm
+    layout.signature_line(inset=10 * mm)
+    layout.paragraph("Firma Responsable", style_centered)
 
-    c.showPage()
-    c.save()
-    buffer.seek(0)
-    return buffer
+    return layout.finish()
 # --- FIN DE NUESTRO CÓDIGO ---
 
 # --- INICIO: Generador de Reporte Histórico de Ventas ---
-def generate_sales_history_pdf(sales_data: list, company_settings: schemas.CompanySettings, filters: dict):
-    buffer = BytesIO()
-    # Formato A4 Vertical
-    c = canvas.Canvas(buffer, pagesize=(210 * mm, 297 * mm))
+# El reporte puede tener miles de ventas: las filas llegan de a una (cursor del
+# servidor), cada página se cierra con showPage() y el PDF se escribe en un
+# archivo temporal que solo pasa a disco si supera SALES_REPORT_SPOOL_MB.
+SALES_REPORT_SPOOL_BYTES = int(os.getenv("SALES_REPORT_SPOOL_MB", "8")) * 1024 * 1024
+
+
+def _draw_sales_table_header(c, y):
+    c.setFont("Helvetica-Bold", 8)
+    c.drawString(15 * mm, y, "ID")
+    c.drawString(30 * mm, y, "FECHA")
+    c.drawString(60 * mm, y, "CLIENTE")
+    c.drawString(110 * mm, y, "VENDEDOR")
+    c.drawString(150 * mm, y, "MÉTODO")
+    c.drawRightString(195 * mm, y, "TOTAL")
+    y -= 2 * mm
+    c.line(15 * mm, y, 195 * mm, y)
+    y -= 5 * mm
+    c.setFont("Helvetica", 8)
+    return y
+
+
+def generate_sales_history_pdf(rows, company_settings: schemas.CompanySettings, filters: dict, totals: dict):
+    """
+    'rows': iterador de filas livianas (crud.sales_report_query).
+    'totals': totales calculados en SQL (crud.get_sales_report_totals).
+    Devuelve un archivo temporal abierto y posicionado al inicio.
+    """
+    output = tempfile.SpooledTemporaryFile(max_size=SALES_REPORT_SPOOL_BYTES)
+    # Formato A4 Vertical (páginas comprimidas: el documento se arma en memoria hasta el save)
     width, height = 210 * mm, 297 * mm
-    styles = getSampleStyleSheet()
-    
+    c = canvas.Canvas(output, pagesize=(width, height), pageCompression=1)
+
+    rows = iter(rows)
+    first_row = next(rows, None)
+
     y = height - 20 * mm
 
     # Cabecera
@@ -824,104 +781,59 @@ def generate_sales_history_pdf(sales_data: list, company_settings: schemas.Compa
     c.setFont("Helvetica-Bold", 12)
     c.drawCentredString(width / 2, y, "REPORTE HISTÓRICO DE VENTAS")
     y -= 6 * mm
-    
+
     # Filtros aplicados
     c.setFont("Helvetica", 9)
-    
+
     # --- LÓGICA PARA MOSTRAR SUCURSAL ---
     loc_display = "TODAS LAS SUCURSALES" # Por defecto
-    
+
     if filters.get('location_id'):
-        # Si se filtró por ID, intentamos sacar el nombre real de los datos
-        if sales_data and hasattr(sales_data[0], 'location') and sales_data[0].location:
-            loc_display = f"SUCURSAL: {sales_data[0].location.name.upper()}"
+        # Si se filtró por ID, sacamos el nombre real de la primera fila
+        if first_row is not None and first_row.location_name:
+            loc_display = f"SUCURSAL: {first_row.location_name.upper()}"
         else:
             # Si no hay datos para sacar el nombre, ponemos un genérico claro
             loc_display = "SUCURSAL SELECCIONADA"
 
     filter_text = f"Desde: {filters.get('start_date', 'Inicio')}  |  Hasta: {filters.get('end_date', 'Hoy')}  |  {loc_display}"
-    
+
     if filters.get('search'): filter_text += f"  |  Búsqueda: {filters['search']}"
-    
+
     c.drawCentredString(width / 2, y, filter_text)
     y -= 10 * mm
 
     # Tabla Header
-    c.setFont("Helvetica-Bold", 8)
-    c.drawString(15 * mm, y, "ID")
-    c.drawString(30 * mm, y, "FECHA")
-    c.drawString(60 * mm, y, "CLIENTE")
-    c.drawString(110 * mm, y, "VENDEDOR")
-    c.drawString(150 * mm, y, "MÉTODO")
-    c.drawRightString(195 * mm, y, "TOTAL")
-    y -= 2 * mm
-    c.line(15 * mm, y, 195 * mm, y)
-    y -= 5 * mm
-
-    total_sum = 0.0
-    # --- ACUMULADORES PARA DESGLOSE ---
-    total_cash = 0.0
-    total_transfer = 0.0
-    total_card = 0.0
-    total_others = 0.0
-    # ----------------------------------
+    y = _draw_sales_table_header(c, y)
 
     # Cuerpo
-    c.setFont("Helvetica", 8)
-    for sale in sales_data:
-        # --- LÓGICA DE SUMA INTELIGENTE ---
-        # 1. Si tiene detalles JSON (Venta Mixta o Nueva)
-        if sale.payment_method_details:
-            details_list = sale.payment_method_details if isinstance(sale.payment_method_details, list) else []
-            # Si es dict, lo convertimos a lista ficticia
-            if isinstance(sale.payment_method_details, dict):
-                 # Soporte legacy simple
-                 details_list = [{"method": sale.payment_method, "amount": sale.total_amount}]
-
-            for p in details_list:
-                m = p.get("method", "OTROS")
-                amt = float(p.get("amount", 0))
-                
-                if m == "EFECTIVO": total_cash += amt
-                elif m == "TRANSFERENCIA": total_transfer += amt
-                elif m == "TARJETA": total_card += amt
-                else: total_others += amt
-        
-        # 2. Si es venta antigua simple
-        else:
-            if sale.payment_method == "EFECTIVO": total_cash += sale.total_amount
-            elif sale.payment_method == "TRANSFERENCIA": total_transfer += sale.total_amount
-            elif sale.payment_method == "TARJETA": total_card += sale.total_amount
-            else: total_others += sale.total_amount
-        # ----------------------------------
+    for sale in itertools.chain([first_row] if first_row is not None else [], rows):
         if y < 20 * mm: # Nueva página si se acaba el espacio
             c.showPage()
-            y = height - 20 * mm
-            c.setFont("Helvetica", 8)
+            y = _draw_sales_table_header(c, height - 20 * mm)
 
         # Formato fecha
         date_str = sale.created_at.strftime("%d/%m/%Y %H:%M")
-        
+
         # --- DIBUJAR FILA PRINCIPAL ---
         c.drawString(15 * mm, y, str(sale.id))
         c.drawString(30 * mm, y, date_str)
         c.drawString(60 * mm, y, sale.customer_name[:25])
-        c.drawString(110 * mm, y, sale.user.email[:20])
-        
+        c.drawString(110 * mm, y, sale.user_email[:20])
+
         # Método de pago (Primera línea)
         method_str = sale.payment_method.replace("_", " ")
         c.drawString(150 * mm, y, method_str)
-        
+
         c.drawRightString(195 * mm, y, f"${sale.total_amount:.2f}")
-        
-        total_sum += sale.total_amount
+
         y -= 4 * mm # Bajamos un poco para ver si hay detalles
 
         # --- DIBUJAR DETALLES DE PAGO (REFERENCIAS) ---
         # Si es MIXTO, TRANSFERENCIA o TARJETA y tiene detalles guardados
         if sale.payment_method_details:
             details = sale.payment_method_details
-            
+
             # Caso 1: Es una lista de pagos (Estructura nueva del PaymentModal)
             if isinstance(details, list):
                 c.setFont("Helvetica", 6) # Letra pequeña para el detalle
@@ -945,49 +857,59 @@ def generate_sales_history_pdf(sales_data: list, company_settings: schemas.Compa
         # Espacio final entre filas (si no hubo detalles, el 'y' bajó 4mm, si hubo, bajó más)
         # Ajustamos para asegurar separación uniforme
         y -= 2 * mm
+
     # --- CUADRO DE RESUMEN FINAL ---
+    # Necesita ~45mm: si no entra, va en una página nueva
+    if y < 55 * mm:
+        c.showPage()
+        y = height - 20 * mm
     y -= 5 * mm
     c.line(15 * mm, y, 195 * mm, y)
     y -= 5 * mm
 
     # Dibujamos el resumen a la derecha, alineado con la columna de montos
     left_margin_summary = 130 * mm
-    
+
     c.setFont("Helvetica", 9)
-    
+
+    # Cantidad de ventas
+    c.drawString(left_margin_summary, y, "Cantidad de Ventas:")
+    c.drawRightString(195 * mm, y, str(totals["count"]))
+    y -= 4 * mm
+
     # Efectivo
     c.drawString(left_margin_summary, y, "Total Efectivo:")
-    c.drawRightString(195 * mm, y, f"${total_cash:.2f}")
+    c.drawRightString(195 * mm, y, f"${totals['cash']:.2f}")
     y -= 4 * mm
-    
+
     # Transferencia
     c.drawString(left_margin_summary, y, "Total Transferencia:")
-    c.drawRightString(195 * mm, y, f"${total_transfer:.2f}")
+    c.drawRightString(195 * mm, y, f"${totals['transfer']:.2f}")
     y -= 4 * mm
 
     # Tarjeta (solo si hay)
-    if total_card > 0:
+    if totals["card"] > 0:
         c.drawString(left_margin_summary, y, "Total Tarjeta:")
-        c.drawRightString(195 * mm, y, f"${total_card:.2f}")
+        c.drawRightString(195 * mm, y, f"${totals['card']:.2f}")
         y -= 4 * mm
 
     # Otros (solo si hay)
-    if total_others > 0:
+    if totals["others"] > 0:
         c.drawString(left_margin_summary, y, "Otros / Notas Crédito:")
-        c.drawRightString(195 * mm, y, f"${total_others:.2f}")
+        c.drawRightString(195 * mm, y, f"${totals['others']:.2f}")
         y -= 4 * mm
 
     c.line(left_margin_summary, y, 195 * mm, y) # Línea pequeña de suma
     y -= 5 * mm
-    
+
     c.setFont("Helvetica-Bold", 11)
     c.drawString(left_margin_summary, y, "TOTAL GENERAL:")
-    c.drawRightString(195 * mm, y, f"${total_sum:.2f}")
+    c.drawRightString(195 * mm, y, f"${totals['total']:.2f}")
 
     c.showPage()
     c.save()
-    buffer.seek(0)
-    return buffer
+    output.seek(0)
+    return output
 # --- FIN DE NUESTRO CÓDIGO ---
 
 # --- INICIO: Generador de Manifiesto de Envío (Formato Térmico) ---
@@ -995,116 +917,92 @@ def generate_transfer_manifest_pdf(transfer: schemas.TransferRead, company_setti
     """
     Genera un MANIFIESTO DE CARGA en formato térmico (58mm).
     """
-    buffer = BytesIO()
     # Calculamos altura dinámica
     base_height = 180 * mm
     extra_height = len(transfer.items) * 10 * mm
-    width, height = 58 * mm, base_height + extra_height 
-    
-    c = canvas.Canvas(buffer, pagesize=(width, height))
-    styles = getSampleStyleSheet()
-
-    # Estilos (reutilizamos la lógica visual de los otros recibos)
-    style_title = ParagraphStyle(name='title', parent=styles['Normal'], alignment=TA_CENTER, fontName='Helvetica-Bold', fontSize=10, leading=12)
-    style_centered = ParagraphStyle(name='centered', parent=styles['Normal'], alignment=TA_CENTER, fontSize=8, leading=10)
-    style_normal = ParagraphStyle(name='normal', parent=styles['Normal'], fontSize=7, leading=9)
-    style_bold = ParagraphStyle(name='bold', parent=styles['Normal'], fontName='Helvetica-Bold', fontSize=8, leading=10)
-
-    y = height - (5 * mm)
-
-    def draw_paragraph(text, style):
-        nonlocal y
-        p = Paragraph(text, style)
-        w, h = p.wrap(width - 6*mm, height)
-        p.drawOn(c, 3*mm, y - h)
-        y -= h + (1.5 * mm)
+    layout = ThermalLayout(height=base_height + extra_height, margin=3 * mm, gap=1.5 * mm)
+    c, width = layout.c, layout.width
+
+    # Estilos (los mismos de los otros recibos)
+    style_title, style_centered = STYLES["title_lg"], STYLES["centered_md"]
+    style_normal, style_bold = STYLES["normal_sm"], STYLES["bold"]
 
     def draw_line():
-        nonlocal y
-        y -= 1 * mm
-        c.setLineWidth(0.5)
-        c.setDash(1, 2)
-        c.line(2 * mm, y, width - (2 * mm), y)
-        c.setDash([])
-        y -= 2 * mm
+        layout.separator(before=1 * mm, after=2 * mm)
 
     # --- CONTENIDO ---
 
     # Cabecera Empresa
-    draw_paragraph(company_settings.name.upper(), style_title)
-    draw_paragraph(f"RUC: {company_settings.ruc}", style_centered)
-    
-    y -= 2 * mm
-    draw_paragraph("MANIFIESTO DE CARGA", style_title)
-    draw_paragraph("(Guía Interna)", style_centered)
+    layout.paragraph(company_settings.name.upper(), style_title)
+    layout.paragraph(f"RUC: {company_settings.ruc}", style_centered)
+
+    layout.y -= 2 * mm
+    layout.paragraph("MANIFIESTO DE CARGA", style_title)
+    layout.paragraph("(Guía Interna)", style_centered)
 
     # Datos del Envío
-    draw_paragraph(f"<b>N° Guía:</b> {transfer.id}", style_centered)
-    
+    layout.paragraph(f"<b>N° Guía:</b> {transfer.id}", style_centered)
+
     # Formatear fecha
     if isinstance(transfer.created_at, str):
          # Si pydantic lo serializó a string, lo usamos directo o lo parseamos
-         date_str = transfer.created_at.split('T')[0] 
+         date_str = transfer.created_at.split('T')[0]
     else:
          date_str = transfer.created_at.strftime("%d/%m/%Y %H:%M")
 
-    draw_paragraph(f"<b>Fecha:</b> {date_str}", style_centered)
-    
+    layout.paragraph(f"<b>Fecha:</b> {date_str}", style_centered)
+
     draw_line()
 
     # Logística
-    draw_paragraph("<b>ORIGEN (Remitente):</b>", style_bold)
-    draw_paragraph(f"{transfer.source_location_name}", style_normal)
-    draw_paragraph(f"Resp: {transfer.created_by_name}", style_normal)
-    
-    y -= 2 * mm
-    
-    draw_paragraph("<b>DESTINO (Receptor):</b>", style_bold)
-    draw_paragraph(f"{transfer.destination_location_name}", style_normal)
-    
+    layout.paragraph("<b>ORIGEN (Remitente):</b>", style_bold)
+    layout.paragraph(f"{transfer.source_location_name}", style_normal)
+    layout.paragraph(f"Resp: {transfer.created_by_name}", style_normal)
+
+    layout.y -= 2 * mm
+
+    layout.paragraph("<b>DESTINO (Receptor):</b>", style_bold)
+    layout.paragraph(f"{transfer.destination_location_name}", style_normal)
+
     if transfer.note:
-        draw_paragraph(f"Nota: {transfer.note}", style_normal)
+        layout.paragraph(f"Nota: {transfer.note}", style_normal)
 
     draw_line()
 
     # Detalle de Items
-    draw_paragraph("<b>DETALLE DE LA CARGA</b>", style_bold)
-    y -= 1 * mm
-    
+    layout.paragraph("<b>DETALLE DE LA CARGA</b>", style_bold)
+    layout.y -= 1 * mm
+
     # Encabezados tabla pequeña
     c.setFont("Helvetica-Bold", 7)
-    c.drawString(3*mm, y, "CANT")
-    c.drawString(15*mm, y, "DESCRIPCIÓN")
-    y -= 3 * mm
+    c.drawString(3*mm, layout.y, "CANT")
+    c.drawString(15*mm, layout.y, "DESCRIPCIÓN")
+    layout.y -= 3 * mm
 
     for item in transfer.items:
         # Cantidad
         c.setFont("Helvetica-Bold", 8)
-        c.drawString(3*mm, y, str(item.quantity))
-        
+        c.drawString(3*mm, layout.y, str(item.quantity))
+
         # Descripción (con wrap manual simple)
         c.setFont("Helvetica", 7)
         desc = item.product_name[:25] # Cortamos si es muy largo para una línea
-        c.drawString(15*mm, y, desc)
-        
+        c.drawString(15*mm, layout.y, desc)
+
         # Casilla de verificación visual
-        c.rect(width - 8*mm, y, 4*mm, 4*mm)
-        
-        y -= 5 * mm
+        c.rect(width - 8*mm, layout.y, 4*mm, 4*mm)
+
+        layout.y -= 5 * mm
 
     draw_line()
-    
+
     # Firmas
-    y -= 10 * mm
-    c.line(10 * mm, y, width - 10 * mm, y)
-    draw_paragraph("Firma Despacho", style_centered)
+    layout.y -= 10 * mm
+    layout.signature_line(inset=10 * mm)
+    layout.paragraph("Firma Despacho", style_centered)
 
-    y -= 10 * mm
-    c.line(10 * mm, y, width - 10 * mm, y)
-    draw_paragraph("Firma Recepción", style_centered)
+    layout.y -= 10 * mm
+    layout.signature_line(inset=10 * mm)
+    layout.paragraph("Firma Recepción", style_centered)
 
-    c.showPage()
-    c.save()
-    buffer.seek(0)
-    return buffer
-# --- FIN DE NUESTRO CÓDIGO ---
\ No newline at end of file
+    return layout.finish()
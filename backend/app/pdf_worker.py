@@ -0,0 +1,268 @@
+import multiprocessing
+import os
+import queue
+import tempfile
+import threading
+import time
+from io import BytesIO
+
+from . import pdf_utils
+
+# ===================================================================
+# --- SERVICIO DE PDFs (POOLS DE PROCESOS) ---
+# ===================================================================
+# ReportLab es Python puro: mientras arma un PDF tiene el GIL y frena a todos
+# los hilos del worker de uvicorn (ventas, POS, de todas las empresas).
+# Aquí los PDFs se dibujan en procesos aparte, en DOS pools separados:
+# - "documents": recibos, órdenes, retiros, notas de crédito, cierres...
+#   (rápidos, PDF_WORKERS procesos).
+# - "reports": el historial de ventas (puede tener miles de filas,
+#   PDF_REPORT_WORKERS procesos). Así dos reportes grandes nunca dejan sin
+#   procesos a los recibos.
+# En cada pool:
+# - Como mucho max_pending trabajos a la vez (esperando + dibujándose);
+#   si no hay lugar en el tiempo máximo del pool, se rechaza (503).
+# - Cada trabajo tiene su tiempo máximo (contando la espera). Si se pasa, el
+#   proceso que lo dibujaba se TERMINA y se reemplaza por uno nuevo: no se
+#   queda ocupando su lugar.
+# - Los endpoints son síncronos (corren en el threadpool): esperar el
+#   resultado no tiene el GIL, así que las demás peticiones siguen fluyendo.
+# Los argumentos viajan por pickle: hay que pasar schemas/dicts, no objetos ORM.
+
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", "2"))
+PDF_MAX_PENDING = int(os.getenv("PDF_MAX_PENDING", "16"))
+PDF_RENDER_TIMEOUT = float(os.getenv("PDF_RENDER_TIMEOUT_SECONDS", "30"))
+# El historial de ventas puede tener miles de filas
+PDF_REPORT_WORKERS = int(os.getenv("PDF_REPORT_WORKERS", "1"))
+PDF_REPORT_MAX_PENDING = int(os.getenv("PDF_REPORT_MAX_PENDING", "4"))
+PDF_REPORT_TIMEOUT = float(os.getenv("PDF_REPORT_TIMEOUT_SECONDS", "120"))
+
+# "spawn": los hijos no heredan conexiones a BD ni hilos del proceso padre
+_mp = multiprocessing.get_context("spawn")
+
+
+# --- Lado del proceso hijo ---
+def _worker_main(conn):
+    """Bucle del proceso hijo: recibe (función, args), devuelve (ok, resultado o error)."""
+    while True:
+        try:
+            fn, args = conn.recv()
+        except (EOFError, OSError):
+            return  # El padre cerró la conexión
+        try:
+            conn.send((True, fn(*args)))
+        except Exception as e:
+            conn.send((False, f"{type(e).__name__}: {e}"))
+
+
+def _render_job(generator_name: str, args: tuple):
+    """Llama a pdf_utils.<generator_name>(*args). Devuelve (bytes del PDF, ms)."""
+    start = time.perf_counter()
+    buffer = getattr(pdf_utils, generator_name)(*args)
+    return buffer.getvalue(), (time.perf_counter() - start) * 1000
+
+
+def _sales_history_job(path: str, user_id: int, params: dict, company_settings, filters: dict):
+    """
+    Reporte histórico completo dentro del hijo: abre su propia sesión, lee con
+    cursor y deja el PDF en 'path' (puede ser grande para el pipe).
+    Devuelve (path, ms).
+    """
+    import shutil
+    from . import crud, database, export_service, models
+
+    start = time.perf_counter()
+    params = dict(params)
+    db = database.open_report_session(params.pop("max_lag_seconds", None))
+    try:
+        user = db.get(models.User, user_id)
+        query = crud.sales_report_query(db, user=user, **params)
+        totals = crud.get_sales_report_totals(db, query)
+        pdf_file = pdf_utils.generate_sales_history_pdf(
+            export_service.iter_sales_report_rows(query), company_settings, filters, totals
+        )
+    finally:
+        db.close()
+
+    with pdf_file, open(path, "wb") as out:
+        shutil.copyfileobj(pdf_file, out)
+    return path, (time.perf_counter() - start) * 1000
+
+
+# --- Lado del proceso principal ---
+class _WorkerProcess:
+    """Un proceso hijo con su tubería. Se puede terminar aunque esté a mitad de un PDF."""
+
+    def __init__(self):
+        self.conn, child_conn = _mp.Pipe()
+        self.process = _mp.Process(target=_worker_main, args=(child_conn,), daemon=True)
+        self.process.start()
+        child_conn.close()
+
+    def kill(self):
+        self.process.terminate()
+        self.process.join(timeout=1)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join(timeout=1)
+        self.conn.close()
+
+
+class _RenderPool:
+    """Pool acotado de procesos hijos, con su propia cola, tiempo máximo y métricas."""
+
+    def __init__(self, name: str, workers: int, max_pending: int, timeout: float):
+        self.name = name
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_pending)
+        # Procesos libres. None = lugar vacío: el proceso se crea al usarlo
+        self._idle = queue.Queue()
+        for _ in range(workers):
+            self._idle.put(None)
+        self._stats_lock = threading.Lock()
+        self._depth = 0
+        self._running = 0
+        self._stats = {
+            "submitted": 0,
+            "completed": 0,
+            "failed": 0,
+            "timeouts": 0,
+            "rejected": 0,
+            "recycled": 0,
+            "max_depth": 0,
+            "total_render_ms": 0.0,
+            "max_render_ms": 0.0,
+        }
+
+    def _count(self, key: str, amount: int = 1):
+        with self._stats_lock:
+            self._stats[key] += amount
+
+    def _checkout(self, deadline: float) -> _WorkerProcess:
+        try:
+            worker = self._idle.get(timeout=max(deadline - time.monotonic(), 0))
+        except queue.Empty:
+            self._count("timeouts")
+            raise TimeoutError("El PDF tardó demasiado en generarse. Intente de nuevo.")
+        if worker is not None and worker.process.is_alive():
+            return worker
+        try:
+            return _WorkerProcess()
+        except Exception:
+            self._idle.put(None)
+            raise
+
+    def _recycle(self, worker: _WorkerProcess):
+        worker.kill()
+        self._count("recycled")
+
+    def run(self, fn, *args, timeout: float | None = None):
+        """
+        Corre fn(*args) en un proceso del pool y devuelve su resultado.
+        Lanza TimeoutError si el pool está saturado o el trabajo se pasa de tiempo.
+        """
+        if not self._slots.acquire(timeout=self.timeout):
+            self._count("rejected")
+            raise TimeoutError("Hay demasiados PDFs en cola. Intente de nuevo en unos segundos.")
+        with self._stats_lock:
+            self._depth += 1
+            self._stats["submitted"] += 1
+            self._stats["max_depth"] = max(self._stats["max_depth"], self._depth)
+        try:
+            deadline = time.monotonic() + (timeout or self.timeout)
+            worker = self._checkout(deadline)
+            with self._stats_lock:
+                self._running += 1
+            try:
+                try:
+                    worker.conn.send((fn, args))
+                    finished = worker.conn.poll(max(deadline - time.monotonic(), 0))
+                    if finished:
+                        ok, payload = worker.conn.recv()
+                except (EOFError, OSError):
+                    # El proceso hijo murió (memoria, señal...): lo reemplazamos
+                    self._recycle(worker)
+                    worker = None
+                    self._count("failed")
+                    raise RuntimeError("El proceso de PDFs terminó inesperadamente.")
+                if not finished:
+                    # Se pasó de tiempo: matamos el proceso para que no siga ocupando su lugar
+                    self._recycle(worker)
+                    worker = None
+                    self._count("timeouts")
+                    raise TimeoutError("El PDF tardó demasiado en generarse. Intente de nuevo.")
+            finally:
+                with self._stats_lock:
+                    self._running -= 1
+                self._idle.put(worker)
+        finally:
+            with self._stats_lock:
+                self._depth -= 1
+            self._slots.release()
+
+        if not ok:
+            self._count("failed")
+            raise RuntimeError(payload)
+        result, render_ms = payload
+        with self._stats_lock:
+            self._stats["completed"] += 1
+            self._stats["total_render_ms"] += render_ms
+            self._stats["max_render_ms"] = max(self._stats["max_render_ms"], render_ms)
+        return result
+
+    def get_stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+            running, depth = self._running, self._depth
+        completed = stats.pop("completed")
+        total_render_ms = stats.pop("total_render_ms")
+        return {
+            "config": {
+                "workers": self.workers,
+                "max_pending": self.max_pending,
+                "timeout_s": self.timeout,
+            },
+            "queued": depth - running,
+            "running": running,
+            **stats,
+            "completed": completed,
+            "avg_render_ms": round(total_render_ms / completed, 3) if completed else 0.0,
+            "max_render_ms": round(stats["max_render_ms"], 3),
+        }
+
+
+_documents = _RenderPool("documents", PDF_WORKERS, PDF_MAX_PENDING, PDF_RENDER_TIMEOUT)
+_reports = _RenderPool("reports", PDF_REPORT_WORKERS, PDF_REPORT_MAX_PENDING, PDF_REPORT_TIMEOUT)
+
+
+def render(generator_name: str, *args, timeout: float | None = None) -> BytesIO:
+    """
+    Dibuja pdf_utils.<generator_name>(*args) en el pool de documentos y devuelve el BytesIO.
+    Lanza TimeoutError si el pool está saturado o el trabajo se pasa de tiempo.
+    """
+    return BytesIO(_documents.run(_render_job, generator_name, args, timeout=timeout))
+
+
+def render_sales_history(user_id: int, params: dict, company_settings, filters: dict):
+    """
+    Reporte histórico de ventas en el pool de reportes. Devuelve el archivo
+    abierto (ya borrado del disco: se libera al cerrarlo).
+    """
+    fd, path = tempfile.mkstemp(prefix="reporte_ventas_", suffix=".pdf")
+    os.close(fd)
+    try:
+        _reports.run(_sales_history_job, path, user_id, params, company_settings, filters)
+        return open(path, "rb")
+    finally:
+        # Abierto o no (error, tiempo agotado), el archivo ya no hace falta en disco
+        os.remove(path)
+
+
+def get_pdf_worker_stats():
+    """Profundidad de la cola y tiempos de render de cada pool (por proceso de uvicorn)."""
+    return {
+        "documents": _documents.get_stats(),
+        "reports": _reports.get_stats(),
+    }
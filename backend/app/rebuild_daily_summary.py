@@ -0,0 +1,23 @@
+# backend/app/rebuild_daily_summary.py
+# Reconstruye la tabla daily_location_summary (dashboard) desde el historial.
+# Uso:
+#   python -m app.rebuild_daily_summary          -> todas las sucursales
+#   python -m app.rebuild_daily_summary 3        -> solo la sucursal #3
+import sys
+from app import crud, database
+
+def rebuild(location_id: int | None = None):
+    db = database.SessionLocal()
+    try:
+        scope = f"sucursal #{location_id}" if location_id else "todas las sucursales"
+        print(f"--- RECONSTRUYENDO RESUMEN DIARIO ({scope}) ---")
+        rows = crud.rebuild_daily_location_summary(db, location_id=location_id)
+        print(f"✅ Listo: {rows} días/sucursal en el resumen.")
+    except Exception as e:
+        print(f"❌ Error reconstruyendo el resumen: {e}")
+        db.rollback()
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    rebuild(int(sys.argv[1]) if len(sys.argv) > 1 else None)
@@ -1,4 +1,4 @@
-from pydantic import BaseModel, computed_field, field_validator
+from pydantic import BaseModel, Field, computed_field, field_validator
 from typing import List, Dict, Any, Optional
 from datetime import datetime, date
 
@@ -139,6 +139,9 @@ class ProductBase(BaseModel):
     
 class ProductImageBase(BaseModel):
     image_url: str
+    thumbnail_url: str | None = None
+    medium_url: str | None = None
+    status: str | None = None # PROCESANDO mientras el worker genera las variantes
 
 class ProductImageCreate(ProductImageBase):
     pass
@@ -218,6 +221,9 @@ class WorkOrderBase(BaseModel):
 
 class WorkOrderImageBase(BaseModel):
     image_url: str
+    thumbnail_url: str | None = None
+    medium_url: str | None = None
+    status: str | None = None # PROCESANDO mientras el worker genera las variantes
     tag: str
 
 class WorkOrderImage(WorkOrderImageBase):
@@ -538,6 +544,21 @@ class InventoryMovement(InventoryMovementBase):
     class Config:
         from_attributes = True
 
+# --- KARDEX (AUDITORÍA): fila plana, sin objetos anidados ---
+# Sale directo de una proyección SQL (no se hidratan Product/Location/User).
+class KardexMovement(InventoryMovementBase):
+    id: int
+    timestamp: datetime
+    product_id: int
+    sku: str
+    product_name: str
+    location_id: int
+    location_name: str
+    user_id: int
+    user_email: str
+    class Config:
+        from_attributes = True
+
 class LostSaleLog(LostSaleLogBase):
     id: int
     timestamp: datetime
@@ -698,6 +719,8 @@ class CashAccount(CashAccountBase):
 class CashTransaction(CashTransactionBase):
     id: int
     timestamp: datetime
+    transaction_type: str = "MANUAL"
+    sale_id: int | None = None
     user: UserSimple
     account: CashAccountSimple # <-- CORRECCIÓN FINAL
     class Config:
@@ -1017,6 +1040,32 @@ class TransferRead(BaseModel):
     class Config:
         from_attributes = True
 
+# ===================================================================
+# --- SCHEMAS PARA REENVÍO MASIVO AL SRI ---
+# ===================================================================
+# Estados que NO son error: ya enviadas, en cola o simples notas de venta.
+# Reenviarlas cambiaría la clave de acceso de una factura ya autorizada
+# (o mandaría dos veces una que otro worker está procesando).
+SRI_OK_STATUSES = ["RECIBIDA", "AUTORIZADO", "NONE", "PENDIENTE"]
+
+class SriResubmitRequest(BaseModel):
+    start_date: date | None = None
+    end_date: date | None = None
+    location_id: int | None = None
+    # Si no se indica, se toman todos los estados de error (DEVUELTA, ERROR_CONEXION, ...)
+    statuses: List[str] | None = None
+    limit: int = Field(500, gt=0, le=5000)
+    max_workers: int = Field(4, gt=0, le=16)
+
+    @field_validator('statuses')
+    @classmethod
+    def validate_statuses(cls, v: List[str] | None) -> List[str] | None:
+        if v:
+            not_allowed = [status for status in v if status in SRI_OK_STATUSES]
+            if not_allowed:
+                raise ValueError(f"Solo se pueden reenviar facturas con error. Estados no permitidos: {', '.join(not_allowed)}")
+        return v
+
 # ===================================================================
 # --- RECONSTRUCCIÓN DE MODELOS ---
 # ===================================================================
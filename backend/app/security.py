@@ -1,6 +1,9 @@
 # EN backend/app/security.py
 
 import os
+import threading
+import time
+from collections import namedtuple
 from typing import List
 from datetime import datetime, timedelta, timezone
 
@@ -12,7 +15,7 @@ from sqlalchemy.orm import Session
 
 
 # Importamos las herramientas que necesitamos
-from . import crud, schemas
+from . import crud, schemas, models
 from .database import get_db
 
 # --- Configuración de Seguridad ---
@@ -37,9 +40,10 @@ def create_access_token(data: dict):
     """
     to_encode = data.copy()
     
-    # 1. Definimos cuándo caduca la llave
-    expire = datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
+    # 1. Definimos cuándo se emitió y cuándo caduca la llave
+    now = datetime.now(timezone.utc)
+    expire = now + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    to_encode.update({"exp": expire, "iat": now})
     
     # 2. Convertimos todo a texto si es necesario (seguridad extra)
     # Por ejemplo, aseguramos que company_id sea un número o string válido
@@ -53,6 +57,114 @@ def create_access_token(data: dict):
 # --- EL VIGILANTE Y SU CONFIGURACIÓN ---
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+# ===================================================================
+# --- CACHÉ DE USUARIOS AUTENTICADOS (PRINCIPAL) ---
+# ===================================================================
+# Cada petición pasaba por get_user_by_email + la carga de user.company.
+# Guardamos lo que el vigilante necesita (id, rol, empresa, activo, módulos)
+# por (email, fecha de emisión del token) durante unos segundos.
+# Se invalida desde crud al bloquear usuarios/empresas o cambiar módulos.
+# Con varios workers de uvicorn cada proceso tiene su copia: el TTL corto
+# acota cuánto puede tardar en notarse un cambio hecho en otro proceso.
+PRINCIPAL_CACHE_TTL_SECONDS = int(os.getenv("PRINCIPAL_CACHE_TTL", "30"))
+PRINCIPAL_CACHE_MAX_ENTRIES = 10000
+
+Principal = namedtuple("Principal", [
+    "id", "email", "role", "is_active",
+    "company_id", "company_name", "company_active", "modules"
+])
+
+_principal_cache = {}   # (email, iat) -> (Principal, cargado_en)
+_principal_lock = threading.Lock()
+_principal_stats = {"hits": 0, "misses": 0}
+
+def _principal_from_user(user) -> Principal:
+    company = user.company if user.company_id else None
+    return Principal(
+        id=user.id,
+        email=user.email,
+        role=user.role,
+        is_active=getattr(user, "is_active", True),
+        company_id=user.company_id,
+        company_name=company.name if company else None,
+        company_active=company.is_active if company else True,
+        modules=dict(company.modules) if (company and isinstance(company.modules, dict)) else None
+    )
+
+def _get_cached_principal(key):
+    with _principal_lock:
+        entry = _principal_cache.get(key)
+        if entry and time.monotonic() - entry[1] < PRINCIPAL_CACHE_TTL_SECONDS:
+            _principal_stats["hits"] += 1
+            return entry[0]
+        _principal_stats["misses"] += 1
+        return None
+
+def _store_principal(key, principal: Principal):
+    now = time.monotonic()
+    with _principal_lock:
+        if len(_principal_cache) >= PRINCIPAL_CACHE_MAX_ENTRIES:
+            # Limpieza: primero los vencidos; si sigue lleno, empezamos de cero
+            for old_key in [k for k, (_, loaded_at) in _principal_cache.items() if now - loaded_at >= PRINCIPAL_CACHE_TTL_SECONDS]:
+                del _principal_cache[old_key]
+            if len(_principal_cache) >= PRINCIPAL_CACHE_MAX_ENTRIES:
+                _principal_cache.clear()
+        _principal_cache[key] = (principal, now)
+
+def invalidate_principal_cache(user_id: int | None = None, company_id: int | None = None):
+    """
+    Olvida los usuarios cacheados.
+    - user_id: solo ese usuario.
+    - company_id: todos los usuarios de esa empresa.
+    - Sin argumentos: todo.
+    """
+    with _principal_lock:
+        if user_id is None and company_id is None:
+            _principal_cache.clear()
+            return
+        for key in [k for k, (p, _) in _principal_cache.items()
+                    if (user_id is not None and p.id == user_id) or (company_id is not None and p.company_id == company_id)]:
+            del _principal_cache[key]
+
+def get_principal_cache_stats():
+    """Métricas de la caché (para el panel de Super Admin)."""
+    with _principal_lock:
+        return {
+            "entries": len(_principal_cache),
+            "ttl_seconds": PRINCIPAL_CACHE_TTL_SECONDS,
+            **_principal_stats
+        }
+
+class CurrentUser:
+    """
+    Lo que reciben los endpoints como 'current_user'.
+    id, email, role, company_id, is_active y modules salen de la caché (sin consultas).
+    Cualquier otro atributo (hashed_pin, full_name, company...) carga el usuario
+    real de la BD la primera vez que se pide.
+    """
+    def __init__(self, principal: Principal, db: Session, user=None):
+        self.id = principal.id
+        self.email = principal.email
+        self.role = principal.role
+        self.is_active = principal.is_active
+        self.company_id = principal.company_id
+        self.modules = principal.modules
+        self._db = db
+        self._user = user
+
+    @property
+    def orm(self):
+        """El objeto models.User completo (se carga una sola vez)."""
+        if self._user is None:
+            self._user = self._db.get(models.User, self.id)
+        return self._user
+
+    def __getattr__(self, name):
+        # Solo se llama si el atributo NO está en la caché
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self.orm, name)
+
 def get_current_user(db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)):
     # Error estándar para intrusos
     credentials_exception = HTTPException(
@@ -75,12 +187,19 @@ def get_current_user(db: Session = Depends(get_db), token: str = Depends(oauth2_
         # Si la firma es falsa o expiró, lanzamos alerta
         raise credentials_exception
 
-    # 4. Buscamos al dueño en el registro real (Base de Datos)
-    user = crud.get_user_by_email(db, email=email)
-    if user is None:
-        raise credentials_exception
+    # 4. Buscamos al dueño: primero en la caché, si no en el registro real (Base de Datos)
+    #    (Los tokens antiguos no traen 'iat': usamos 'exp', que también es único por emisión)
+    cache_key = (email, payload.get("iat") or payload.get("exp"))
+    principal = _get_cached_principal(cache_key)
+    user = None
+    if principal is None:
+        user = crud.get_user_by_email(db, email=email)
+        if user is None:
+            raise credentials_exception
+        principal = _principal_from_user(user)
+        _store_principal(cache_key, principal)
 
-    if not getattr(user, "is_active", True):
+    if not principal.is_active:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="El usuario está deshabilitado"
@@ -88,16 +207,15 @@ def get_current_user(db: Session = Depends(get_db), token: str = Depends(oauth2_
 
     # --- NUEVO: Validar si la Empresa está activa (SaaS) ---
     # Si el usuario pertenece a una empresa, y esa empresa está desactivada (ej. falta de pago)
-    # SQLAlchemy carga user.company automáticamente cuando lo pedimos aquí.
-    if user.company_id and user.company and not user.company.is_active:
+    if principal.company_id and not principal.company_active:
          raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
-            detail=f"La empresa '{user.company.name}' está desactivada. Contacte a soporte."
+            detail=f"La empresa '{principal.company_name}' está desactivada. Contacte a soporte."
         )
     # ------------------------------------------------------
 
-    # Devolvemos el usuario completo obtenido de la base de datos
-    return user
+    # Devolvemos el usuario (datos cacheados; el resto se carga solo si se pide)
+    return CurrentUser(principal, db, user=user)
 
 # --- REQUIRE ROLE
 
@@ -132,15 +250,15 @@ def require_module(module_name: str):
             return
 
         # 2. Si el usuario no tiene empresa (raro), no pasa
-        if not current_user.company:
+        if not current_user.company_id:
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail="Usuario no asociado a ninguna empresa."
             )
 
-        # 3. Revisamos los permisos en el cajón 'modules'
+        # 3. Revisamos los permisos en el cajón 'modules' (viene de la caché)
         # modules es un Diccionario (JSON). Ej: {"pos": False, "inventory": True}
-        modules_config = current_user.company.modules
+        modules_config = current_user.modules
 
         # Si la configuración existe y el módulo específico está explícitamente en FALSE...
         if modules_config and isinstance(modules_config, dict):
@@ -1,9 +1,14 @@
 import datetime
 import os
 import base64
+import hashlib
+import tempfile
+import threading
 import requests
+from requests.adapters import HTTPAdapter
 from lxml import etree
 from zeep import Client
+from zeep.cache import SqliteCache
 from zeep.transports import Transport
 from cryptography.hazmat.primitives.serialization import pkcs12
 from cryptography.hazmat.primitives import hashes
@@ -14,6 +19,92 @@ from cryptography import x509
 # --- HERRAMIENTAS TÉCNICAS PARA FACTURACIÓN ELECTRÓNICA ECUADOR ---
 # ===================================================================
 
+URL_RECEPCION = {
+    "1": "https://celcer.sri.gob.ec/comprobantes-electronicos-ws/RecepcionComprobantesOffline?wsdl",
+    "2": "https://cel.sri.gob.ec/comprobantes-electronicos-ws/RecepcionComprobantesOffline?wsdl"
+}
+
+URL_AUTORIZACION = {
+    "1": "https://celcer.sri.gob.ec/comprobantes-electronicos-ws/AutorizacionComprobantesOffline?wsdl",
+    "2": "https://cel.sri.gob.ec/comprobantes-electronicos-ws/AutorizacionComprobantesOffline?wsdl"
+}
+
+# --- REGISTRO DE CLIENTES SOAP (uno por servicio y ambiente, por proceso) ---
+# Crear un zeep.Client descarga y parsea el WSDL: lo hacemos UNA vez y lo reutilizamos.
+# El WSDL además queda en un caché SQLite local para que un proceso nuevo no lo baje otra vez.
+SRI_TIMEOUT_SECONDS = int(os.getenv("SRI_TIMEOUT", "10"))
+SRI_WSDL_CACHE_PATH = os.getenv("SRI_WSDL_CACHE", os.path.join(tempfile.gettempdir(), "sri_wsdl_cache.db"))
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+def _build_transport():
+    """Transporte con una sesión HTTP compartida (conexiones keep-alive reutilizables)."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=1)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return Transport(
+        session=session,
+        timeout=SRI_TIMEOUT_SECONDS,
+        operation_timeout=SRI_TIMEOUT_SECONDS,
+        cache=SqliteCache(path=SRI_WSDL_CACHE_PATH, timeout=60 * 60 * 24)
+    )
+
+def get_sri_client(servicio, ambiente="1"):
+    """
+    Devuelve el cliente SOAP del SRI ('recepcion' o 'autorizacion') para el ambiente dado.
+    Se crea la primera vez y luego se reutiliza.
+    """
+    key = (servicio, ambiente)
+    client = _clients.get(key)
+    if client:
+        return client
+
+    with _clients_lock:
+        client = _clients.get(key)
+        if not client:
+            urls = URL_RECEPCION if servicio == "recepcion" else URL_AUTORIZACION
+            client = Client(urls[ambiente], transport=_build_transport())
+            _clients[key] = client
+        return client
+
+# --- CACHÉ DE FIRMAS (.p12) ---
+# Clave: ruta del archivo (una por empresa: /code/signatures/<company_id>/firma.p12),
+# fecha de modificación y huella de la contraseña. Si suben una firma nueva,
+# cambia el mtime y se vuelve a leer.
+_credentials = {}
+_credentials_lock = threading.Lock()
+
+def cargar_credenciales(archivo_p12_path, password_p12):
+    """Devuelve (private_key, certificate) leyendo el .p12 solo si cambió."""
+    mtime = os.stat(archivo_p12_path).st_mtime_ns
+    password_hash = hashlib.sha256((password_p12 or "").encode()).hexdigest()
+    key = (archivo_p12_path, mtime, password_hash)
+
+    with _credentials_lock:
+        cached = _credentials.get(key)
+    if cached:
+        return cached
+
+    with open(archivo_p12_path, "rb") as f:
+        p12_data = f.read()
+
+    # Validar contraseña cargando la llave
+    private_key, certificate, additional_certs = pkcs12.load_key_and_certificates(
+        p12_data,
+        password_p12.encode() if password_p12 else None
+    )
+
+    with _credentials_lock:
+        # Quitamos versiones viejas de la misma firma
+        for old_key in [k for k in _credentials if k[0] == archivo_p12_path]:
+            del _credentials[old_key]
+        _credentials[key] = (private_key, certificate)
+
+    print(f"✅ Firma cargada exitosamente para: {certificate.subject}")
+    return private_key, certificate
+
 def generar_digito_verificador(clave_acceso_48):
     """
     Aplica el algoritmo 'Módulo 11' que exige el SRI para el último dígito.
@@ -120,16 +211,8 @@ def firmar_xml(xml_string, archivo_p12_path, password_p12):
         raise ValueError(f"No se encontró el archivo de firma electrónica en: {archivo_p12_path}")
 
     try:
-        with open(archivo_p12_path, "rb") as f:
-            p12_data = f.read()
-        
-        # Validar contraseña cargando la llave
-        private_key, certificate, additional_certs = pkcs12.load_key_and_certificates(
-            p12_data, 
-            password_p12.encode() if password_p12 else None
-        )
-        
-        print(f"✅ Firma cargada exitosamente para: {certificate.subject}")
+        # Llave y certificado desde la caché (solo se lee el .p12 si cambió)
+        private_key, certificate = cargar_credenciales(archivo_p12_path, password_p12)
         
         # NOTA: En un entorno de producción real de Python, firmar XAdES-BES completo 
         # requiere librerías complejas como 'signxml' o 'xmlsec'. 
@@ -148,15 +231,9 @@ def enviar_comprobante_sri(xml_firmado, ambiente="1"):
     """
     Llama al Web Service del SRI.
     """
-    URL_RECEPCION = {
-        "1": "https://celcer.sri.gob.ec/comprobantes-electronicos-ws/RecepcionComprobantesOffline?wsdl",
-        "2": "https://cel.sri.gob.ec/comprobantes-electronicos-ws/RecepcionComprobantesOffline?wsdl"
-    }
-    
     try:
-        # Configurar transporte
-        transport = Transport(timeout=10)
-        client = Client(URL_RECEPCION[ambiente], transport=transport)
+        # Cliente compartido (WSDL ya parseado)
+        client = get_sri_client("recepcion", ambiente)
 
         # Convertir a Base64
         xml_64 = base64.b64encode(xml_firmado).decode("utf-8")
@@ -183,4 +260,44 @@ def enviar_comprobante_sri(xml_firmado, ambiente="1"):
         return {
             "status": "ERROR_CONEXION",
             "mensaje": f"No se pudo contactar al SRI: {str(e)}"
-        }
\ No newline at end of file
+        }
+
+def consultar_autorizacion_sri(clave_acceso, ambiente="1"):
+    """
+    Pregunta al SRI si un comprobante ya RECIBIDO fue autorizado.
+    Devuelve status: AUTORIZADO, NO AUTORIZADO, EN PROCESO o ERROR_CONEXION.
+    """
+    try:
+        client = get_sri_client("autorizacion", ambiente)
+
+        respuesta = client.service.autorizacionComprobante(clave_acceso)
+
+        # Si el SRI todavía no lo procesa, no devuelve autorizaciones
+        autorizaciones = respuesta.autorizaciones.autorizacion if respuesta.autorizaciones else []
+        if not autorizaciones:
+            return {"status": "EN PROCESO", "mensaje": "El SRI aún no procesa el comprobante."}
+
+        autorizacion = autorizaciones[0]
+        if autorizacion.estado == "AUTORIZADO":
+            return {
+                "status": "AUTORIZADO",
+                "mensaje": "Comprobante autorizado por el SRI.",
+                "fecha": autorizacion.fechaAutorizacion
+            }
+
+        errores = []
+        if autorizacion.mensajes:
+            for err in autorizacion.mensajes.mensaje:
+                errores.append(f"{err.identificador}: {err.mensaje}")
+        return {
+            "status": "NO AUTORIZADO",
+            "mensaje": "El SRI no autorizó el comprobante.",
+            "detalles": errores
+        }
+
+    except Exception as e:
+        print(f"❌ Error de conexión con SRI (autorización): {e}")
+        return {
+            "status": "ERROR_CONEXION",
+            "mensaje": f"No se pudo contactar al SRI: {str(e)}"
+        }
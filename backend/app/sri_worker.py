@@ -0,0 +1,310 @@
+import os
+import random
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+
+import pytz
+from sqlalchemy.sql import or_
+
+from . import models, crud, sri_utils
+from .database import SessionLocal
+
+# ===================================================================
+# --- WORKERS DE FACTURACIÓN ELECTRÓNICA (COLA SRI) ---
+# ===================================================================
+# create_sale solo encola (tabla sri_invoice_jobs). Aquí un pool de hilos toma
+# los encargos pendientes y hace el trabajo lento: generar XML, firmar, enviar
+# al SRI y consultar la autorización, con reintentos y espera exponencial.
+# Los encargos se reservan con FOR UPDATE SKIP LOCKED, así que varios procesos
+# (workers de uvicorn) pueden correr esto a la vez sin pisarse.
+
+SRI_WORKERS = int(os.getenv("SRI_WORKERS", "4"))
+SRI_BATCH_SIZE = int(os.getenv("SRI_BATCH_SIZE", "20"))
+SRI_MAX_ATTEMPTS = int(os.getenv("SRI_MAX_ATTEMPTS", "8"))
+SRI_BACKOFF_BASE_SECONDS = 30
+SRI_BACKOFF_MAX_SECONDS = 3600
+SRI_AUTH_POLL_SECONDS = 10      # Espera entre "RECIBIDA" y la consulta de autorización
+SRI_STALE_LOCK_MINUTES = 10     # Si un worker murió a mitad, liberamos su encargo
+SRI_BULK_MAX_WORKERS = int(os.getenv("SRI_BULK_MAX_WORKERS", "8")) # Tope para reenvíos masivos
+# Respuestas de recepción que significan "ese comprobante ya lo tengo":
+# 43 = CLAVE ACCESO REGISTRADA, 70 = CLAVE DE ACCESO EN PROCESAMIENTO
+SRI_ALREADY_RECEIVED_CODES = {"43", "70"}
+
+_executor = ThreadPoolExecutor(max_workers=SRI_WORKERS, thread_name_prefix="sri-worker")
+
+
+def _now():
+    return datetime.now(pytz.utc)
+
+
+def _backoff(attempts: int) -> timedelta:
+    """30s, 60s, 120s... hasta 1 hora."""
+    seconds = min(SRI_BACKOFF_BASE_SECONDS * (2 ** max(attempts - 1, 0)), SRI_BACKOFF_MAX_SECONDS)
+    return timedelta(seconds=seconds)
+
+
+def claim_jobs(db, limit: int = SRI_BATCH_SIZE) -> list[int]:
+    """
+    Reserva hasta 'limit' encargos listos para procesar y los marca PROCESANDO.
+    Devuelve sus IDs.
+    """
+    now = _now()
+    stale_before = now - timedelta(minutes=SRI_STALE_LOCK_MINUTES)
+
+    jobs = db.query(models.SriInvoiceJob).filter(
+        or_(
+            (models.SriInvoiceJob.status == "PENDIENTE") & (models.SriInvoiceJob.next_attempt_at <= now),
+            (models.SriInvoiceJob.status == "PROCESANDO") & (models.SriInvoiceJob.locked_at < stale_before)
+        )
+    ).order_by(models.SriInvoiceJob.next_attempt_at)\
+     .limit(limit)\
+     .with_for_update(skip_locked=True).all()
+
+    for job in jobs:
+        job.status = "PROCESANDO"
+        job.locked_at = now
+    db.commit()
+    return [job.id for job in jobs]
+
+
+def _clave_de_acceso(db, sale, sri_config: dict) -> tuple[str, datetime]:
+    """
+    La clave de acceso se genera UNA sola vez y se guarda en la venta antes de
+    enviar: los reintentos reenvían el mismo comprobante (misma clave, misma
+    fecha de emisión, que va en los primeros 8 dígitos de la clave).
+    Solo se genera otra si cambió el RUC, el ambiente o la serie configurados.
+    """
+    secuencial = str(sale.id).zfill(9)
+    serie = f"{sri_config['establishment']}{sri_config['emission_point']}"
+    clave = sale.sri_access_key
+    # Clave: fecha(8) + tipo(2) + ruc(13) + ambiente(1) + serie(6) + secuencial(9) + ...
+    if not clave or clave[10:39] != f"{sri_config['ruc']}{sri_config['env']}{serie}{secuencial}":
+        clave = sri_utils.generar_clave_acceso(
+            fecha=datetime.now(),
+            tipo_comprobante="01", # 01 = Factura
+            ruc=sri_config["ruc"],
+            ambiente=sri_config["env"],
+            serie=serie,
+            numero=secuencial,
+            codigo_numerico=str(random.randint(10000000, 99999999))
+        )
+        sale.sri_access_key = clave
+        db.commit() # Si el worker muere enviando, el reintento encuentra esta misma clave
+    return clave, datetime.strptime(clave[:8], "%d%m%Y")
+
+
+def _emitir_factura(db, sale, sri_config: dict, company_settings) -> dict:
+    """Arma el XML con la clave de acceso de la venta, lo firma y lo envía al SRI."""
+    venta_data = {
+        "cliente_nombre": sale.customer_name,
+        "cliente_id": sale.customer_ci,
+        "cliente_email": sale.customer_email or "consumidor@final.com",
+        "cliente_direccion": sale.customer_address or "Ciudad",
+        "subtotal": sale.subtotal_amount,
+        "total": sale.total_amount,
+        "items": [
+            {"nombre": item.description, "cantidad": item.quantity, "precio": item.unit_price}
+            for item in sale.items
+        ]
+    }
+
+    # Usamos el ID de la venta como secuencial simple (relleno a 9 dígitos)
+    secuencial = str(sale.id).zfill(9)
+    clave_acceso, fecha_emision = _clave_de_acceso(db, sale, sri_config)
+
+    config = dict(sri_config)
+    config.update({
+        "razon_social": company_settings.name,
+        "direccion": company_settings.address or "Matriz",
+        "clave_acceso": clave_acceso,
+        "secuencial": secuencial,
+        "fecha_emision": fecha_emision.strftime("%d/%m/%Y")
+    })
+
+    xml_raw = sri_utils.crear_xml_factura(venta_data, config)
+    xml_signed = sri_utils.firmar_xml(xml_raw, sri_config["signature_path"], sri_config["password"])
+    return sri_utils.enviar_comprobante_sri(xml_signed, ambiente=sri_config["env"])
+
+
+def _mensaje(respuesta: dict) -> str:
+    detalles = respuesta.get("detalles", [])
+    return " | ".join(detalles) if detalles else respuesta.get("mensaje")
+
+
+def _ya_recibida(respuesta: dict) -> bool:
+    """DEVUELTA solo porque el SRI ya tiene esa clave (un intento anterior sí llegó)."""
+    detalles = respuesta.get("detalles", [])
+    return bool(detalles) and all(d.split(":", 1)[0].strip() in SRI_ALREADY_RECEIVED_CODES for d in detalles)
+
+
+def _finish(job, status: str, error: str | None = None):
+    job.status = status
+    job.locked_at = None
+    job.last_error = error
+
+
+def _retry_later(job, sale, error: str, delay: timedelta | None = None):
+    """Vuelve a dejar el encargo en la cola, o lo da por fallido si ya agotó intentos."""
+    if job.attempts >= SRI_MAX_ATTEMPTS:
+        _finish(job, "FALLIDA", error)
+        if sale.sri_auth_status != "RECIBIDA":
+            sale.sri_auth_status = "ERROR_CONEXION"
+        sale.sri_error_message = error
+        return
+    job.status = "PENDIENTE"
+    job.locked_at = None
+    job.last_error = error
+    job.next_attempt_at = _now() + (delay or _backoff(job.attempts))
+
+
+def process_job(job_id: int) -> dict:
+    """
+    Procesa UN encargo (en su propia sesión de BD).
+    - Si la venta ya tiene clave de acceso: consultar autorización primero.
+    - Si el SRI no la tiene (o aún no hay clave): generar, firmar y enviar.
+    Devuelve {"sale_id", "status", "message", "action"} para reportes de progreso.
+    'action': "ENVIADA" (el SRI recibió el XML), "CONSULTADA" (solo se preguntó
+    por la autorización) o None (no se llegó al SRI).
+    """
+    db = SessionLocal()
+    try:
+        job = db.query(models.SriInvoiceJob).get(job_id)
+        if not job:
+            return {"sale_id": None, "status": "DESCONOCIDO", "message": f"Encargo {job_id} no existe.", "action": None}
+        sale = job.sale
+        job.attempts += 1
+
+        sri_config = crud.get_sri_config(db, sale.company_id)
+        if not sri_config:
+            _finish(job, "FALLIDA", "Sin firma electrónica configurada.")
+            sale.sri_auth_status = "ERROR_CONFIG"
+            sale.sri_error_message = "La empresa no tiene configurada la firma electrónica."
+            db.commit()
+            return {"sale_id": sale.id, "status": sale.sri_auth_status, "message": sale.sri_error_message, "action": None}
+
+        action = None
+        try:
+            # Si ya hay clave, un intento anterior pudo haber llegado al SRI aunque no
+            # nos enteráramos (timeout, worker caído): primero preguntamos por ella.
+            respuesta = None
+            if sale.sri_access_key:
+                respuesta = sri_utils.consultar_autorizacion_sri(sale.sri_access_key, ambiente=sri_config["env"])
+                if respuesta["status"] == "EN PROCESO" and sale.sri_auth_status != "RECIBIDA":
+                    respuesta = None # El SRI no la tiene: hay que enviarla (con la misma clave)
+
+            if respuesta is not None:
+                # --- PASO 2: ¿Ya está autorizada? ---
+                if respuesta["status"] != "ERROR_CONEXION":
+                    action = "CONSULTADA"
+                if respuesta["status"] == "AUTORIZADO":
+                    sale.sri_auth_status = "AUTORIZADO"
+                    sale.sri_auth_date = respuesta.get("fecha") or _now()
+                    sale.sri_error_message = None
+                    _finish(job, "COMPLETADA")
+                elif respuesta["status"] == "NO AUTORIZADO":
+                    sale.sri_auth_status = "NO AUTORIZADO"
+                    sale.sri_error_message = _mensaje(respuesta)
+                    _finish(job, "FALLIDA", sale.sri_error_message)
+                else:
+                    # EN PROCESO o sin conexión: volvemos a preguntar luego
+                    _retry_later(job, sale, _mensaje(respuesta))
+            else:
+                # --- PASO 1: Generar -> Firmar -> Enviar ---
+                company_settings = crud.get_company_settings(db, sale.company_id)
+                respuesta = _emitir_factura(db, sale, sri_config, company_settings)
+                if respuesta["status"] in ("RECIBIDA", "DEVUELTA"):
+                    action = "ENVIADA"
+
+                if respuesta["status"] == "RECIBIDA" or (respuesta["status"] == "DEVUELTA" and _ya_recibida(respuesta)):
+                    sale.sri_auth_status = "RECIBIDA"
+                    sale.sri_auth_date = _now()
+                    sale.sri_error_message = None
+                    # Siguiente paso: consultar autorización en unos segundos
+                    job.attempts -= 1
+                    _retry_later(job, sale, None, delay=timedelta(seconds=SRI_AUTH_POLL_SECONDS))
+                elif respuesta["status"] == "DEVUELTA":
+                    # Error en los datos del comprobante: reintentar no lo arregla
+                    sale.sri_auth_status = "DEVUELTA"
+                    sale.sri_error_message = _mensaje(respuesta)
+                    _finish(job, "FALLIDA", sale.sri_error_message)
+                else:
+                    _retry_later(job, sale, _mensaje(respuesta))
+
+        except ValueError as e:
+            # Firma corrupta / contraseña mala: no tiene sentido reintentar
+            _finish(job, "FALLIDA", str(e))
+            sale.sri_auth_status = "ERROR_INTERNO"
+            sale.sri_error_message = str(e)
+        except Exception as e:
+            print(f"❌ [SRI] Error procesando venta #{sale.id}: {e}")
+            _retry_later(job, sale, f"Error Crítico: {str(e)}")
+
+        db.commit()
+        return {"sale_id": sale.id, "status": sale.sri_auth_status, "message": sale.sri_error_message, "action": action}
+
+    except Exception as e:
+        db.rollback()
+        print(f"❌ [SRI] Error en encargo {job_id}: {e}")
+        return {"sale_id": None, "status": "ERROR_INTERNO", "message": str(e), "action": None}
+    finally:
+        db.close()
+
+
+def run_pending_jobs():
+    """
+    Tarea periódica (APScheduler): reserva un lote y lo reparte en el pool.
+    Espera a que termine el lote antes de salir para no solaparse.
+    """
+    db = SessionLocal()
+    try:
+        job_ids = claim_jobs(db)
+    except Exception as e:
+        db.rollback()
+        print(f"❌ [SRI] No se pudo leer la cola: {e}")
+        return
+    finally:
+        db.close()
+
+    if not job_ids:
+        return
+
+    print(f"🔄 [SRI] Procesando {len(job_ids)} facturas en cola...")
+    for result in _executor.map(process_job, job_ids):
+        print(f"   ↳ Venta #{result['sale_id']}: {result['status']}")
+
+
+# ===================================================================
+# --- REENVÍO MASIVO (después de una caída del SRI) ---
+# ===================================================================
+
+def claim_jobs_for_sales(db, sale_ids: list[int]) -> list[int]:
+    """
+    Reserva los encargos PENDIENTES de estas ventas (los que otro worker
+    ya tomó se saltan) y los marca PROCESANDO. Devuelve los IDs de encargo.
+    """
+    if not sale_ids:
+        return []
+    jobs = db.query(models.SriInvoiceJob).filter(
+        models.SriInvoiceJob.sale_id.in_(sale_ids),
+        models.SriInvoiceJob.status == "PENDIENTE"
+    ).order_by(models.SriInvoiceJob.sale_id)\
+     .with_for_update(skip_locked=True).all()
+
+    now = _now()
+    for job in jobs:
+        job.status = "PROCESANDO"
+        job.locked_at = now
+    db.commit()
+    return [job.id for job in jobs]
+
+
+def process_jobs_streaming(job_ids: list[int], max_workers: int = SRI_WORKERS):
+    """
+    Procesa los encargos con un pool acotado y va devolviendo (yield)
+    el resultado de cada factura apenas termina.
+    """
+    max_workers = max(1, min(max_workers, SRI_BULK_MAX_WORKERS))
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="sri-bulk") as pool:
+        futures = [pool.submit(process_job, job_id) for job_id in job_ids]
+        for future in as_completed(futures):
+            yield future.result()
@@ -0,0 +1,52 @@
+# backend/app/utils/cursor.py
+import base64
+import json
+from datetime import datetime
+
+from sqlalchemy import tuple_
+
+# ===================================================================
+# --- PAGINACIÓN POR CURSOR (KEYSET) ---
+# ===================================================================
+# Con offset, la página 500 obliga a Postgres a leer y descartar las 49.900
+# filas anteriores, y si entra una venta nueva mientras paginamos se repiten
+# o se saltan filas. Con cursor guardamos los valores de orden de la última
+# fila entregada (ej: created_at + id) y pedimos "las que vienen después".
+# El cursor es opaco para el frontend: base64 de una lista JSON.
+
+def encode_cursor(*values) -> str:
+    payload = [v.isoformat() if isinstance(v, datetime) else v for v in values]
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str, columns) -> list:
+    """Devuelve los valores del cursor ya convertidos al tipo de cada columna. ValueError si no es válido."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if not isinstance(values, list) or len(values) != len(columns):
+            raise ValueError
+        return [
+            datetime.fromisoformat(v) if col.type.python_type is datetime else col.type.python_type(v)
+            for v, col in zip(values, columns)
+        ]
+    except Exception:
+        raise ValueError("Cursor de paginación inválido.")
+
+def apply_keyset(query, columns, cursor: str | None = None, descending: bool = True):
+    """
+    Ordena por 'columns' (la última debe ser única, ej: id) y, si hay cursor,
+    filtra las filas que van DESPUÉS de él. El límite lo pone quien llama.
+    """
+    if cursor:
+        values = decode_cursor(cursor, columns)
+        key = tuple_(*columns)
+        query = query.filter(key < tuple_(*values) if descending else key > tuple_(*values))
+    return query.order_by(*[col.desc() if descending else col.asc() for col in columns])
+
+def next_cursor(rows: list, limit: int, columns) -> str | None:
+    """Cursor de la siguiente página (None si esta página no vino llena)."""
+    if not rows or len(rows) < limit:
+        return None
+    last = rows[-1]
+    return encode_cursor(*[getattr(last, col.key) for col in columns])
@@ -773,7 +773,11 @@ function ProductForm({ productToEdit, onSave, onClose }) {
                             className="relative group aspect-square bg-white rounded-xl shadow-sm border border-gray-200 overflow-hidden cursor-pointer hover:shadow-md transition-all"
                             onClick={() => setViewImage(image)} // <--- ABRIR VISOR AL HACER CLICK
                         >
-                            <img src={`${import.meta.env.VITE_API_URL || "http://localhost:8000"}${image.image_url}`} alt="Prod" className="w-full h-full object-cover" />
+                            {image.status === "PROCESANDO" ? (
+                                <div className="w-full h-full flex items-center justify-center text-[9px] font-bold text-gray-400 uppercase animate-pulse">Procesando...</div>
+                            ) : (
+                                <img src={`${import.meta.env.VITE_API_URL || "http://localhost:8000"}${image.thumbnail_url || image.image_url}`} alt="Prod" className="w-full h-full object-cover" />
+                            )}
                             {/* Botón Borrar con stopPropagation para no abrir el visor al borrar */}
                             <button 
                                 type="button" 
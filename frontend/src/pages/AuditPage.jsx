@@ -6,6 +6,8 @@ function AuditPage() {
   const [users, setUsers] = useState([]);
   const [filters, setFilters] = useState({ start_date: '', end_date: '', user_id: '' });
   const [loading, setLoading] = useState(false);
+  const [nextCursor, setNextCursor] = useState(null); // Siguiente página del Kardex
+  const [isExporting, setIsExporting] = useState(false);
 
   // Cargar la lista de usuarios para el filtro
   useEffect(() => {
@@ -16,25 +18,55 @@ function AuditPage() {
     setFilters({ ...filters, [e.target.name]: e.target.value });
   };
 
-  const handleSearch = async () => {
+  // --- LÓGICA DE LIMPIEZA DE FILTROS ---
+  const buildParams = () => {
+    const params = {};
+    if (filters.start_date) params.start_date = filters.start_date;
+    if (filters.end_date) params.end_date = filters.end_date;
+    if (filters.user_id) params.user_id = filters.user_id;
+    return params;
+  };
+  // --- FIN DE LA LÓGICA ---
+
+  // append = true -> "Cargar más" (siguiente página por cursor)
+  const handleSearch = async (append = false) => {
     setLoading(true);
-try {
-      // --- LÓGICA DE LIMPIEZA DE FILTROS ---
-      const params = {};
-      if (filters.start_date) params.start_date = filters.start_date;
-      if (filters.end_date) params.end_date = filters.end_date;
-      if (filters.user_id) params.user_id = filters.user_id;
-      // --- FIN DE LA LÓGICA ---
+    try {
+      const params = buildParams();
+      if (append && nextCursor) params.cursor = nextCursor;
 
-      // Pasamos los filtros limpios a la petición
       const response = await api.get('/reports/inventory-audit', { params });
-      setMovements(response.data);
+      setMovements(prev => append ? [...prev, ...response.data] : response.data);
+      setNextCursor(response.headers['x-next-cursor'] || null);
     } catch (error) {
       alert('Error al cargar el reporte.');
     } finally {
       setLoading(false);
     }
   };
+
+  // Descarga el Kardex COMPLETO con los mismos filtros (CSV en streaming)
+  const handleExport = async () => {
+    setIsExporting(true);
+    try {
+      const response = await api.get('/reports/inventory-audit/export', {
+        params: { ...buildParams(), format: 'csv' },
+        responseType: 'blob'
+      });
+      const url = window.URL.createObjectURL(response.data);
+      const link = document.createElement('a');
+      link.href = url;
+      link.setAttribute('download', `Kardex_${new Date().toISOString().slice(0, 10)}.csv`);
+      document.body.appendChild(link);
+      link.click();
+      link.remove();
+      window.URL.revokeObjectURL(url);
+    } catch (error) {
+      alert('Error al exportar el Kardex.');
+    } finally {
+      setIsExporting(false);
+    }
+  };
   const formatDate = (dateString) => {
     const options = { year: 'numeric', month: 'short', day: 'numeric', hour: '2-digit', minute: '2-digit' };
     return new Date(dateString).toLocaleDateString('es-EC', options);
@@ -61,9 +93,12 @@ try {
             {users.map(user => <option key={user.id} value={user.id}>{user.email}</option>)}
           </select>
         </div>
-        <button onClick={handleSearch} disabled={loading} className="py-2 px-6 bg-accent text-white font-bold rounded-lg hover:bg-teal-600 disabled:bg-gray-400">
+        <button onClick={() => handleSearch(false)} disabled={loading} className="py-2 px-6 bg-accent text-white font-bold rounded-lg hover:bg-teal-600 disabled:bg-gray-400">
           {loading ? 'Buscando...' : 'Buscar'}
         </button>
+        <button onClick={handleExport} disabled={isExporting} className="py-2 px-6 bg-white border text-gray-700 font-bold rounded-lg hover:bg-gray-100 disabled:opacity-50">
+          {isExporting ? 'Exportando...' : 'Exportar CSV'}
+        </button>
       </div>
 
       {/* Tabla de Resultados */}
@@ -83,18 +118,26 @@ try {
             {movements.map((mov) => (
               <tr key={mov.id} className="border-b hover:bg-gray-50">
                 <td className="py-3 px-4">{formatDate(mov.timestamp)}</td>
-                <td className="py-3 px-4 font-semibold">{mov.product.name}</td>
-                <td className="py-3 px-4">{mov.location.name}</td>
+                <td className="py-3 px-4 font-semibold">{mov.product_name}</td>
+                <td className="py-3 px-4">{mov.location_name}</td>
                 <td className={`py-3 px-4 text-center font-bold ${mov.quantity_change > 0 ? 'text-green-600' : 'text-red-600'}`}>
                   {mov.quantity_change > 0 ? `+${mov.quantity_change}` : mov.quantity_change}
                 </td>
                 <td className="py-3 px-4">{mov.movement_type}</td>
-                <td className="py-3 px-4">{mov.user.email}</td>
+                <td className="py-3 px-4">{mov.user_email}</td>
               </tr>
             ))}
           </tbody>
         </table>
       </div>
+
+      {nextCursor && (
+        <div className="flex justify-center mt-4">
+          <button onClick={() => handleSearch(true)} disabled={loading} className="py-2 px-6 border rounded-lg text-gray-700 font-semibold hover:bg-gray-50 disabled:opacity-50">
+            {loading ? 'Cargando...' : 'Cargar más movimientos'}
+          </button>
+        </div>
+      )}
     </div>
   );
 }
@@ -173,7 +173,8 @@ const ExpensesPage = () => {
       await axios.post(`${API_URL}/expenses/`, {
         amount: parseFloat(amount),
         description,
-        expense_date: new Date(expenseDate).toISOString(),
+        // Mediodía LOCAL: así el gasto cae en el día elegido en Ecuador (no el día anterior en UTC)
+        expense_date: new Date(`${expenseDate}T12:00:00`).toISOString(),
         category_id: parseInt(selectedCategory),
         location_id: parseInt(locationIdToUse),
         account_id: parseInt(selectedAccount), // <--- NUEVO
@@ -669,7 +669,7 @@ ${publicLink}`;
                         {/* 1. Imagen Grande (Cuadrada) */}
                         <div className="aspect-square bg-gray-100 relative overflow-hidden">
                           <img
-                            src={`${import.meta.env.VITE_API_URL || "http://localhost:8000"}${product.images[0]?.image_url || "/placeholder.png"}`}
+                            src={`${import.meta.env.VITE_API_URL || "http://localhost:8000"}${product.images[0]?.thumbnail_url || product.images[0]?.image_url || "/placeholder.png"}`}
                             alt={product.name}
                             className="w-full h-full object-cover group-hover:scale-110 transition-transform duration-300"
                           />
@@ -367,7 +367,7 @@ function ProductPage() {
                     <img
                       src={
                         product.images[0]?.image_url
-                          ? `${import.meta.env.VITE_API_URL || "http://localhost:8000"}${product.images[0].image_url}`
+                          ? `${import.meta.env.VITE_API_URL || "http://localhost:8000"}${product.images[0].thumbnail_url || product.images[0].image_url}`
                           : "/vite.svg"
                       }
                       alt={product.name}
@@ -18,6 +18,8 @@ const getTodayString = () => {
 function SalesHistoryPage() {
   const [sales, setSales] = useState([]);
   const [loading, setLoading] = useState(true);
+  const [nextCursor, setNextCursor] = useState(null); // Cursor de la siguiente página (cabecera X-Next-Cursor)
+  const [loadingMore, setLoadingMore] = useState(false);
   const [error, setError] = useState("");
   const { user } = useContext(AuthContext);
   const [isPrintingId, setIsPrintingId] = useState(null);
@@ -107,18 +109,23 @@ function SalesHistoryPage() {
     }
   };
 
-  const fetchSales = async () => {
-    setLoading(true);
-    setError("");
-    const params = { skip: 0, limit: 100 };
+  const buildSalesParams = (cursor = null) => {
+    const params = { limit: 100 };
+    if (cursor) params.cursor = cursor;
     if (startDate) params.start_date = startDate;
     if (endDate) params.end_date = endDate;
     if (searchTerm) params.search = searchTerm;
     if (selectedLocationId) params.location_id = selectedLocationId;
+    return params;
+  };
 
+  const fetchSales = async () => {
+    setLoading(true);
+    setError("");
     try {
-      const response = await api.get("/sales/", { params });
+      const response = await api.get("/sales/", { params: buildSalesParams() });
       setSales(response.data);
+      setNextCursor(response.headers["x-next-cursor"] || null);
     } catch (err) {
       setError("No se pudo cargar el historial.");
     } finally {
@@ -126,6 +133,21 @@ function SalesHistoryPage() {
     }
   };
 
+  // Siguiente página por cursor: no se repiten ni se saltan ventas aunque entren nuevas
+  const fetchMoreSales = async () => {
+    if (!nextCursor) return;
+    setLoadingMore(true);
+    try {
+      const response = await api.get("/sales/", { params: buildSalesParams(nextCursor) });
+      setSales((prev) => [...prev, ...response.data]);
+      setNextCursor(response.headers["x-next-cursor"] || null);
+    } catch (err) {
+      setError("No se pudo cargar más ventas.");
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   // --- NUEVA FUNCIÓN IMPRIMIR ---
   const handlePrintReport = async () => {
     try {
@@ -278,12 +300,16 @@ ${publicLink}`;
   const [isRetrying, setIsRetrying] = useState(false);
 
   const handleRetrySri = async () => {
-    if (!window.confirm("¿Deseas intentar reenviar todas las facturas fallidas DE HOY al SRI?")) return;
+    if (!window.confirm("¿Deseas intentar reenviar todas las facturas fallidas DEL RANGO DE FECHAS seleccionado al SRI?")) return;
     
     setIsRetrying(true);
     try {
-      const { data } = await api.post('/sales/retry-sri-failures');
-      alert(`Proceso finalizado:\n✅ Enviadas: ${data.success}\n❌ Fallidas: ${data.failed}\n\nRevisa la tabla para ver detalles.`);
+      const params = {};
+      if (startDate) params.start_date = startDate;
+      if (endDate) params.end_date = endDate;
+      if (selectedLocationId) params.location_id = selectedLocationId;
+      const { data } = await api.post('/sales/retry-sri-failures', null, { params });
+      alert(`Facturas devueltas a la cola del SRI: ${data.success}\n\nSe enviarán en segundo plano. Revisa la tabla en unos minutos.`);
       fetchSales(); // Recargar tabla para ver los nuevos semáforos
     } catch (error) {
       console.error(error);
@@ -371,7 +397,7 @@ ${publicLink}`;
              onClick={handleRetrySri}
              disabled={isRetrying}
              className="py-2 px-4 bg-indigo-600 text-white font-bold rounded hover:bg-indigo-700 ml-auto flex items-center gap-2 shadow-sm"
-             title="Reintentar facturas fallidas de hoy"
+             title="Reintentar facturas fallidas del rango de fechas"
            >
              <HiOutlineCloudUpload className={`w-5 h-5 ${isRetrying ? 'animate-bounce' : ''}`} />
              {isRetrying ? "Procesando..." : "Reintentar SRI"}
@@ -458,6 +484,8 @@ ${publicLink}`;
                       return <span className="inline-flex items-center px-2 py-1 rounded-full text-xs font-bold bg-green-100 text-green-800" title="Factura Autorizada"><HiOutlineCheckCircle className="w-4 h-4 mr-1"/> OK</span>;
                     } else if (status === "NONE") {
                       return <span className="text-gray-400 text-xs">-</span>;
+                    } else if (status === "PENDIENTE") {
+                      return <span className="inline-flex items-center px-2 py-1 rounded-full text-xs font-bold bg-yellow-100 text-yellow-800" title="Factura en cola de envío al SRI">En cola</span>;
                     } else {
                       // Error o Devuelta
                       return (
@@ -508,6 +536,18 @@ ${publicLink}`;
         </table>
       </div>
 
+      {nextCursor && !loading && (
+        <div className="flex justify-center">
+          <button
+            onClick={fetchMoreSales}
+            disabled={loadingMore}
+            className="py-2 px-6 rounded-lg border bg-white text-gray-700 font-semibold hover:bg-gray-50 disabled:opacity-50"
+          >
+            {loadingMore ? "Cargando..." : "Cargar más ventas"}
+          </button>
+        </div>
+      )}
+
       {/* --- MODAL DE REEMBOLSO --- */}
       <ModalForm
         isOpen={refundModalOpen}